@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+# Background sensor acquisition.
+#
+# A read from the MAX31855 goes over (software) SPI and can be retried up to MAX_ATTEMPTS
+# times when it comes back NaN. Done inline, that holds up smoothing, printing and the
+# backup write that were due in the same pass. Here a dedicated thread does the reading
+# on its own schedule and drops each record into a ring buffer. The main loop drains the
+# buffer whenever it gets around to it, so the time stamps only depend on the reader.
+
+import threading
+
+from scheduler import Scheduler
+
+
+class RingBuffer(object):
+    """
+    Bounded single-producer/single-consumer queue of records.
+
+    No locks: the producer (the reader thread) is the only one that moves 'head' and the
+    consumer (the main loop) is the only one that moves 'tail'. Each slot is written before
+    'head' is advanced past it, and rebinding an attribute is atomic under the GIL, so the
+    consumer never sees a half-written slot.
+
+    When the buffer is full the newest record is dropped (and counted in 'overflows')
+    rather than overwriting one the consumer might be reading.
+
+    Parameters:
+        capacity: (int) maximum number of unread records
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1, got %r" % capacity)
+        self.capacity = capacity
+        self.slots = [None] * (capacity + 1)    # one slot always stays empty to tell full from empty
+        self.head = 0           # next slot to write (producer only)
+        self.tail = 0           # next slot to read (consumer only)
+        self.overflows = 0
+
+    def __len__(self):
+        return (self.head - self.tail) % len(self.slots)
+
+    def put(self, record):
+        """
+        Adds a record. Producer side only.
+
+        Returns:
+            (bool) False if the buffer was full and the record was dropped
+        """
+
+        nxt = (self.head + 1) % len(self.slots)
+        if nxt == self.tail:
+            self.overflows += 1
+            return False
+        self.slots[self.head] = record
+        self.head = nxt
+        return True
+
+    def drain(self):
+        """
+        Removes and returns every record currently in the buffer, oldest first. Consumer side only.
+
+        Returns:
+            (list) of records, possibly empty
+        """
+
+        head = self.head        # take one snapshot, anything written after this waits for the next drain
+        records = []
+        i = self.tail
+        while i != head:
+            records.append(self.slots[i])
+            self.slots[i] = None
+            i = (i + 1) % len(self.slots)
+        self.tail = head
+        return records
+
+
+class SensorReader(threading.Thread):
+    """
+    Thread that samples the sensor every 'freq' seconds into a RingBuffer.
+
+    Each record is an (elapsed, temp, temp_is_valid) tuple, where elapsed is measured on the
+    same timeline as the main loop (pass the main scheduler's t_initial to start_at()).
+
+    Parameters:
+        read: function called as read(elapsed) returning (temp, temp_is_valid),
+            ex: roast.get_valid_reading
+        freq: (float) seconds between readings
+        offset: (float) seconds from time zero until the first reading
+        capacity: (int) size of the ring buffer
+        scheduler: optional Scheduler to run the readings on (it supplies the clock)
+    """
+
+    def __init__(self, read, freq, offset=0, capacity=1024, scheduler=None):
+        threading.Thread.__init__(self, name='SensorReader')
+        self.daemon = True          # never keep the script alive after the main loop is done
+        self.read = read
+        self.buffer = RingBuffer(capacity)
+        self.sched = scheduler or Scheduler()
+        self.sched.add('READ', freq, offset, self.read_once)
+        self.error = None
+
+    def read_once(self, elapsed):
+        temp, temp_is_valid = self.read(elapsed)
+        self.buffer.put((elapsed, temp, temp_is_valid))
+
+    def start_at(self, t_initial):
+        """ Starts the thread with its time zero set to t_initial (a reading of the scheduler's clock).
+        """
+
+        self.sched.start(t_initial)
+        self.start()
+
+    def run(self):
+        if self.sched.t_initial is None:
+            self.sched.start()
+        try:
+            self.sched.run()
+        except Exception as e:
+            # hand the problem over to the main thread instead of dying silently
+            self.error = e
+
+    def stop(self, timeout=None):
+        """ Asks the thread to finish and waits for it (at most timeout seconds).
+        """
+
+        self.sched.stop()
+        if self.is_alive():
+            self.join(timeout)
+
+    def drain(self):
+        """
+        Returns every record collected since the last drain, oldest first.
+
+        Raises:
+            whatever exception stopped the reader thread, if it did stop
+        """
+
+        records = self.buffer.drain()
+        if self.error is not None and not records:
+            raise self.error
+        return records
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+# Live checking of the roast against the lower_bound/upper_bound envelope of a profile
+# (see profile_builder.py).
+#
+# The envelope is laid out ahead of time as two dense tables with one entry every 'step'
+# seconds, so checking a sample is an index calculation and two comparisons.
+# To keep a single noisy sample from setting off an alarm, the state only changes after
+# 'debounce' samples in a row agree on the new state.
+
+OK    = 'ok'
+OVER  = 'over'
+UNDER = 'under'
+
+
+class BoundsChecker(object):
+    """
+    Compares samples against a lower and an upper bound, and reports when the roast leaves
+    (or comes back into) the envelope.
+
+    Parameters:
+        lower, upper: array('d') of the same length, one entry every 'step' seconds from 0,
+            ex: from profile_compiler.py
+        step: (float) seconds between entries, ex: the SMOOTH_FREQ
+        debounce: (int) samples in a row needed to change state
+
+    Raises:
+        ValueError: if the tables are empty or don't match, or debounce < 1
+    """
+
+    def __init__(self, lower, upper, step=0.2, debounce=5):
+        if debounce < 1:
+            raise ValueError("debounce must be at least 1 sample, got %r" % debounce)
+        if not len(lower) or len(lower) != len(upper):
+            raise ValueError("the bound tables must be the same (non-zero) length (%i, %i)" % (len(lower), len(upper)))
+        self.step = float(step)
+        self.lower = lower
+        self.upper = upper
+        self.last = len(lower) - 1
+        self.debounce = debounce
+        self.state = OK
+        self.candidate = OK         # the state the recent samples point to
+        self.streak = 0             # how many samples in a row have pointed to it
+
+    def bounds_at(self, elapsed):
+        """ (lower, upper) of the entry closest to the elapsed time. After the end of the profile,
+        the last entries.
+        """
+
+        # rounded, not truncated: 0.6/0.2 is 2.9999999999999996
+        i = int(elapsed / self.step + 0.5)
+        if i > self.last:
+            i = self.last
+        elif i < 0:
+            i = 0
+        return self.lower[i], self.upper[i]
+
+    def update(self, elapsed, temp):
+        """
+        Checks one sample.
+
+        Parameters:
+            elapsed: (float) time in seconds since start
+            temp: (float) the (smoothed) temperature
+
+        Returns:
+            the new state (OK, OVER or UNDER) if it just changed, otherwise None
+
+        Raises:
+            None.
+        """
+
+        lower, upper = self.bounds_at(elapsed)
+        if temp > upper:
+            now = OVER
+        elif temp < lower:
+            now = UNDER
+        else:
+            now = OK
+
+        if now == self.state:
+            self.candidate = now
+            self.streak = 0
+            return None
+
+        if now == self.candidate:
+            self.streak += 1
+        else:
+            self.candidate = now
+            self.streak = 1
+
+        if self.streak >= self.debounce:
+            self.state = now
+            self.streak = 0
+            return now
+        return None
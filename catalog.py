@@ -0,0 +1,280 @@
+#!/usr/bin/python
+
+# A catalog of every roast file in the library, so you can find roasts without opening them.
+#
+# The catalog is a little sqlite file (catalog.sqlite). For every roast file it keeps the
+# metadata (bean, run, weights, loss, ...), how long the roast was, which series it has,
+# how many samples each one has, and when its milestones happened (see milestones.py).
+#
+# refresh() only re-reads files that are new or whose modification time or size changed,
+# and forgets files that are gone, so keeping it up to date is quick. The files are read by
+# a pool of worker processes.
+#
+# It reads every kind of roast file importer.py knows about (json batches and profiles, and
+# both kinds of csv), so the series names are the standard ones (temp_actual, temp_smooth, ...).
+#
+# Anything else (notes, spreadsheets, ...) is recorded with its error, so it isn't re-read
+# every time either.
+#
+# NOTE: percent_loss is stored the way roast.py computes it, (final-start)/start, so a 13.8%
+# loss is -13.8. find() takes losses as positive numbers.
+
+import multiprocessing
+import os
+import sqlite3
+import sys
+
+from importer import read_roast, roast_files
+from milestones import roast_milestones
+from timeseries import TimeSeries
+
+CATALOG_FILE = './catalog.sqlite'
+ROOTS = ['./library', './incoming_roasts', './profiles']
+META_KEYS = ('beanName', 'run', 't_ambient', 'starting_wt', 'final_wt', 'percent_loss')
+
+# bumped whenever summarize() starts keeping something new (or finds the milestones
+# differently), so every file gets re-read once
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roasts (
+    path         TEXT PRIMARY KEY,
+    mtime        REAL,
+    size         INTEGER,
+    format       TEXT,
+    error        TEXT,
+    beanName     TEXT,
+    run          INTEGER,
+    t_ambient    REAL,
+    starting_wt  REAL,
+    final_wt     REAL,
+    percent_loss REAL,
+    duration     REAL
+);
+CREATE TABLE IF NOT EXISTS series (
+    path    TEXT REFERENCES roasts(path) ON DELETE CASCADE,
+    name    TEXT,
+    length  INTEGER,
+    PRIMARY KEY (path, name)
+);
+CREATE TABLE IF NOT EXISTS milestones (
+    path    TEXT REFERENCES roasts(path) ON DELETE CASCADE,
+    name    TEXT,
+    time    REAL,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS roasts_bean ON roasts(beanName);
+"""
+
+
+def number(value):
+    """ float(value), or None when there isn't one.
+    """
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def summarize(path):
+    """
+    Reads a roast file and pulls out what the catalog keeps.
+
+    Parameters:
+        path: (str) a roast file
+
+    Returns:
+        a dictionary with the META_KEYS, 'format', 'duration', 'series' ({name: number of samples})
+        and 'milestones' ([[time, name], ...])
+
+    Raises:
+        IOError: if the file can't be read
+        ValueError: if it isn't a roast
+    """
+
+    batch, kind = read_roast(path)
+    entry = dict((k, batch.get(k)) for k in META_KEYS)
+    entry['format'] = kind
+    entry['series'] = {}
+    duration = None
+    for key, value in batch.items():
+        if isinstance(value, TimeSeries):
+            entry['series'][key] = len(value)
+            if len(value):
+                duration = max(duration, value.times()[-1])
+    entry['duration'] = duration
+    # the ones roast.py spotted during the roast, or else the ones the curve shows now
+    entry['milestones'] = roast_milestones(batch)
+    return entry
+
+def summarize_one(path):
+    """ summarize() for a worker process: returns (entry, error message).
+    """
+
+    try:
+        return summarize(path), None
+    except (IOError, ValueError) as e:
+        return {'series': {}}, str(e) or e.__class__.__name__
+
+
+class Catalog(object):
+    """
+    The catalog database.
+
+    Parameters:
+        db_path: (str) the sqlite file, created if it doesn't exist
+    """
+
+    def __init__(self, db_path=CATALOG_FILE):
+        self.db = sqlite3.connect(db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # forget what older versions kept, refresh() reads everything again
+            with self.db:
+                self.db.execute("DELETE FROM roasts")
+                self.db.execute("PRAGMA user_version = %i" % SCHEMA_VERSION)
+
+    def close(self):
+        self.db.close()
+
+    def refresh(self, roots=ROOTS, workers=None):
+        """
+        Brings the catalog up to date with the files under the roots.
+
+        Parameters:
+            roots: list of directories to look through
+            workers: (int) processes to read the files with. None uses one per cpu, 1 reads them right here.
+
+        Returns:
+            (added, updated, removed, unchanged) counts
+
+        Raises:
+            None.
+        """
+
+        known = dict((row['path'], (row['mtime'], row['size']))
+                     for row in self.db.execute("SELECT path, mtime, size FROM roasts"))
+        added = updated = unchanged = 0
+        seen = set()
+        stale = []
+        for path in roast_files(roots):
+            seen.add(path)
+            st = os.stat(path)
+            if known.get(path) == (st.st_mtime, st.st_size):
+                unchanged += 1
+                continue
+            if path in known:
+                updated += 1
+            else:
+                added += 1
+            stale.append((path, st))
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(stale))
+        paths = [path for path, st in stale]
+        if workers <= 1:
+            results = [summarize_one(path) for path in paths]
+        else:
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(summarize_one, paths, chunksize=4)
+            finally:
+                pool.close()
+                pool.join()
+
+        with self.db:
+            for (path, st), (entry, error) in zip(stale, results):
+                self.store(path, st, entry, error)
+
+            gone = [path for path in known if path not in seen and path.startswith(tuple(roots))]
+            for path in gone:
+                self.db.execute("DELETE FROM roasts WHERE path = ?", (path,))
+
+        return added, updated, len(gone), unchanged
+
+    def store(self, path, st, entry=None, error=None):
+        """ (Re)reads one file into the catalog, unless it has already been summarize()d.
+        """
+
+        if entry is None:
+            entry, error = summarize_one(path)
+
+        self.db.execute("DELETE FROM roasts WHERE path = ?", (path,))
+        self.db.execute("INSERT INTO roasts (path, mtime, size, format, error, beanName, run, t_ambient, "
+                        "starting_wt, final_wt, percent_loss, duration) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                        (path, st.st_mtime, st.st_size, entry.get('format'), error, entry.get('beanName'),
+                         entry.get('run'), number(entry.get('t_ambient')), number(entry.get('starting_wt')),
+                         number(entry.get('final_wt')), number(entry.get('percent_loss')), entry.get('duration')))
+        self.db.executemany("INSERT INTO series (path, name, length) VALUES (?,?,?)",
+                            [(path, name, n) for name, n in entry['series'].items()])
+        self.db.executemany("INSERT INTO milestones (path, name, time) VALUES (?,?,?)",
+                            [(path, name, t) for t, name in entry.get('milestones', [])])
+
+    def find(self, bean=None, run=None, min_loss=None, max_loss=None, has_series=None):
+        """
+        Looks up roasts in the catalog (without touching the files).
+
+        Parameters:
+            bean: (str) part of the bean name, ex: 'sidamo' (not case sensitive)
+            run: (int) the run/batch number
+            min_loss, max_loss: (float) weight loss in percent, as a positive number, ex: 15 for 15%
+            has_series: (str) only roasts with this series, ex: 'temp_smooth'
+
+        Returns:
+            a list of dictionaries (one per roast, every column of the roasts table) sorted by bean and run
+
+        Raises:
+            None.
+        """
+
+        where = ["error IS NULL"]
+        args = []
+        if bean is not None:
+            where.append("beanName LIKE ?")
+            args.append('%' + bean + '%')
+        if run is not None:
+            where.append("run = ?")
+            args.append(run)
+        if min_loss is not None:
+            where.append("abs(percent_loss) >= ?")
+            args.append(min_loss)
+        if max_loss is not None:
+            where.append("abs(percent_loss) <= ?")
+            args.append(max_loss)
+        if has_series is not None:
+            where.append("path IN (SELECT path FROM series WHERE name = ? AND length > 0)")
+            args.append(has_series)
+
+        sql = "SELECT * FROM roasts WHERE %s ORDER BY beanName, run, path" % " AND ".join(where)
+        return [dict(row) for row in self.db.execute(sql, args)]
+
+    def series(self, path):
+        """ {series name: number of samples} for one roast.
+        """
+
+        return dict((row['name'], row['length'])
+                    for row in self.db.execute("SELECT name, length FROM series WHERE path = ?", (path,)))
+
+    def milestones(self, path):
+        """ {milestone name: time} for one roast.
+        """
+
+        return dict((row['name'], row['time'])
+                    for row in self.db.execute("SELECT name, time FROM milestones WHERE path = ?", (path,)))
+
+
+
+if __name__ == '__main__':
+    # python catalog.py [bean [min_loss]]
+    # refreshes the catalog, then lists the roasts that match
+    catalog = Catalog()
+    print "added %i, updated %i, removed %i, unchanged %i" % catalog.refresh()
+    bean = sys.argv[1] if len(sys.argv) > 1 else None
+    min_loss = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    for roast in catalog.find(bean, min_loss=min_loss):
+        print "%-24s run %-4s loss %-6s %-6s %s" % (roast['beanName'], roast['run'], roast['percent_loss'],
+                                                   roast['duration'], roast['path'])
+    catalog.close()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+# Time sources for the roast loop.
+#
+# time.time() follows the wall clock, so an NTP correction (the beaglebone does this
+# shortly after boot) can make a roast jump forwards or backwards in the middle of a run.
+# Everything that schedules events should use monotonic() instead.
+#
+# The roast loop gets its time from a clock object with two methods, now() and sleep(seconds):
+#   SystemClock   real time (monotonic)
+#   ScaledClock   real time, sped up
+#   VirtualClock  simulated time that only moves when slept on. Nothing ever waits, and a
+#                 run gives exactly the same time stamps every time.
+
+import time
+
+
+def _find_monotonic():
+    """
+    Picks the best monotonic time source available on this interpreter.
+
+    Python 3.3+ has time.monotonic() built in. Python 2 (which is what runs on the beaglebone)
+    does not, so we go straight to clock_gettime(CLOCK_MONOTONIC) through ctypes.
+    If even that isn't possible we fall back on time.time(), which at least keeps the script running.
+
+    Parameters:
+        None.
+
+    Returns:
+        a function taking no arguments that returns seconds (float) from an arbitrary starting point
+
+    Raises:
+        None.
+    """
+
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        CLOCK_MONOTONIC = 1        # from <linux/time.h>
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+                return time.time()
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+        # make sure it actually works before committing to it
+        monotonic()
+        return monotonic
+
+    except (ImportError, OSError, AttributeError):
+        return time.time
+
+
+monotonic = _find_monotonic()
+
+
+class SystemClock(object):
+    """ Real time, on the monotonic clock.
+    """
+
+    def now(self):
+        return monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class ScaledClock(object):
+    """
+    A clock that runs 'speed' times faster than real time, ex: speed=10 replays a
+    15 minute roast in 90 seconds. Pass now and sleep to the Scheduler.
+
+    Parameters:
+        speed: (float) how many clock seconds go by per real second
+        real_clock: the real time source
+        real_sleep: the real sleep function
+    """
+
+    def __init__(self, speed=1.0, real_clock=monotonic, real_sleep=time.sleep):
+        if speed <= 0:
+            raise ValueError("speed must be positive, got %r (use a VirtualClock to not wait at all)" % speed)
+        self.speed = float(speed)
+        self.real_clock = real_clock
+        self.real_sleep = real_sleep
+        self.real_start = real_clock()
+
+    def now(self):
+        return (self.real_clock() - self.real_start) * self.speed
+
+    def sleep(self, seconds):
+        self.real_sleep(seconds / self.speed)
+
+
+class VirtualClock(object):
+    """
+    A clock that only moves when somebody sleeps on it: sleep(5) returns immediately, 5 seconds later.
+
+    With this, a roast runs as fast as the computer can go. Only one thread should sleep on it
+    (a second thread sleeping would push time forward for both).
+
+    Parameters:
+        start: (float) the initial reading
+    """
+
+    def __init__(self, start=0.0):
+        self.t = float(start)
+
+    def now(self):
+        return self.t
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.t += seconds
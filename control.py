@@ -0,0 +1,237 @@
+#!/usr/bin/python
+
+# Driving the heater to follow the profile.
+#
+# The CONTROL event (see roast.py) runs every CONTROL_FREQ seconds, on its own fixed period,
+# and only does arithmetic and flips a pin: it never prints or writes files. Each time:
+#   PID           turns the error (target - smoothed temperature) into a duty cycle, 0 to 1
+#   Controller    hands the duty cycle to the heater and keeps the books: the heat going in
+#                 (Q_in, watts) and the energy put in so far (E_heat, kJ)
+#
+# The heater is anything with set_duty(duty, elapsed):
+#   RelayHeater   the solid state relay on the beaglebone. It can only be on or off, so the
+#                 duty cycle is spread over the CONTROL ticks (sigma-delta): with 0.3, it is
+#                 on for 3 ticks out of every 10.
+#   ThermalPlant  a made-up roaster: a lumped model of the beans and chamber warmed by the
+#                 heater and cooled by the room. It is also a sensor (see sensors.py), so the
+#                 whole loop (timing, latency and the PID gains) can be tried on a laptop:
+#
+#   python roast.py --simulate-control <profile file>
+
+import math
+import random
+import threading
+
+from sensors import Sensor
+
+HEATER_WATTS = 1500.0           # what the heating element draws when it is on
+
+
+class PID(object):
+    """
+    PID controller with its output clamped to [out_min, out_max].
+
+    The derivative is taken on the measurement, not on the error, so a step in the target
+    doesn't kick the output; when the caller already has a good rate (ex: the rate of rise)
+    it can pass it in instead of having it worked out from two noisy samples. The integral
+    stops growing while the output is pinned at a limit (anti-windup).
+
+    Parameters:
+        kp, ki, kd: (float) the gains
+        out_min, out_max: (float) output limits
+    """
+
+    def __init__(self, kp, ki, kd, out_min=0.0, out_max=1.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.out_min = out_min
+        self.out_max = out_max
+        self.integral = 0.0
+        self.last = None            # (time, measurement) of the previous update
+        self.value = None
+
+    def update(self, t, setpoint, measurement, rate=None):
+        """
+        Works out the next output.
+
+        Parameters:
+            t: (float) time in seconds
+            setpoint: (float) where the measurement should be
+            measurement: (float) where it is
+            rate: (float) optional rate of change of the measurement, per second
+
+        Returns:
+            (float) the output, between out_min and out_max
+        """
+
+        error = setpoint - measurement
+        dt = 0.0
+        if self.last is not None:
+            dt = t - self.last[0]
+            if rate is None and dt > 0:
+                rate = (measurement - self.last[1]) / dt
+        self.last = (t, measurement)
+
+        unclamped = self.kp * error + self.ki * self.integral - self.kd * (rate or 0.0)
+        # only integrate when that doesn't push further into a limit
+        if not ((unclamped >= self.out_max and error > 0) or (unclamped <= self.out_min and error < 0)):
+            self.integral += error * dt
+        output = self.kp * error + self.ki * self.integral - self.kd * (rate or 0.0)
+        self.value = min(max(output, self.out_min), self.out_max)
+        return self.value
+
+
+class RelayHeater(object):
+    """
+    The heater's solid state relay, on a beaglebone GPIO pin.
+
+    Like the MAX31855, the Adafruit library is only imported when one of these is created.
+
+    Parameters:
+        pin: (str) the header pin, ex: 'P8_10'
+
+    Raises:
+        ImportError: when not running on the beaglebone
+    """
+
+    def __init__(self, pin):
+        import Adafruit_BBIO.GPIO as GPIO
+        self.gpio = GPIO
+        self.pin = pin
+        GPIO.setup(pin, GPIO.OUT)
+        self.owed = 0.0             # on-time (in ticks) asked for but not given yet
+        self.off()
+
+    def set_duty(self, duty, elapsed):
+        self.owed += duty
+        on = self.owed >= 0.5
+        if on:
+            self.owed -= 1.0
+        self.gpio.output(self.pin, self.gpio.HIGH if on else self.gpio.LOW)
+
+    def off(self):
+        self.gpio.output(self.pin, self.gpio.LOW)
+
+
+class ThermalPlant(Sensor):
+    """
+    A stand-in for the roaster: the heater, the beans and the thermocouple.
+
+    The beans and chamber are one lump of heat capacity 'capacity' (J/'F), heated by
+    duty*watts*efficiency and losing 'loss' W per 'F above ambient. The probe follows that
+    temperature with its own lag, plus some noise. Between calls the duty cycle is constant,
+    so both steps are solved exactly (exponential decay), however far apart the calls are.
+
+    It is a Sensor (read_f, ambient_f) and a heater (set_duty) at the same time; both can be
+    called from different threads (ex: with THREADED_READ).
+
+    Parameters:
+        ambient: (float) room and starting temperature, 'F
+        watts, efficiency: heater power and the part of it that ends up in the beans
+        capacity: (float) J/'F
+        loss: (float) W/'F
+        probe_lag: (float) the probe's time constant, seconds
+        noise: (float) standard deviation of the reading noise, 'F
+        seed: for the noise, so a run can be repeated exactly
+    """
+
+    def __init__(self, ambient=68.0, watts=HEATER_WATTS, efficiency=0.4, capacity=120.0, loss=1.0,
+                 probe_lag=4.0, noise=0.5, seed=0):
+        self.ambient = float(ambient)
+        self.watts = watts
+        self.efficiency = efficiency
+        self.capacity = capacity
+        self.loss = loss
+        self.probe_lag = probe_lag
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.t = 0.0
+        self.temp = self.probe = self.ambient
+        self.duty = 0.0
+
+    def advance(self, elapsed):
+        """ Moves the model forward to elapsed, with the current duty cycle.
+        """
+
+        dt = elapsed - self.t
+        if dt <= 0:
+            return
+        settle = self.ambient + self.duty * self.watts * self.efficiency / self.loss
+        tau = self.capacity / self.loss
+        start = self.temp
+        self.temp = settle + (start - settle) * math.exp(-dt / tau)
+        # probe: first order lag following an exponential. Solved exactly, unless the two
+        # time constants are (nearly) the same, where lagging toward the new temperature is plenty.
+        lag = self.probe_lag
+        if abs(tau - lag) > 1e-6 and lag > 0:
+            a = math.exp(-dt / lag)
+            b = math.exp(-dt / tau)
+            self.probe = settle + (self.probe - settle) * a + (start - settle) * tau / (tau - lag) * (b - a)
+        else:
+            self.probe += (self.temp - self.probe) * (1.0 - math.exp(-dt / max(lag, 1e-6)))
+        self.t = elapsed
+
+    def set_duty(self, duty, elapsed):
+        with self.lock:
+            self.advance(elapsed)
+            self.duty = duty
+
+    def off(self):
+        with self.lock:
+            self.duty = 0.0
+
+    def read_f(self, elapsed):
+        with self.lock:
+            self.advance(elapsed)
+            return self.probe + self.random.gauss(0.0, self.noise)
+
+    def ambient_f(self):
+        return self.ambient
+
+
+class Controller(object):
+    """
+    Runs the PID and the heater, and keeps track of the heat put in.
+
+    Parameters:
+        pid: (PID) with out_min=0 and out_max=1
+        heater: anything with set_duty(duty, elapsed) and off(), ex: RelayHeater or ThermalPlant
+        watts: (float) heater power, for Q_in and E_heat
+    """
+
+    def __init__(self, pid, heater, watts=HEATER_WATTS):
+        self.pid = pid
+        self.heater = heater
+        self.watts = watts
+        self.duty = 0.0
+        self.t = None
+        self.energy = 0.0           # J
+
+    def update(self, elapsed, target, temp, ror=None):
+        """
+        One control step: new duty cycle from the target and the smoothed temperature.
+
+        Parameters:
+            elapsed: (float) seconds since the start
+            target: (float) where the temperature should be, 'F
+            temp: (float) the smoothed temperature, 'F
+            ror: (float) optional rate of rise, 'F/min
+
+        Returns:
+            (duty, q_in, e_heat): the new duty cycle (0 to 1), heat rate (W) and the energy put
+            in so far (kJ)
+        """
+
+        # the energy for the time since the last step went in at the old duty cycle
+        if self.t is not None:
+            self.energy += self.duty * self.watts * (elapsed - self.t)
+        self.t = elapsed
+        rate = ror / 60.0 if ror is not None else None
+        self.duty = self.pid.update(elapsed, target, temp, rate)
+        self.heater.set_duty(self.duty, elapsed)
+        return self.duty, self.duty * self.watts, self.energy / 1000.0
+
+    def off(self):
+        self.heater.off()
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+
+# Thinning out a series for plotting.
+#
+# A roast has a sample every 0.2 s, so a graph of a few dozen roasts is hundreds of thousands of
+# points on a screen only about a thousand pixels wide. Largest-Triangle-Three-Buckets (LTTB)
+# picks the n points that keep the shape of the curve: the first and last points are kept, the
+# rest are split into n-2 buckets, and from each bucket it keeps the point that makes the biggest
+# triangle with the point kept from the bucket before and the average of the bucket after.
+# Spikes and turning points survive, unlike with plain decimation.
+#
+# ZoomDownsampler hooks that up to a matplotlib axes: every line is drawn downsampled to about
+# the width of the axes in pixels, and it re-downsamples just the visible part whenever the
+# x limits change, so zooming in brings back the full detail.
+
+import numpy as np
+
+POINTS_PER_PIXEL = 1            # how many points per pixel of axes width to keep
+SMALL_BUCKET = 64               # buckets smaller than this are searched without numpy
+
+
+def as_array(values):
+    """
+    A float numpy array for a sequence.
+
+    An array('d') (ex: TimeSeries.times()) is used in place, without copying, so it mustn't
+    grow while the numpy array is in use.
+    """
+
+    try:
+        return np.frombuffer(values, dtype=np.float64)
+    except (TypeError, ValueError, AttributeError):
+        return np.asarray(values, dtype=np.float64)
+
+def lttb(x, y, n):
+    """
+    Downsamples a series to n points with Largest-Triangle-Three-Buckets.
+
+    Parameters:
+        x: numpy array of times, increasing
+        y: numpy array of values, same length
+        n: (int) points to keep
+
+    Returns:
+        (x, y) numpy arrays of min(n, len(x)) points. Short series are returned as they are.
+
+    Raises:
+        None.
+    """
+
+    size = len(x)
+    if n >= size or n < 3:
+        return x, y
+
+    # bucket i (of n-2) is [edges[i], edges[i+1]). The last "bucket" is just the last point.
+    every = (size - 2) / float(n - 2)
+    edges = (np.arange(n - 1) * every).astype(np.intp) + 1
+    edges[-1] = size - 1
+    counts = np.diff(np.append(edges, size))
+    avg_x = np.add.reduceat(x, edges) / counts
+    avg_y = np.add.reduceat(y, edges) / counts
+
+    keep = [0] * n
+    keep[-1] = size - 1
+    a = 0
+    if every < SMALL_BUCKET:
+        # numpy has too much overhead per call for a handful of points, plain floats are quicker
+        xs, ys = x.tolist(), y.tolist()
+        edges, avg_x, avg_y = edges.tolist(), avg_x.tolist(), avg_y.tolist()
+        for i in range(n - 2):
+            ax, ay = xs[a], ys[a]
+            bx, by = avg_x[i + 1] - ax, avg_y[i + 1] - ay
+            best = -1.0
+            for j in range(edges[i], edges[i + 1]):
+                # twice the area of the triangle (point a, candidate, next bucket's average)
+                area = abs(bx * (ys[j] - ay) - (xs[j] - ax) * by)
+                if area > best:
+                    best = area
+                    a = j
+            keep[i + 1] = a
+    else:
+        for i in range(n - 2):
+            lo, hi = edges[i], edges[i + 1]
+            area = np.abs((avg_x[i + 1] - x[a]) * (y[lo:hi] - y[a]) -
+                          (x[lo:hi] - x[a]) * (avg_y[i + 1] - y[a]))
+            a = lo + int(area.argmax())
+            keep[i + 1] = a
+    return x[keep], y[keep]
+
+
+class ZoomDownsampler(object):
+    """
+    Keeps the lines on a matplotlib axes downsampled to what the axes can show.
+
+    Parameters:
+        ax: the matplotlib axes
+        points_per_pixel: (float) points to keep per pixel of axes width
+    """
+
+    def __init__(self, ax, points_per_pixel=POINTS_PER_PIXEL):
+        self.ax = ax
+        self.points_per_pixel = points_per_pixel
+        self.lines = []         # [line, full x, full y, (first, last, n) of what is drawn]
+        # matplotlib only keeps a weak reference to a bound method, the lambda keeps this object alive
+        ax.callbacks.connect('xlim_changed', lambda ax: self.update())
+
+    def points(self):
+        return max(int(self.ax.bbox.width * self.points_per_pixel), 3)
+
+    def plot(self, x, y, *args, **kwargs):
+        """
+        Plots a whole series, downsampled. Takes the same arguments as ax.plot().
+
+        The axes aren't rescaled for every line, call autoscale() once they have all been added.
+
+        Returns:
+            the matplotlib line
+        """
+
+        x = as_array(x)
+        y = as_array(y)
+        n = self.points()
+        kwargs.setdefault('scalex', False)
+        kwargs.setdefault('scaley', False)
+        line, = self.ax.plot(*(lttb(x, y, n) + args), **kwargs)
+        self.lines.append([line, x, y, (0, len(x), n)])
+        return line
+
+    def autoscale(self):
+        """ Fits the axes limits to all the lines.
+        """
+
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+    def update(self):
+        """ Re-downsamples the visible part of every line (called when the x limits change).
+        """
+
+        x0, x1 = self.ax.get_xlim()
+        n = self.points()
+        changed = False
+        for entry in self.lines:
+            line, x, y, drawn = entry
+            # one point past each edge, so the line still runs off the sides of the plot
+            lo = max(np.searchsorted(x, x0, 'left') - 1, 0)
+            hi = min(np.searchsorted(x, x1, 'right') + 1, len(x))
+            if (lo, hi, n) == drawn:
+                # ex: autoscale(), which shows every line in full
+                continue
+            line.set_data(*lttb(x[lo:hi], y[lo:hi], n))
+            entry[3] = (lo, hi, n)
+            changed = True
+        if changed:
+            self.ax.figure.canvas.draw_idle()
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+
+# Building a profile out of past roasts, instead of typing one in (see profile_builder.py).
+#
+# All the roasts are put on a common time grid (see resample.py) and, at every grid time, it
+# takes the mean, the median and a low and a high percentile over the roasts. Those bands become
+# a profile in the usual format:
+#   target_temp     the median (or the mean)
+#   lower_bound     the low percentile (default 10th)
+#   upper_bound     the high percentile (default 90th)
+# with a setpoint every 30 s, like the hand-made ones. Near the end, where only a few roasts
+# are still going, the statistics don't mean much, so the profile stops at the last time
+# at least min_count roasts have a value.
+#
+#   python envelope.py "Ethiopia Sidamo auto" incoming_roasts/Run_4*_Ethiopia\ Sidamo.txt ...
+#   python envelope.py "Ethiopia Sidamo auto" --bean sidamo --runs 40 51
+
+import argparse
+import os
+
+import numpy as np
+
+from resample import Resampler
+
+PROFILE_PATH = './profiles/'
+PERCENTILES = (10, 90)
+SETPOINT_EVERY = 30.0           # seconds between profile setpoints
+
+
+def roast_envelope(roasts, key='temp_smooth', step=1.0, percentiles=PERCENTILES, min_count=None, event=None):
+    """
+    Statistics of a series over many roasts, at every time of a common grid.
+
+    Parameters:
+        roasts: list of roast dictionaries (ex: from viewer.read_in_data)
+        key: (str) the series to use
+        step: (float) grid spacing in seconds
+        percentiles: (low, high) for the bands, ex: (10, 90)
+        min_count: (int) roasts needed at a time for it to count. Default: half of them.
+        event: optional event to line the roasts up on first (see resample.py)
+
+    Returns:
+        a dictionary of numpy arrays, all the same length:
+        'times', 'mean', 'median', 'lower', 'upper', 'count'
+
+    Raises:
+        ValueError: if no time has enough roasts
+    """
+
+    if min_count is None:
+        min_count = max(len(roasts) // 2, 1)
+    times, table = Resampler(step).roasts(roasts, [key], event=event, event_key=key)
+    temps = table[key]
+
+    count = np.sum(~np.isnan(temps), axis=0)
+    enough = np.flatnonzero(count >= min_count)
+    if not len(enough):
+        raise ValueError("no time has %i roasts with '%s' (out of %i roasts)" % (min_count, key, len(roasts)))
+    # up to the last time with enough roasts (a gap at the start is fine, ex: aligned roasts)
+    keep = slice(enough[0], enough[-1] + 1)
+    temps = temps[:, keep]
+
+    lower, median, upper = np.nanpercentile(temps, [percentiles[0], 50, percentiles[1]], axis=0)
+    return {
+        'times': times[keep],
+        'mean': np.nanmean(temps, axis=0),
+        'median': median,
+        'lower': lower,
+        'upper': upper,
+        'count': count[keep],
+    }
+
+def setpoints(times, values, every=SETPOINT_EVERY):
+    """ [[time, temp], ...] every 'every' seconds (plus the very end), rounded to 0.1.
+    """
+
+    wanted = np.arange(times[0], times[-1], every)
+    if not len(wanted) or wanted[-1] != times[-1]:
+        wanted = np.append(wanted, times[-1])
+    picked = np.interp(wanted, times, values)
+    return [[round(t, 1), round(v, 1)] for t, v in zip(wanted.tolist(), picked.tolist())]
+
+def make_profile(envelope, target='median', every=SETPOINT_EVERY):
+    """
+    Turns an envelope into a profile dictionary.
+
+    Parameters:
+        envelope: from roast_envelope()
+        target: 'median' or 'mean', what becomes the target_temp
+        every: (float) seconds between setpoints
+
+    Returns:
+        (dict) with 'target_temp', 'lower_bound' and 'upper_bound', ready for json
+
+    Raises:
+        None.
+    """
+
+    times = envelope['times']
+    return {
+        'target_temp': setpoints(times, envelope[target], every),
+        'lower_bound': setpoints(times, envelope['lower'], every),
+        'upper_bound': setpoints(times, envelope['upper'], every),
+    }
+
+def build_profile(roasts, name, key='temp_smooth', path=PROFILE_PATH, **options):
+    """
+    Makes a profile out of roasts and saves it as path + name.
+
+    Parameters:
+        roasts: list of roast dictionaries (with 'nickname's, ex: from viewer.read_in_data)
+        name: (str) the profile name, ex: 'Ethiopia Sidamo'
+        key: (str) the series to build it from
+        path: (str) the profile folder
+        options: passed on to roast_envelope()
+
+    Returns:
+        (full_filename, profile)
+
+    Raises:
+        ValueError: if the roasts don't have enough data
+        IOError: if the profile can't be written
+    """
+
+    from journal import write_atomically
+
+    profile = make_profile(roast_envelope(roasts, key, **options))
+    # so you can always look up what the profile came from
+    profile['built_from'] = [roast.get('nickname', roast.get('filename')) for roast in roasts]
+    full_filename = os.path.join(path, name)
+    write_atomically(profile, full_filename)
+    return full_filename, profile
+
+
+
+if __name__ == '__main__':
+    from loader import load_roasts
+
+    parser = argparse.ArgumentParser(description="Build a profile out of past roasts.")
+    parser.add_argument('name', help="profile name, it is saved in %s" % PROFILE_PATH)
+    parser.add_argument('files', nargs='*', help="roast files (or use a catalog query)")
+    parser.add_argument('--bean', help="catalog query: part of the bean name")
+    parser.add_argument('--runs', type=int, nargs=2, metavar=('FIRST', 'LAST'), help="catalog query: run numbers")
+    parser.add_argument('--series', default='temp_smooth')
+    parser.add_argument('--percentiles', type=float, nargs=2, default=list(PERCENTILES))
+    args = parser.parse_args()
+
+    paths = list(args.files)
+    if args.bean:
+        from catalog import Catalog
+        catalog = Catalog()
+        catalog.refresh()
+        for roast in catalog.find(args.bean, has_series=args.series):
+            if args.runs is None or args.runs[0] <= roast['run'] <= args.runs[1]:
+                paths.append(roast['path'])
+        catalog.close()
+    if not paths:
+        parser.error("no roasts to build from, give some files or a catalog query")
+
+    loaded, errors = load_roasts(paths, [args.series])
+    for path, error in errors:
+        print "skipped %s: %s" % (path, error)
+    roasts = [dict(roast, nickname=os.path.basename(path)) for path, roast in zip(paths, loaded) if roast is not None]
+    full_filename, profile = build_profile(roasts, args.name, args.series, percentiles=args.percentiles)
+    print "wrote %s from %i roasts" % (full_filename, len(roasts))
+    for t, temp in profile['target_temp']:
+        print "%6.1f s  %6.1f 'F" % (t, temp)
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+
+# Exporting roasts to csv, lots of them at once.
+#
+# The files come out exactly like the ones dict2csv() (modGregory.py) writes:
+#
+#   Ethiopia Sidamo                                         the title (see csv_title)
+#   Run #12,T_ambient = 73
+#
+#   temp_actual_sec, temp_actual_val, temp_smooth_sec, temp_smooth_val,
+#   0.0, 68.0, 0.0, 68.0,
+#   ...
+#   403.1, 157.5, , ,                                       shorter series are padded with empty cells
+#   , , , ,                                                 plus one empty row at the end
+#
+# but the rows are streamed straight from the series through csv.writer instead of looking up
+# every cell (and catching the error when a series has run out), and all the roasts go to one
+# folder that is picked once.
+#
+# The cells are str() of the values, like dict2csv(), so the files are byte for byte the same,
+# whether the series are plain [[time, value], ...] lists or TimeSeries (which hand back the
+# ints a file had, ex: the [0, 68] readings at the start of temp_actual, see timeseries.py).
+#
+#   python exporter.py <destination folder> <roast files...>
+
+import csv
+import multiprocessing
+import os
+import sys
+from itertools import izip_longest
+
+SUBSCRIPTS = ("_sec", "_val")
+
+
+def csv_title(roast):
+    """ The header dict2csv() files start with, ex: 'Ethiopia Sidamo\\nRun #12,T_ambient = 73\\n\\n'
+    """
+
+    return "%s\nRun #%02.i,T_ambient = %.f\n\n" % (roast['beanName'], roast['run'], roast['t_ambient'])
+
+def spread(cells):
+    """
+    Lays out a row of cells the way dict2csv() does, 'a, b, c, ' (with csv.writer's ',' in between).
+
+    Returns:
+        the list to hand to csv.writer
+    """
+
+    return cells[:1] + [' ' + c for c in cells[1:]] + [' ']
+
+def write_csv(roast, full_filename, title, keys, subscripts=SUBSCRIPTS):
+    """
+    Writes some series of a roast to a csv file, laid out like dict2csv().
+
+    Parameters:
+        roast: (dict) the roast, series as [[time, value], ...] lists or TimeSeries
+        full_filename: (str) the csv file to write
+        title: (str) written first, as it is, ex: csv_title(roast)
+        keys: list of the series to export (missing ones come out as empty columns)
+        subscripts: the two suffixes for the column names
+
+    Returns:
+        None.
+
+    Raises:
+        IOError: if the file can't be written
+    """
+
+    with open(full_filename, 'wb') as f:
+        f.write(title + "\n")
+        if not keys:
+            # dict2csv() writes an empty header and an empty row
+            f.write("\n\n")
+            return
+        out = csv.writer(f, lineterminator='\n')
+
+        header = []
+        for key in keys:
+            header += [key + subscripts[0], key + subscripts[1]]
+        out.writerow(spread(header))
+
+        columns = []
+        for key in keys:
+            series = roast.get(key, [])
+            if hasattr(series, 'to_list'):
+                columns.append(iter(series.to_list()))
+            else:
+                columns.append(iter(series))
+        empty = ('', '')
+        for pairs in izip_longest(*columns, fillvalue=empty):
+            row = []
+            for pair in pairs:
+                if pair is empty:
+                    row += empty
+                else:
+                    row += [str(pair[0]), str(pair[1])]
+            out.writerow(spread(row))
+        out.writerow(spread([''] * (2 * len(keys))))
+
+def export_one(job):
+    """ write_csv() for a worker process: returns the error message, or None.
+    """
+
+    roast, full_filename, keys = job
+    try:
+        write_csv(roast, full_filename, csv_title(roast), keys)
+        return None
+    except (IOError, KeyError, TypeError) as e:
+        return "%s: %s" % (e.__class__.__name__, e)
+
+def export_roasts(roasts, directory, keys=None, workers=1):
+    """
+    Exports a list of roasts to csv files in one folder, named after their 'filename'.
+
+    A roast that can't be exported (ex: no 'beanName' for the title) doesn't stop the others.
+
+    Parameters:
+        roasts: list of roast dictionaries (ex: from viewer.read_in_data)
+        directory: (str) the folder to write to
+        keys: list of the series to export. None exports every series a roast has.
+        workers: (int) processes to use. None uses one per cpu.
+
+    Returns:
+        (written, errors)
+        written: list of the csv files written
+        errors: list of (csv file, error message)
+
+    Raises:
+        None.
+    """
+
+    jobs = []
+    for roast in roasts:
+        name = roast.get('filename') or os.path.splitext(roast.get('nickname', 'roast'))[0]
+        export_keys = keys
+        if export_keys is None:
+            export_keys = sorted(k for k, v in roast.items() if isinstance(v, list) or hasattr(v, 'times'))
+        jobs.append((roast, os.path.join(directory, name + '.csv'), export_keys))
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        results = [export_one(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(export_one, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    written = []
+    errors = []
+    for (roast, full_filename, export_keys), error in zip(jobs, results):
+        if error is None:
+            written.append(full_filename)
+        else:
+            errors.append((full_filename, error))
+    return written, errors
+
+
+
+if __name__ == '__main__':
+    from loader import load_roasts
+
+    if len(sys.argv) < 3:
+        print "usage: python exporter.py <destination folder> <roast files...>"
+        sys.exit(1)
+    roasts, errors = load_roasts(sys.argv[2:])
+    written, export_errors = export_roasts([r for r in roasts if r is not None], sys.argv[1], workers=None)
+    for name, error in errors + export_errors:
+        print "skipped %s: %s" % (name, error)
+    print "exported %i roasts to %s" % (len(written), sys.argv[1])
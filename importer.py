@@ -0,0 +1,291 @@
+#!/usr/bin/python
+
+# Bulk import of the roast library into the standard batch format.
+#
+# The library has three kinds of roast files in it (see the Folder Notes):
+#   json        batch files written by roast.py (.txt/.json) and profiles
+#   csv         the old spreadsheet exports:
+#                   Sumatra Buah Buahan
+#                   Run #03,T_amb=80.0
+#                   elapsed, t_avg(15), t_bean
+#                   00:00.1, 68.0, 68.5
+#   csv_export  dict2csv() exports (see viewer.py):
+#                   Ethiopia Sidamo
+#                   Run #12,T_ambient = 73
+#
+#                   temp_actual_sec, temp_actual_val, temp_smooth_sec, temp_smooth_val,
+#                   0.0, 68, 0.0, 68.0,
+#
+# detect() tells them apart from the first few lines, and read_roast() turns any of them into
+# a batch dictionary like the ones roast.py writes. The csv files are read row by row straight
+# into TimeSeries; the old column names are renamed (t_bean -> temp_actual, t_avg(15) -> temp_smooth).
+#
+# import_library() does the whole library in one pass, over a pool of worker processes.
+# Roasts whose series are the same (ex: Run_12 as .txt and as a .csv export of it) are only
+# written out once, keeping the copy with the most metadata (json over csv).
+#
+#   python importer.py <destination folder> [folders to import, default: library, incoming_roasts]
+
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+
+from timeseries import TimeSeries, to_timeseries
+from journal import write_atomically
+
+ROOTS = ['./library', './incoming_roasts']
+EXTENSIONS = ('.txt', '.json', '.csv', '')          # '' for the profiles
+
+# formats in order of preference when the same roast turns up more than once
+FORMATS = ('json', 'csv_export', 'csv')
+
+RUN_LINE = re.compile(r'Run\s*#\s*(\d+)(?:\s*,\s*T_amb(?:ient)?\s*=\s*([0-9.]+))?', re.IGNORECASE)
+OLD_NAMES = [(re.compile(r't_bean$'), 'temp_actual'),
+             (re.compile(r't_avg\(\d+\)$'), 'temp_smooth')]
+
+
+def roast_files(roots):
+    """ Every file under the roots that could be a roast, in a stable order.
+    """
+
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if os.path.splitext(name)[1].lower() in EXTENSIONS:
+                    yield os.path.join(dirpath, name)
+
+def cells(line):
+    """ The cells of one csv line, stripped, without the empty ones spreadsheets pad rows with.
+    """
+
+    row = [c.strip() for c in next(csv.reader([line]))]
+    while row and not row[-1]:
+        row.pop()
+    return row
+
+def detect(path):
+    """
+    Works out which kind of roast file this is, from its first few lines.
+
+    Parameters:
+        path: (str) the file
+
+    Returns:
+        'json', 'csv' or 'csv_export'
+
+    Raises:
+        IOError: if the file can't be read
+        ValueError: if it isn't any kind of roast file
+    """
+
+    with open(path, 'rb') as f:
+        start = f.read(1024).lstrip()
+        if start.startswith(b'{'):
+            return 'json'
+        lines = [l for l in start.splitlines()[:6] if cells(l)]
+
+    if len(lines) >= 3 and RUN_LINE.match(','.join(cells(lines[1]))):
+        header = cells(lines[2])
+        if header[0] == 'elapsed':
+            return 'csv'
+        if header[0].endswith('_sec'):
+            return 'csv_export'
+    raise ValueError("%s isn't a roast file" % path)
+
+def parse_elapsed(s):
+    """ '05:58.1' (or plain seconds) to seconds.
+    """
+
+    if ':' in s:
+        m, sec = s.split(':')
+        return int(m) * 60 + float(sec)
+    return float(s)
+
+def standard_name(name):
+    for pattern, new_name in OLD_NAMES:
+        if pattern.match(name):
+            return new_name
+    return name
+
+def read_csv(path, kind):
+    """
+    Reads either kind of csv file, one row at a time.
+
+    Parameters:
+        path: (str) the file
+        kind: 'csv' or 'csv_export', see detect()
+
+    Returns:
+        (dict) the batch
+
+    Raises:
+        IOError: if the file can't be read
+        ValueError: if the file is damaged
+    """
+
+    with open(path, 'rb') as f:
+        lines = (line for line in f if cells(line))
+        batch = {'beanName': ','.join(cells(next(lines))),
+                 'filename': os.path.splitext(os.path.basename(path))[0]}
+        m = RUN_LINE.match(','.join(cells(next(lines))))
+        batch['run'] = int(m.group(1))
+        if m.group(2):
+            batch['t_ambient'] = float(m.group(2))
+
+        header = cells(next(lines))
+        if kind == 'csv':
+            # one time column shared by all the series
+            names = [standard_name(h) for h in header[1:]]
+            columns = [(0, j + 1) for j in range(len(names))]
+            to_seconds = parse_elapsed
+        else:
+            # a time and a value column for every series
+            names = [h[:-len('_sec')] for h in header[0::2]]
+            columns = [(2 * j, 2 * j + 1) for j in range(len(names))]
+            to_seconds = float
+
+        series = [TimeSeries() for name in names]
+        for line in lines:
+            row = cells(line)
+            for s, (i, j) in zip(series, columns):
+                if j < len(row) and row[i] and row[j]:
+                    s.add(to_seconds(row[i]), float(row[j]))
+
+    batch.update(zip(names, series))
+    return batch
+
+def read_roast(path):
+    """
+    Reads any kind of roast file into a batch dictionary.
+
+    Parameters:
+        path: (str) the file
+
+    Returns:
+        (batch, kind): the batch dictionary (series as TimeSeries) and the kind of file, see detect()
+
+    Raises:
+        IOError: if the file can't be read
+        ValueError: if it isn't a roast file
+    """
+
+    kind = detect(path)
+    if kind == 'json':
+        with open(path) as f:
+            batch = to_timeseries(json.load(f))
+        if not isinstance(batch, dict):
+            raise ValueError("%s isn't a roast file" % path)
+    else:
+        try:
+            batch = read_csv(path, kind)
+        except (StopIteration, IndexError, TypeError, AttributeError):
+            raise ValueError("%s is damaged" % path)
+    return batch, kind
+
+def content_hash(batch):
+    """ A fingerprint of the series in a batch (not the metadata), for spotting duplicates.
+    """
+
+    h = hashlib.sha1()
+    for key in sorted(batch):
+        value = batch[key]
+        if isinstance(value, TimeSeries) and len(value):
+            h.update(key.encode('utf-8'))
+            h.update(repr(value.times().tolist()))
+            h.update(repr(value.values().tolist()))
+    return h.hexdigest()
+
+def import_one(path):
+    """ read_roast() for a worker process: returns (path, kind, hash, batch, error).
+    """
+
+    try:
+        batch, kind = read_roast(path)
+        return path, kind, content_hash(batch), batch, None
+    except (IOError, ValueError) as e:
+        return path, None, None, None, str(e)
+
+def import_library(dest, roots=ROOTS, workers=None):
+    """
+    Converts every roast in the roots to a json batch file in dest, leaving out duplicates.
+
+    Parameters:
+        dest: (str) folder to write the batch files to (created if needed)
+        roots: list of folders to import
+        workers: (int) processes to use. None uses one per cpu, 1 does it all right here.
+
+    Returns:
+        (written, duplicates, errors)
+        written: list of (source file, new file)
+        duplicates: list of (source file, the source file it duplicates)
+        errors: list of (source file, error message)
+
+    Raises:
+        OSError: if dest can't be created
+    """
+
+    paths = list(roast_files(roots))
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers <= 1:
+        results = [import_one(path) for path in paths]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(import_one, paths, chunksize=4)
+        finally:
+            pool.close()
+            pool.join()
+
+    errors = [(path, error) for path, kind, digest, batch, error in results if error is not None]
+
+    # one roast per fingerprint, the best format wins (ties go to the first file)
+    best = {}
+    for result in results:
+        path, kind, digest, batch, error = result
+        if error is not None:
+            continue
+        if digest not in best or FORMATS.index(kind) < FORMATS.index(best[digest][1]):
+            best[digest] = result
+
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    written = []
+    duplicates = []
+    taken = set()
+    for path, kind, digest, batch, error in results:
+        if error is not None:
+            continue
+        kept = best[digest][0]
+        if kept != path:
+            duplicates.append((path, kept))
+            continue
+        name = batch.get('filename') or os.path.splitext(os.path.basename(path))[0]
+        if name in taken:
+            # different roasts, same name
+            name += '_' + digest[:8]
+        taken.add(name)
+        full_filename = os.path.join(dest, name + '.txt')
+        write_atomically(batch, full_filename)
+        written.append((path, full_filename))
+
+    return written, duplicates, errors
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "usage: python importer.py <destination folder> [folders to import]"
+        sys.exit(1)
+    written, duplicates, errors = import_library(sys.argv[1], sys.argv[2:] or ROOTS)
+    for path, kept in duplicates:
+        print "duplicate: %s (same as %s)" % (path, kept)
+    for path, error in errors:
+        print "skipped: %s" % error
+    print "imported %i roasts, %i duplicates, %i skipped" % (len(written), len(duplicates), len(errors))
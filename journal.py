@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+# Append-only journal for backing up a roast in progress.
+#
+# The WRITE event used to json.dump() the whole batch dictionary every WRITE_FREQ seconds,
+# so each backup took longer than the last, and a crash in the middle of one could leave
+# a truncated file as the only copy. The journal only appends the samples that came in
+# since the previous checkpoint, one line (one json record) per checkpoint:
+#
+#   {"meta": {"beanName": "Ethiopia Sidamo", "run": 51, ...}}
+#   {"append": {"temp_actual": [[0.0, 68.1], ...], "temp_smooth": [...]}}
+#   {"append": {"temp_actual": [[30.0, 151.2], ...], ...}}
+#
+# A "meta" record holds every key that isn't a series and is only written again if one of
+# them changes. At the end of the roast the journal is compacted into the normal batch file.
+#
+# To rebuild the batch file after a crash:   python journal.py <path to .journal file>
+
+import json
+import os
+import sys
+
+from timeseries import TimeSeries, BatchEncoder
+
+JOURNAL_EXT = ".journal"
+
+
+def is_series(value):
+    """ Series are the [[time, value], ...] lists (or TimeSeries) in the batch dictionary. Everything else is metadata.
+    """
+    return isinstance(value, (list, TimeSeries))
+
+def split_batch(batch):
+    """
+    Separates a batch dictionary into its metadata and its series.
+
+    Parameters:
+        batch: (dict) the batch dictionary
+
+    Returns:
+        (meta, series): two dictionaries
+
+    Raises:
+        None.
+    """
+
+    meta = {}
+    series = {}
+    for key, value in batch.items():
+        if is_series(value):
+            series[key] = value
+        else:
+            meta[key] = value
+    return meta, series
+
+def replay(path):
+    """
+    Rebuilds a batch dictionary from a journal file.
+
+    A record that was only partly written when the script died (no newline at the end,
+    or invalid json) is ignored, along with anything after it.
+
+    Parameters:
+        path: (str) the journal file
+
+    Returns:
+        (dict) the batch, as of the last complete checkpoint
+
+    Raises:
+        IOError: if the journal can't be read
+    """
+
+    batch = {}
+    with open(path) as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            batch.update(record.get('meta', {}))
+            for key, samples in record.get('append', {}).items():
+                batch.setdefault(key, []).extend(samples)
+    return batch
+
+def write_atomically(batch, full_filename):
+    """
+    Writes the batch to full_filename without ever leaving a half-written file there.
+
+    It writes to a temporary file first and then renames it over the destination,
+    which replaces the old file in one step.
+    """
+
+    tmp = full_filename + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(batch, f, cls=BatchEncoder)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, full_filename)
+
+
+class Journal(object):
+    """
+    Backs up a batch by appending what is new since the last checkpoint.
+
+    The series in the batch are assumed to only ever grow by appending (which is all
+    roast.py does with them). The journal remembers how many samples of each series
+    it has already written.
+
+    Parameters:
+        full_filename: (str) the batch file. The journal is kept next to it, with JOURNAL_EXT added.
+    """
+
+    def __init__(self, full_filename):
+        self.full_filename = full_filename
+        self.path = full_filename + JOURNAL_EXT
+        self.written = {}       # series key -> number of samples already in the journal
+        self.meta = None        # the metadata as of the last "meta" record
+        self.f = None
+
+    def open(self):
+        """ Starts a new journal file, keeping any old one (ex: from a crashed roast) out of harm's way.
+        """
+
+        if os.path.exists(self.path):
+            backup = self.path + ".old"
+            print "WARNING: found an old journal, moving it to %s" % backup
+            os.rename(self.path, backup)
+        self.f = open(self.path, 'w')
+
+    def checkpoint(self, batch):
+        """
+        Appends everything that has changed in the batch since the previous checkpoint.
+
+        The cost only depends on how much came in since then, not on how long the roast has been going.
+
+        Parameters:
+            batch: (dict) the batch dictionary
+
+        Returns:
+            None.
+
+        Raises:
+            IOError: if the journal can't be written
+        """
+
+        if self.f is None:
+            self.open()
+
+        meta, series = split_batch(batch)
+
+        if meta != self.meta:
+            self.f.write(json.dumps({'meta': meta}) + '\n')
+            self.meta = meta
+
+        new_samples = {}
+        for key, samples in series.items():
+            n = self.written.get(key, 0)
+            if len(samples) > n or key not in self.written:
+                new_samples[key] = samples[n:]
+                self.written[key] = len(samples)
+
+        if new_samples:
+            self.f.write(json.dumps({'append': new_samples}, cls=BatchEncoder) + '\n')
+
+        # make sure it actually made it to the card before we call it a backup
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def compact(self, batch):
+        """
+        Writes the complete batch to its final file and throws away the journal.
+
+        Parameters:
+            batch: (dict) the batch dictionary, including the closing_sequence() additions
+
+        Returns:
+            None.
+
+        Raises:
+            IOError, OSError: if the final file can't be written. The journal is left alone in that case.
+        """
+
+        self.close()
+        write_atomically(batch, self.full_filename)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+
+if __name__ == "__main__":
+    # recover a batch file from the journal of a roast that didn't finish
+    for path in sys.argv[1:]:
+        batch = replay(path)
+        if path.endswith(JOURNAL_EXT):
+            full_filename = path[:-len(JOURNAL_EXT)]
+        else:
+            full_filename = path + ".json"
+        write_atomically(batch, full_filename)
+        print "recovered %s (%i temp_actual readings)" % (full_filename, len(batch.get('temp_actual', [])))
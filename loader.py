@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+# Loading roast files, or just the parts of them you need.
+#
+# A roast file is one json object. Most of it is series ([[time, value], ...] lists with
+# thousands of pairs). When only one of those is wanted, load_roast() walks the top level of
+# the object and only decodes the value of that key. The other values are skipped by
+# scanning for where they end, without turning them into Python objects. The file is
+# memory-mapped, so the operating system only reads what the scan touches.
+#
+# The scan is done in Python, one regex at a time, so it only wins while there is little to
+# decode: over incoming_roasts (x10) it took 0.29 s against 0.41 s for json.load with one
+# series, but 0.55 s against 0.36 s with two. With more than SCAN_MAX series wanted, the
+# whole file is json.load()-ed and the rest thrown away.
+#
+# load_roasts() loads a whole list of files, spread over a pool of worker processes
+# (json decoding holds the GIL, so threads wouldn't help).
+
+import json
+import mmap
+import multiprocessing
+import re
+
+from timeseries import to_timeseries
+from roastbin import RoastFile, BIN_EXT
+from importer import read_roast
+
+# small bits of information that always come along (generate_title() and dict2csv() need them,
+# resample.py lines roasts up on the milestones)
+META_KEYS = ('beanName', 'run', 't_ambient', 'filename', 'starting_wt', 'final_wt', 'percent_loss', 'milestones')
+
+WHITESPACE = re.compile(br'\s*')
+STRING = re.compile(br'"(?:[^"\\]|\\.)*"', re.DOTALL)
+STRUCTURE = re.compile(br'[\[\]{}"]')
+# a list of nothing but numbers and nested lists, ex: a series. Checked for balance before use.
+NUMERIC_LIST = re.compile(br'\[[0-9\s,.\[\]eE+\-]*\]')
+SCALAR = re.compile(br'[^,}\]\s]+')
+
+SCAN_MAX = 1                    # series wanted, at most, for the scan to beat json.load
+
+
+def skip_ws(buf, i):
+    return WHITESPACE.match(buf, i).end()
+
+def skip_value(buf, i):
+    """
+    Finds the end of the json value that starts at buf[i], without decoding it.
+
+    Parameters:
+        buf: the json text (str or mmap)
+        i: (int) index of the first character of the value
+
+    Returns:
+        (int) index just past the end of the value
+
+    Raises:
+        ValueError: if the text ends before the value does
+    """
+
+    c = buf[i:i+1]
+    if c == b'"':
+        m = STRING.match(buf, i)
+        if not m:
+            raise ValueError("unterminated string at %i" % i)
+        return m.end()
+
+    if c == b'[':
+        # fast path for the usual case, a series: one regex match, done in C
+        m = NUMERIC_LIST.match(buf, i)
+        if m:
+            chunk = buf[i:m.end()]
+            if chunk.count(b'[') == chunk.count(b']'):
+                after = buf[skip_ws(buf, m.end()):skip_ws(buf, m.end())+1]
+                if after in (b',', b'}', b']'):
+                    return m.end()
+
+    if c in (b'[', b'{'):
+        depth = 0
+        pos = i
+        while True:
+            m = STRUCTURE.search(buf, pos)
+            if not m:
+                raise ValueError("unterminated list or object starting at %i" % i)
+            s = m.group()
+            if s == b'"':
+                pos = skip_value(buf, m.start())
+                continue
+            pos = m.end()
+            if s in (b'[', b'{'):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+
+    # number, true, false, null
+    m = SCALAR.match(buf, i)
+    if not m:
+        raise ValueError("no json value at %i" % i)
+    return m.end()
+
+def scan_object(buf, wanted):
+    """
+    Decodes the values of the wanted keys of the top-level json object in buf.
+
+    Parameters:
+        buf: the json text (str or mmap)
+        wanted: a set of keys, or None for all of them
+
+    Returns:
+        (dict) the wanted keys that were found, with their (decoded) values
+
+    Raises:
+        ValueError: if buf isn't a json object
+    """
+
+    found = {}
+    i = skip_ws(buf, 0)
+    if buf[i:i+1] != b'{':
+        raise ValueError("not a json object")
+    i = skip_ws(buf, i + 1)
+    if buf[i:i+1] == b'}':
+        return found
+
+    while True:
+        key_end = skip_value(buf, i)
+        key = json.loads(buf[i:key_end].decode('utf-8'))
+        i = skip_ws(buf, key_end)
+        if buf[i:i+1] != b':':
+            raise ValueError("expected ':' at %i" % i)
+        i = skip_ws(buf, i + 1)
+
+        value_end = skip_value(buf, i)
+        if wanted is None or key in wanted:
+            found[key] = json.loads(buf[i:value_end].decode('utf-8'))
+
+        i = skip_ws(buf, value_end)
+        c = buf[i:i+1]
+        if c == b'}':
+            return found
+        if c != b',':
+            raise ValueError("expected ',' or '}' at %i" % i)
+        i = skip_ws(buf, i + 1)
+
+def load_roast(path, keys=None, meta_keys=META_KEYS):
+    """
+    Loads a roast file, but only the series you ask for.
+
+    Parameters:
+        path: (str) the roast file (json, binary (see roastbin.py) or csv (see importer.py))
+        keys: optional list of series to load, ex: ['temp_smooth']. None loads everything (like json.load).
+        meta_keys: small keys to load as well (only used when keys is given)
+
+    Returns:
+        a dictionary with the keys that were found (missing ones are simply left out),
+        the series as TimeSeries
+
+    Raises:
+        IOError: if the file can't be read
+        ValueError: if it isn't a json object
+    """
+
+    if path.lower().endswith('.csv'):
+        # the old spreadsheet exports, see importer.py
+        roast = read_roast(path)[0]
+        if keys is not None:
+            roast = dict((k, v) for k, v in roast.items() if k in keys or k in meta_keys)
+        return roast
+
+    if path.endswith(BIN_EXT):
+        # the binary format can skip straight to the series that are wanted
+        with RoastFile(path) as roast:
+            return roast.to_batch(keys)
+
+    if keys is None:
+        # everything is wanted anyway, json.load does that fastest
+        return to_timeseries(json.load(open(path)))
+
+    if len(keys) > SCAN_MAX:
+        # decoding everything in C beats scanning in Python (see the top of this file)
+        with open(path) as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("not a json object")
+        wanted = set(keys) | set(meta_keys)
+        data = dict((k, v) for k, v in data.items() if k in wanted)
+        return to_timeseries(data, [k for k in keys if k in data])
+
+    with open(path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can't be mapped
+            raise ValueError("%s is empty" % path)
+        try:
+            data = scan_object(buf, set(keys) | set(meta_keys))
+        finally:
+            buf.close()
+
+    return to_timeseries(data, [k for k in keys if k in data])
+
+def load_one(job):
+    """ load_roast() for a worker process: returns (roast, None) or (None, error message).
+    """
+
+    path, keys = job
+    try:
+        return load_roast(path, keys), None
+    except (IOError, OSError, ValueError) as e:
+        return None, str(e)
+
+def load_roasts(paths, keys=None, workers=None):
+    """
+    Loads several roast files at once, in parallel.
+
+    A file that can't be loaded doesn't stop the others, it is just reported in the errors.
+
+    Parameters:
+        paths: list of roast files
+        keys: optional list of series to load (see load_roast)
+        workers: (int) processes to use. None uses one per cpu, 1 loads everything right here.
+
+    Returns:
+        (roasts, errors)
+        roasts: a list with one entry per path, in the same order: the loaded dictionary, or None if it failed
+        errors: a list of (path, error message)
+
+    Raises:
+        None.
+    """
+
+    jobs = [(path, keys) for path in paths]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(jobs))
+
+    if workers <= 1:
+        results = [load_one(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            # map() hands the results back in the order of the jobs
+            results = pool.map(load_one, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    roasts = []
+    errors = []
+    for path, (roast, error) in zip(paths, results):
+        roasts.append(roast)
+        if error is not None:
+            errors.append((path, error))
+    return roasts, errors
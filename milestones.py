@@ -0,0 +1,319 @@
+#!/usr/bin/python
+
+# Spotting the milestones of a roast as it happens (or afterwards, from the file).
+#
+#   turning_point   the lowest temperature after charging, found once the beans have come
+#                   TURN_RISE 'F back up from it. Only when there was a dip (ex: cold beans
+#                   into a hot roaster): at least TURN_DIP 'F below the temperature the roast
+#                   started at, the hottest in its first TURN_START seconds (by then the
+#                   smoothing is past roast.py's pre-filled readings). In the popper the beans
+#                   go in cold with the probe, so the temperature just climbs: once it is
+#                   TURN_RISE 'F above the start without having dipped, there is no turning
+#                   point and the drying end is looked for instead.
+#   drying_end      the temperature reaches DRY_END_TEMP (the beans start to yellow)
+#   first_crack     the temperature reaches FIRST_CRACK_TEMP
+#   drop            the beans come out: after the drying end, the rate of rise falls below
+#                   DROP_ROR and the temperature is DROP_FALL 'F below the hottest point so far.
+#                   It is put at that hottest point. The fall keeps a dip in the middle of the
+#                   roast (ex: Run_43 goes from 355 down to 342 'F at 2:30) from counting.
+#
+# They happen in that order, each one is only looked for once the previous one is found.
+#
+# DRY_END_TEMP and FIRST_CRACK_TEMP have to be crossed on the way up. A recording that
+# starts past DRY_END_TEMP (ex: the SUMATRA COMPLETION runs, which pick up at 447 'F) didn't
+# see them happen, so it gets no milestones at all (started_hot is set). It can't be told
+# from its first smoothed temperature, which is mostly roast.py's pre-filled BEAN_TEMP
+# readings (93 'F for those runs); it is told by reaching DRY_END_TEMP within MIN_DRY_TIME
+# of the start, which no roast does (the quickest in the library takes 50 s).
+# The temperatures are for the probe in the popper, which reads the air around the beans as
+# much as the beans, so they are higher than the usual bean temperatures. To keep a single
+# noisy sample from setting one off, the condition has to hold for DEBOUNCE samples in a row.
+#
+# MilestoneDetector takes one smoothed temperature (and rate of rise) at a time and does a
+# fixed amount of work for each, so roast.py runs it on every SMOOTH tick and records the
+# milestones in batch['milestones'] as [[time, name], ...], like the alarms. find_milestones()
+# runs it over a whole roast. The catalog (see catalog.py) keeps them for every roast file:
+#
+#   python milestones.py [bean]         refreshes the catalog, then lists the milestones
+
+import sys
+
+from smoothing import RateOfRise, ROR_OVER
+
+TURNING_POINT = 'turning_point'
+DRYING_END = 'drying_end'
+FIRST_CRACK = 'first_crack'
+DROP = 'drop'
+MILESTONES = (TURNING_POINT, DRYING_END, FIRST_CRACK, DROP)
+
+TURN_RISE = 5.0                 # 'F above the lowest temperature before it counts as the turning point
+TURN_DIP = 10.0                 # 'F the lowest temperature has to be below the start
+TURN_START = 5.0                # seconds the start temperature is taken over
+DRY_END_TEMP = 300.0            # 'F
+MIN_DRY_TIME = 30.0             # seconds, quicker than that to DRY_END_TEMP means it started hot
+FIRST_CRACK_TEMP = 401.0        # 'F
+DROP_ROR = -60.0                # 'F/min
+DROP_FALL = 40.0                # 'F below the hottest point. Dips mid roast are under 26, drops get there in 3-19 s
+DEBOUNCE = 5                    # samples in a row
+
+# short names for the PRINT line
+LABELS = {TURNING_POINT: 'TP', DRYING_END: 'DRY', FIRST_CRACK: '1C', DROP: 'DROP'}
+
+
+class MilestoneDetector(object):
+    """
+    Finds the milestones in a stream of (time, smoothed temperature, rate of rise) samples.
+
+    Parameters:
+        turn_rise, turn_dip, turn_start, dry_end_temp, first_crack_temp, drop_ror, drop_fall: see the top of this file
+        debounce: (int) samples in a row the condition has to hold for
+        min_dry_time: (float) see the top of this file
+
+    Raises:
+        ValueError: if debounce < 1
+    """
+
+    def __init__(self, turn_rise=TURN_RISE, turn_dip=TURN_DIP, turn_start=TURN_START, dry_end_temp=DRY_END_TEMP,
+                 first_crack_temp=FIRST_CRACK_TEMP, drop_ror=DROP_ROR, drop_fall=DROP_FALL, debounce=DEBOUNCE,
+                 min_dry_time=MIN_DRY_TIME):
+        if debounce < 1:
+            raise ValueError("debounce must be at least 1 sample, got %r" % debounce)
+        self.turn_rise = turn_rise
+        self.turn_dip = turn_dip
+        self.turn_start = turn_start
+        self.dry_end_temp = dry_end_temp
+        self.first_crack_temp = first_crack_temp
+        self.drop_ror = drop_ror
+        self.drop_fall = drop_fall
+        self.debounce = debounce
+        self.found = []             # [[time, name], ...] in the order they happened
+        self.next = 0               # index in MILESTONES of the one being looked for
+        self.streak = 0             # samples in a row the condition has held
+        self.streak_name = None     # the milestone the streak is for
+        self.first = None           # time of the first sample of the streak
+        self.extreme = None         # (time, temp) lowest since the start (turning point) or hottest since the drying end
+        self.high = None            # the start temperature, see the top of this file
+        self.min_dry_time = min_dry_time
+        self.start = None           # time of the first sample
+        self.started_hot = False    # the recording started part way through the roast
+
+    def done(self):
+        return self.next == len(MILESTONES)
+
+    def times(self):
+        """ {name: time} of the milestones found so far.
+        """
+
+        return dict((name, t) for t, name in self.found)
+
+    def condition(self, name, temp, ror):
+        """ Whether the sample points to the milestone being looked for.
+        """
+
+        if name == TURNING_POINT:
+            return self.high - self.extreme[1] >= self.turn_dip and temp >= self.extreme[1] + self.turn_rise
+        if name == DRYING_END:
+            return temp >= self.dry_end_temp
+        if name == FIRST_CRACK:
+            return temp >= self.first_crack_temp
+        return ror is not None and ror <= self.drop_ror and temp <= self.extreme[1] - self.drop_fall
+
+    def update(self, t, temp, ror=None):
+        """
+        Takes the next sample.
+
+        Parameters:
+            t: (float) elapsed time, seconds
+            temp: (float) smoothed temperature
+            ror: (float) rate of rise in 'F/min, or None if there isn't one yet
+
+        Returns:
+            [time, name] of the milestone this sample completed, or None
+        """
+
+        if self.done():
+            return None
+        if self.start is None:
+            self.start = t
+        name = MILESTONES[self.next]
+
+        # the turning point and the drop are the lowest/hottest point before they are spotted
+        if name == TURNING_POINT:
+            if t - self.start <= self.turn_start:
+                if self.high is None or temp > self.high:
+                    self.high = temp
+                    self.extreme = (t, temp)
+            elif temp < self.extreme[1]:
+                self.extreme = (t, temp)
+            elif self.high - self.extreme[1] < self.turn_dip and temp >= self.high + self.turn_rise:
+                # climbing without having dipped: there isn't a turning point
+                self.next = MILESTONES.index(DRYING_END)
+                self.extreme = None
+                name = DRYING_END
+        elif name in (FIRST_CRACK, DROP):
+            if self.extreme is None or temp > self.extreme[1]:
+                self.extreme = (t, temp)
+        # the beans can also come out before the first crack, ex: a light roast. The fall from
+        # the hottest point is what tells that apart from a dip on the way to the first crack.
+        if name == FIRST_CRACK and self.condition(DROP, temp, ror):
+            name = DROP
+
+        if name != self.streak_name or not self.condition(name, temp, ror):
+            self.streak = 0
+            self.streak_name = name
+            if not self.condition(name, temp, ror):
+                return None
+        if self.streak == 0:
+            self.first = t
+        self.streak += 1
+        if self.streak < self.debounce:
+            return None
+
+        if name in (TURNING_POINT, DROP):
+            when = self.extreme[0]
+        else:
+            when = self.first
+        if name == DRYING_END and when - self.start < self.min_dry_time:
+            # no roast dries that fast, the recording started after the drying end
+            self.started_hot = True
+            self.found = []
+            self.next = len(MILESTONES)
+            return None
+        milestone = [when, name]
+        self.found.append(milestone)
+        self.next = MILESTONES.index(name) + 1
+        self.streak = 0
+        if name in (TURNING_POINT, DRYING_END):
+            self.extreme = None
+        return milestone
+
+
+def find_milestones(times, temps, rors=None, **options):
+    """
+    Runs a MilestoneDetector over a whole roast.
+
+    Parameters:
+        times, temps: sequences of the times and smoothed temperatures
+        rors: sequence of the rates of rise at those same times (None or NaN where there isn't
+            one). None works them out from the temps, like roast.py does.
+        options: passed on to MilestoneDetector
+
+    Returns:
+        [[time, name], ...]
+
+    Raises:
+        None.
+    """
+
+    if rors is None:
+        rors = rates_of_rise(times, temps)
+    detector = MilestoneDetector(**options)
+    for t, temp, ror in zip(times, temps, rors):
+        if ror != ror:
+            ror = None
+        detector.update(t, temp, ror)
+        if detector.done():
+            break
+    return detector.found
+
+def rates_of_rise(times, temps, n=ROR_OVER):
+    """ The rate of rise at every reading, as smoothing.RateOfRise gives it during the roast.
+    """
+
+    ror = RateOfRise(n)
+    return [ror.update(t, temp) for t, temp in zip(times, temps)]
+
+def latest(times, rate_times, rates):
+    """
+    The rate of rise at each of the times: the last one from at or before it (None before the first).
+
+    That is what the detector sees in roast.py, where the SMOOTH event takes whatever rate of
+    rise the readings so far give.
+    """
+
+    found = []
+    i = -1
+    for t in times:
+        while i + 1 < len(rate_times) and rate_times[i + 1] <= t:
+            i += 1
+        found.append(rates[i] if i >= 0 else None)
+    return found
+
+def batch_milestones(batch, key='temp_smooth'):
+    """
+    The milestones of a roast dictionary, as roast.py would have found them.
+
+    It uses the roast's own temp_ror when it has one, otherwise the rate of rise of temp_actual
+    (or of the key itself) is worked out. Plain Python, so the catalog doesn't need numpy.
+
+    Parameters:
+        batch: (dict) the roast, series as TimeSeries (ex: from importer.read_roast)
+        key: (str) the smoothed series
+
+    Returns:
+        [[time, name], ...], empty if the roast doesn't have the key
+
+    Raises:
+        None.
+    """
+
+    series = batch.get(key)
+    if series is None or not len(series):
+        return []
+    times = series.times().tolist()
+    if batch.get('temp_ror') is not None and len(batch['temp_ror']):
+        rate = batch['temp_ror']
+        rors = latest(times, rate.times().tolist(), rate.values().tolist())
+    else:
+        source = batch.get('temp_actual', series)
+        source_times = source.times().tolist()
+        rors = latest(times, source_times, rates_of_rise(source_times, source.values().tolist()))
+    return find_milestones(times, series.values().tolist(), rors)
+
+def roast_milestones(batch, key='temp_smooth'):
+    """
+    The milestones of a roast: the ones roast.py recorded in it, or else batch_milestones().
+
+    Everything that needs a roast's milestones (the catalog, resample.py's alignment,
+    similarity.py) goes through here, so they all agree.
+
+    Parameters:
+        batch: (dict) the roast, series as TimeSeries
+        key: (str) the smoothed series. The recorded ones are only used for temp_smooth,
+            which is what roast.py found them in.
+
+    Returns:
+        [[time, name], ...]
+    """
+
+    if key == 'temp_smooth' and batch.get('milestones'):
+        return batch['milestones']
+    return batch_milestones(batch, key)
+
+def development_time(milestones):
+    """ Seconds from first crack to the drop, or None if the roast doesn't have both.
+    """
+
+    found = dict((name, t) for t, name in milestones)
+    if FIRST_CRACK in found and DROP in found:
+        return found[DROP] - found[FIRST_CRACK]
+    return None
+
+
+
+if __name__ == '__main__':
+    # python milestones.py [bean]
+    from catalog import Catalog
+    from modGregory import convert_time
+
+    catalog = Catalog()
+    catalog.refresh()
+    bean = sys.argv[1] if len(sys.argv) > 1 else None
+    print "%-24s %-4s %8s %8s %8s %8s %8s" % ('bean', 'run', 'turning', 'dry end', '1st crk', 'drop', 'dev')
+    for roast in catalog.find(bean, has_series='temp_smooth'):
+        found = catalog.milestones(roast['path'])
+        cells = [convert_time(found[name]) if name in found else '-' for name in MILESTONES]
+        dev = development_time([[t, name] for name, t in found.items()])
+        cells.append(convert_time(dev) if dev is not None else '-')
+        print "%-24s %-4s %8s %8s %8s %8s %8s" % tuple([roast['beanName'], roast['run']] + cells)
+    catalog.close()
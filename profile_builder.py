@@ -7,6 +7,7 @@ profile = {}
 
 # set the basic profile.  Likely this won't have to be more than a dozen points.
 # CURRENTLY THIS IS THE SETPOINTS FOR ETHIOPIA SIDAMO ROAST #18 FOR RIKKI
+# (envelope.py can build the whole profile, bounds and all, out of a bunch of past roasts instead)
 # foreseeable problem: can't compare this with actual roasts because it is called 'target_temp', not 'temp_actual' or whatever...
 profile['target_temp'] = [[0.0, 70.0], [30.0, 190.0], [60.0, 257.0],[90.0, 299.0], [120.0, 328.0], [150.0, 349.0], [180.0, 369.0], [210.0, 385.0], [240.0, 397.0], [270.0, 413.0], [300.0, 426.0], [330.0, 436.0], [360.0, 445.0], [390.0, 456.0], [420, 465.0], [430, 467.0]]
 
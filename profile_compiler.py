@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+# Compiling a profile into dense lookup tables, ahead of the roast.
+#
+# A profile file (or a past batch used as one) is a short list of [time, temp] setpoints. The
+# compiler evaluates it (see profile_eval.py) every 'step' seconds, ex: every SMOOTH_FREQ, and
+# keeps three tables: the target temperature and, if the profile has them, the lower and upper
+# bounds. During the roast a lookup is then just an index into a table.
+#
+# The tables are saved in a small binary file next to the profile (the profile's name plus
+# TABLE_EXT). The next time the same profile is loaded with the same step and interpolation
+# method, and the profile file hasn't changed (same modification time and size), the tables are
+# read straight back from it instead of being worked out again.
+#
+#   header     struct HEADER: magic, step, number of entries, interpolation method,
+#              the profile file's modification time and size, whether there are bounds
+#   target     n little-endian doubles
+#   lower      n little-endian doubles (only if there are bounds)
+#   upper      n little-endian doubles (only if there are bounds)
+#
+#   python profile_compiler.py <profile file> [step]      compiles (or checks) the table file
+
+import json
+import os
+import struct
+import sys
+from array import array
+
+from profile_eval import Profile
+
+TABLE_EXT = '.table'
+MAGIC = b'PROFTBL1'
+HEADER = struct.Struct('<8sdI8sdQ?')
+
+
+def target_pairs(prof):
+    """ The setpoints to follow: temp_actual for a past batch, otherwise target_temp (see profile_builder.py).
+    """
+
+    if prof.get('temp_actual'):
+        return prof['temp_actual']
+    return prof['target_temp']
+
+def dense(pairs, method, step, n):
+    """ The profile evaluated at 0, step, 2*step, ... (n entries) as an array('d').
+    """
+
+    curve = Profile(pairs, method)
+    return array('d', [curve.value_at(i * step) for i in range(n)])
+
+
+class CompiledProfile(object):
+    """
+    A profile as dense tables, one entry every 'step' seconds.
+
+    It can stand in for a profile_eval.Profile (value_at), and has the bounds in the
+    format bounds.BoundsChecker() takes.
+
+    Parameters:
+        step: (float) seconds between table entries
+        target: array('d') target temperatures
+        lower, upper: array('d') bounds, or None
+        method: (str) the interpolation method the tables were made with
+    """
+
+    def __init__(self, step, target, lower=None, upper=None, method='linear'):
+        self.step = float(step)
+        self.target = target
+        self.lower = lower
+        self.upper = upper
+        self.method = method
+        self.last = len(target) - 1
+
+    def __len__(self):
+        return len(self.target)
+
+    def has_bounds(self):
+        return self.lower is not None and self.upper is not None
+
+    def index(self, elapsed):
+        """ The table entry closest to the elapsed time (the first/last one outside of the profile).
+        """
+
+        i = int(elapsed / self.step + 0.5)
+        if i > self.last:
+            return self.last
+        if i < 0:
+            return 0
+        return i
+
+    def value_at(self, elapsed):
+        """ The target temperature at the elapsed time.
+        """
+
+        return self.target[self.index(elapsed)]
+
+    def bounds_at(self, elapsed):
+        """ (lower, upper) at the elapsed time.
+        """
+
+        i = self.index(elapsed)
+        return self.lower[i], self.upper[i]
+
+
+def compile_profile(prof, step, method='linear'):
+    """
+    Compiles a profile dictionary into a CompiledProfile.
+
+    The tables run to the end of the longest of the target and bounds.
+
+    Parameters:
+        prof: (dict) the profile (or a batch), straight from json
+        step: (float) seconds between table entries
+        method: (str) how to interpolate the target, see profile_eval.METHODS.
+                The bounds are always linear (they are limits, they shouldn't bulge).
+
+    Returns:
+        a CompiledProfile
+
+    Raises:
+        KeyError: if there is neither a temp_actual nor a target_temp
+        ValueError: for a bad method or an empty profile
+    """
+
+    pairs = target_pairs(prof)
+    if not len(pairs):
+        raise ValueError("the profile has no setpoints")
+    has_bounds = bool(prof.get('lower_bound')) and bool(prof.get('upper_bound'))
+
+    duration = float(pairs[-1][0])
+    if has_bounds:
+        duration = max(duration, float(prof['lower_bound'][-1][0]), float(prof['upper_bound'][-1][0]))
+    n = int(duration / step) + 1
+
+    target = dense(pairs, method, step, n)
+    if not has_bounds:
+        return CompiledProfile(step, target, method=method)
+    return CompiledProfile(step, target, dense(prof['lower_bound'], 'linear', step, n),
+                           dense(prof['upper_bound'], 'linear', step, n), method)
+
+def write_table(compiled, path, st):
+    """
+    Saves the tables (for the profile file with os.stat() result st) to path.
+
+    Like journal.write_atomically(), it writes a temporary file and renames it into place.
+    """
+
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, compiled.step, len(compiled), compiled.method.encode('ascii'),
+                            st.st_mtime, st.st_size, compiled.has_bounds()))
+        tables = [compiled.target]
+        if compiled.has_bounds():
+            tables += [compiled.lower, compiled.upper]
+        for table in tables:
+            if sys.byteorder != 'little':
+                table = array('d', table)
+                table.byteswap()
+            table.tofile(f)
+    os.rename(tmp, path)
+
+def read_table(path, st, step, method):
+    """
+    Reads the tables back from path, if they still match the profile file (os.stat() result st),
+    the step and the method.
+
+    Returns:
+        a CompiledProfile, or None if the table file is missing, stale or damaged
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                return None
+            magic, t_step, n, t_method, mtime, size, has_bounds = HEADER.unpack(header)
+            t_method = t_method.rstrip(b'\0').decode('ascii')
+            if (magic != MAGIC or t_step != step or t_method != method or
+                    mtime != st.st_mtime or size != st.st_size):
+                return None
+            tables = []
+            for i in range(3 if has_bounds else 1):
+                table = array('d')
+                table.fromfile(f, n)
+                if sys.byteorder != 'little':
+                    table.byteswap()
+                tables.append(table)
+    except (IOError, EOFError, struct.error):
+        return None
+    if has_bounds:
+        return CompiledProfile(step, tables[0], tables[1], tables[2], method)
+    return CompiledProfile(step, tables[0], method=method)
+
+def load_profile(filename, step, method='linear'):
+    """
+    The compiled version of a profile file, from its table file when that is up to date.
+
+    Otherwise the profile is compiled and the table file (re)written. Not being able to write
+    it (ex: a read-only folder) only means compiling again next time.
+
+    Parameters:
+        filename: (str) the profile (or batch) file
+        step: (float) seconds between table entries, ex: SMOOTH_FREQ
+        method: (str) how to interpolate the target
+
+    Returns:
+        a CompiledProfile
+
+    Raises:
+        IOError: if the profile can't be read
+        KeyError, ValueError: if it isn't a profile
+    """
+
+    step = float(step)
+    st = os.stat(filename)
+    table_file = filename + TABLE_EXT
+    compiled = read_table(table_file, st, step, method)
+    if compiled is not None:
+        return compiled
+
+    with open(filename) as f:
+        compiled = compile_profile(json.load(f), step, method)
+    try:
+        write_table(compiled, table_file, st)
+    except (IOError, OSError):
+        pass
+    return compiled
+
+
+
+if __name__ == '__main__':
+    # python profile_compiler.py <profile file> [step]
+    name = sys.argv[1]
+    step = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    fresh = read_table(name + TABLE_EXT, os.stat(name), step, 'linear') is not None
+    compiled = load_profile(name, step)
+    print "%s%s: %i entries every %s s, %s" % (name + TABLE_EXT, " (up to date)" if fresh else "", len(compiled),
+                                              step, "with bounds" if compiled.has_bounds() else "no bounds")
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+
+# Evaluating a roast profile at any point in time.
+#
+# A profile is a short list of [time, temp] setpoints, ex: every 30 seconds as in
+# profile_builder.py. Everything that can be worked out ahead of time (the polynomial for each
+# segment between two setpoints) is done once when the profile is loaded, so a lookup during
+# the roast is a couple of comparisons and a few multiplications.
+#
+# Interpolation methods:
+#   'linear' straight lines between the setpoints
+#   'spline' monotone cubic spline (Fritsch-Carlson). Smooth, but never overshoots the setpoints,
+#            so a flat stretch of the profile stays flat.
+#   'step'   the old behavior: the value of the next setpoint at or after the requested time
+
+from array import array
+from bisect import bisect_right
+
+METHODS = ('linear', 'spline', 'step')
+
+
+def monotone_slopes(times, values):
+    """
+    Slopes at each setpoint for a monotone cubic Hermite spline (Fritsch-Carlson, as in PCHIP).
+
+    Parameters:
+        times: (list) strictly increasing
+        values: (list) same length
+
+    Returns:
+        (list) of slopes, one per setpoint
+
+    Raises:
+        None.
+    """
+
+    n = len(times)
+    h = [times[i+1] - times[i] for i in range(n - 1)]
+    delta = [(values[i+1] - values[i]) / h[i] for i in range(n - 1)]
+
+    slopes = [0.0] * n
+    slopes[0] = delta[0]
+    slopes[-1] = delta[-1]
+    for i in range(1, n - 1):
+        if delta[i-1] * delta[i] <= 0:
+            # local min/max (or flat): a non-zero slope here would overshoot
+            slopes[i] = 0.0
+        else:
+            w1 = 2 * h[i] + h[i-1]
+            w2 = h[i] + 2 * h[i-1]
+            slopes[i] = (w1 + w2) / (w1 / delta[i-1] + w2 / delta[i])
+    return slopes
+
+
+class Profile(object):
+    """
+    A roast profile that can be evaluated at any elapsed time.
+
+    Before the first setpoint the first value is used, after the last setpoint the last value.
+
+    Lookups keep a cursor on the current segment. During a roast time only goes forward, so the
+    cursor just steps along (constant time). Jumping backwards, or far ahead, falls back on a
+    binary search (log n). Either way the profile itself is never modified.
+
+    Parameters:
+        pairs: [[time, temp], ...] setpoints, in chronological order
+        method: (str) one of METHODS
+
+    Raises:
+        ValueError: for an unknown method or times that go backwards
+    """
+
+    def __init__(self, pairs, method='linear'):
+        if method not in METHODS:
+            raise ValueError("unknown interpolation method %r, pick one of %s" % (method, METHODS))
+
+        times = []
+        values = []
+        for t, v in pairs:
+            t, v = float(t), float(v)
+            if times and t < times[-1]:
+                raise ValueError("profile times must be in chronological order (%s after %s)" % (t, times[-1]))
+            if times and t == times[-1]:
+                # repeated time stamp: the later value wins
+                values[-1] = v
+                continue
+            times.append(t)
+            values.append(v)
+
+        self.method = method
+        self.t = array('d', times)
+        self.v = array('d', values)
+        self.cursor = 0
+
+        # per segment: value = v[i] + dt*(c1[i] + dt*(c2[i] + dt*c3[i])), with dt = time - t[i]
+        n = len(times)
+        self.c1 = array('d', [0.0] * max(n - 1, 0))
+        self.c2 = array('d', [0.0] * max(n - 1, 0))
+        self.c3 = array('d', [0.0] * max(n - 1, 0))
+        if n > 1 and method == 'linear':
+            for i in range(n - 1):
+                self.c1[i] = (values[i+1] - values[i]) / (times[i+1] - times[i])
+        elif n > 1 and method == 'spline':
+            m = monotone_slopes(times, values)
+            for i in range(n - 1):
+                h = times[i+1] - times[i]
+                delta = (values[i+1] - values[i]) / h
+                self.c1[i] = m[i]
+                self.c2[i] = (3 * delta - 2 * m[i] - m[i+1]) / h
+                self.c3[i] = (m[i] + m[i+1] - 2 * delta) / (h * h)
+
+    def __len__(self):
+        return len(self.t)
+
+    def segment(self, t):
+        """ Index i of the segment with self.t[i] <= t < self.t[i+1], using (and moving) the cursor.
+        """
+
+        times = self.t
+        i = self.cursor
+        if times[i] <= t:
+            # usual case: same segment or one of the next couple
+            for _ in range(3):
+                if i + 1 >= len(times) - 1 or t < times[i+1]:
+                    self.cursor = i
+                    return i
+                i += 1
+        i = max(min(bisect_right(times, t) - 1, len(times) - 2), 0)
+        self.cursor = i
+        return i
+
+    def value_at(self, t):
+        """
+        The profile temperature at elapsed time t.
+
+        Parameters:
+            t: (float) seconds since the start of the roast
+
+        Returns:
+            (float) temperature
+
+        Raises:
+            IndexError: if the profile is empty
+        """
+
+        times = self.t
+        if t <= times[0]:
+            return self.v[0]
+        if t >= times[-1]:
+            return self.v[-1]
+
+        i = self.segment(t)
+        if self.method == 'step':
+            return self.v[i] if t == times[i] else self.v[i+1]
+        dt = t - times[i]
+        return self.v[i] + dt * (self.c1[i] + dt * (self.c2[i] + dt * self.c3[i]))
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+# Drawing roast graphs straight to files, no display needed (ex: on the beaglebone at the end
+# of a session).
+#
+# It draws the same graphs as viewer.py, using matplotlib's Agg backend, and writes:
+#   overlay.png         every roast on one graph
+#   <roast name>.png    one graph per roast
+# (or .svg, or both). The graphs are drawn by a pool of worker processes.
+#
+# The roasts are either files, or whatever a catalog query finds (see catalog.py):
+#
+#   python render.py charts/ incoming_roasts/Batch_49_Ethiopia\ Sidamo.txt ...
+#   python render.py charts/ --bean sidamo --min-loss 15
+#   python render.py charts/ --bean sidamo --series temp_actual temp_smooth --format png svg --no-overlay
+
+import matplotlib
+# has to happen before pyplot is imported (by viewer)
+matplotlib.use('Agg')
+
+import argparse
+import multiprocessing
+import os
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from viewer import draw_roasts, read_in_data
+
+SERIES = ['temp_actual', 'temp_smooth']
+FORMATS = ('png',)
+SIZE = (12, 6)                  # inches
+DPI = 100
+
+
+def draw_file(job):
+    """
+    Draws one graph and saves it in every format. Meant for a worker process.
+
+    Parameters:
+        job: (roasts, series, title, filename without extension, formats)
+
+    Returns:
+        (written, error): the files written, and an error message or None
+    """
+
+    roasts, series, title, base, formats = job
+    try:
+        # a bare Figure, pyplot's global state has no business in a worker process
+        fig = Figure(figsize=SIZE, dpi=DPI)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        draw_roasts(ax, roasts, series)
+        ax.set_title(title)
+        written = []
+        for fmt in formats:
+            filename = "%s.%s" % (base, fmt)
+            fig.savefig(filename, format=fmt)
+            written.append(filename)
+        return written, None
+    except (IOError, ValueError, KeyError) as e:
+        return [], "%s: %s" % (e.__class__.__name__, e)
+
+def render_roasts(paths, directory, series=SERIES, formats=FORMATS, overlay=True, each=True, workers=None):
+    """
+    Draws graphs of roast files into a folder.
+
+    Parameters:
+        paths: list of roast files
+        directory: (str) where to put the graphs (created if needed)
+        series: list of the series to draw, ex: ['temp_actual', 'temp_smooth']
+        formats: list of file formats, 'png' and/or 'svg'
+        overlay: (bool) draw every roast on one graph, overlay.<format>
+        each: (bool) draw a graph for every roast, named after the roast file
+        workers: (int) processes to draw with. None uses one per cpu.
+
+    Returns:
+        (written, errors)
+        written: list of the files written
+        errors: list of (what was being drawn, error message)
+
+    Raises:
+        OSError: if the folder can't be created
+    """
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    roasts = read_in_data(paths, series, workers)
+
+    jobs = []
+    if overlay and roasts:
+        jobs.append((roasts, series, "%i roasts" % len(roasts), os.path.join(directory, 'overlay'), formats))
+    if each:
+        for roast in roasts:
+            name = os.path.splitext(roast['nickname'])[0]
+            jobs.append(([roast], series, name, os.path.join(directory, name), formats))
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        results = [draw_file(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(draw_file, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    written = []
+    errors = []
+    for job, (files, error) in zip(jobs, results):
+        written += files
+        if error is not None:
+            errors.append((job[3], error))
+    return written, errors
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Draw roast graphs to files, no display needed.")
+    parser.add_argument('directory', help="where to write the graphs")
+    parser.add_argument('files', nargs='*', help="roast files (or use a catalog query)")
+    parser.add_argument('--bean', help="catalog query: part of the bean name")
+    parser.add_argument('--run', type=int, help="catalog query: run number")
+    parser.add_argument('--min-loss', type=float, help="catalog query: minimum weight loss, percent")
+    parser.add_argument('--max-loss', type=float, help="catalog query: maximum weight loss, percent")
+    parser.add_argument('--series', nargs='+', default=SERIES)
+    parser.add_argument('--format', nargs='+', default=list(FORMATS), choices=['png', 'svg'])
+    parser.add_argument('--no-overlay', action='store_true')
+    parser.add_argument('--no-each', action='store_true')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    paths = list(args.files)
+    if args.bean or args.run is not None or args.min_loss is not None or args.max_loss is not None:
+        from catalog import Catalog
+        catalog = Catalog()
+        catalog.refresh()
+        paths += [roast['path'] for roast in catalog.find(args.bean, args.run, args.min_loss, args.max_loss)]
+        catalog.close()
+    if not paths:
+        parser.error("no roasts to draw, give some files or a catalog query")
+
+    written, errors = render_roasts(paths, args.directory, args.series, args.format,
+                                    not args.no_overlay, not args.no_each, args.workers)
+    for name, error in errors:
+        print "couldn't draw %s: %s" % (name, error)
+    print "wrote %i files to %s" % (len(written), args.directory)
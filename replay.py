@@ -0,0 +1,154 @@
+#!/usr/bin/python
+
+# Replaying a recorded roast as if it were coming off the thermocouple.
+#
+# This is what USING_FAKE_DATA runs on. Any roast file with a 'temp_actual' series works
+# (ex: one from incoming_roasts/), as does fake_data.json. A cursor steps through the
+# readings as time goes by, nothing gets copied.
+#
+# Sensor faults can be mixed in to see how the rest of the script copes with them:
+#   ('nan', t)                  the first read at or after t comes back NaN (a single glitch, a retry fixes it)
+#   ('dropout', t_start, t_end) every read from t_start to t_end comes back NaN (ex: a loose thermocouple)
+# plus nan_every=N, which makes every Nth read NaN.
+
+import json
+
+from timeseries import TimeSeries
+
+NAN = float('nan')
+
+
+def load_recording(filename):
+    """
+    Reads a roast file (or one of the original fake data files) to replay.
+
+    Parameters:
+        filename: (str) a json roast file
+
+    Returns:
+        the decoded json, ex: a batch dictionary
+
+    Raises:
+        IOError: if the file can't be read
+        ValueError: if it isn't json
+    """
+
+    with open(filename) as f:
+        return json.load(f)
+
+def replay_pairs(recorded, name="the recording"):
+    """
+    The readings to replay out of a roast (see load_recording).
+
+    Parameters:
+        recorded: (dict) the decoded roast file
+        name: (str) what to call it in the error, ex: its filename
+
+    Returns:
+        a TimeSeries of [time, temp]
+
+    Raises:
+        ValueError: if it has nothing to replay
+    """
+
+    if 'temp_actual' in recorded:
+        pairs = recorded['temp_actual']
+    else:
+        # the original fake data files: every key is a list of readings
+        pairs = []
+        for k in sorted(recorded.keys()):
+            pairs += recorded[k]
+
+    # data may be stored as unicode strings
+    series = TimeSeries([float(x), float(y)] for [x, y] in pairs)
+    if not len(series):
+        raise ValueError("%s has no readings to replay" % name)
+    return series
+
+
+class Replay(object):
+    """
+    Plays back recorded readings by elapsed time.
+
+    read(elapsed) returns the first recorded reading taken at or after 'elapsed'
+    (the same reading the old get_fake_data_point() picked), or NaN where a fault says so.
+    Once the recording runs out it keeps returning the last reading.
+
+    Parameters:
+        series: (TimeSeries) the recorded readings, in chronological order
+        faults: optional list of fault tuples, see the top of this file
+        nan_every: (int) optional, make every Nth read NaN
+
+    Raises:
+        ValueError: for a fault that isn't understood
+    """
+
+    def __init__(self, series, faults=(), nan_every=0):
+        self.t = series.times()
+        self.v = series.values()
+        self.cursor = 0
+        self.reads = 0
+        self.finished = False
+
+        self.glitches = []      # times of pending single NaN reads, sorted
+        self.dropouts = []      # (t_start, t_end)
+        for fault in faults:
+            if fault[0] == 'nan' and len(fault) == 2:
+                self.glitches.append(float(fault[1]))
+            elif fault[0] == 'dropout' and len(fault) == 3:
+                self.dropouts.append((float(fault[1]), float(fault[2])))
+            else:
+                raise ValueError("don't know how to fake the sensor fault %r" % (fault,))
+        self.glitches.sort()
+        self.nan_every = nan_every
+
+    def duration(self):
+        """ Time (seconds) of the last recorded reading.
+        """
+        return self.t[-1]
+
+    def faulty(self, elapsed):
+        """ True if the read at this time should come back NaN. Uses up single glitches.
+        """
+
+        if self.nan_every and self.reads % self.nan_every == 0:
+            return True
+        if self.glitches and self.glitches[0] <= elapsed:
+            self.glitches.pop(0)
+            return True
+        for t_start, t_end in self.dropouts:
+            if t_start <= elapsed <= t_end:
+                return True
+        return False
+
+    def read(self, elapsed):
+        """
+        The reading at the elapsed time.
+
+        Parameters:
+            elapsed: (float) time in seconds since start
+
+        Returns:
+            (float) temperature in Fahrenheit, possibly NaN
+
+        Raises:
+            None.
+        """
+
+        self.reads += 1
+        if self.faulty(elapsed):
+            return NAN
+
+        # we know the readings come sorted chronologically, so we just step forward from
+        # where we were last time, ignoring all the readings that have already passed
+        i = self.cursor
+        last = len(self.t) - 1
+        while i < last and self.t[i] < elapsed:
+            i += 1
+        self.cursor = i
+
+        if i == last and self.t[i] < elapsed and not self.finished:
+            print "Came to the end of the fake data."
+            self.finished = True
+
+        return self.v[i]
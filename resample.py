@@ -0,0 +1,231 @@
+#!/usr/bin/python
+
+# Putting roasts on a common time grid, so they can be compared with plain array math.
+#
+# Every series is sampled on its own irregular times (temp_actual, temp_smooth and target_temp
+# don't even line up within one roast). resample() linearly interpolates a series onto a regular
+# grid (ex: every 0.2 s); resample_roasts() does a whole list of roasts, giving one row per roast:
+#
+#   times, temps = resample_roasts(roasts, ['temp_smooth'], step=1.0)
+#   average = np.nanmean(temps['temp_smooth'], axis=0)
+#   difference = temps['temp_smooth'][1] - temps['temp_smooth'][0]
+#
+# Outside of a series' own time span the grid gets NaN, not made-up values.
+#
+# The roasts can also be lined up on an event instead of on their start times (see EVENTS):
+#   'start'             the first sample (the default, same as not aligning)
+#   'turning_point', 'drying_end', 'first_crack', 'drop'
+#                       the milestones, the same ones the catalog has: the ones recorded in
+#                       the roast, or else what milestones.py finds in it (see
+#                       milestones.roast_milestones). A bare series gets them from its own curve.
+#   300                 a number: the first time the temperature reaches that many 'F
+# The event then happens at time 0 in every roast, so times before it are negative.
+#
+# Resampled series are cached, by file (and its modification time), series, grid and event.
+
+import os
+
+import numpy as np
+
+from downsample import as_array
+from milestones import MILESTONES, find_milestones, roast_milestones
+
+CACHE_SIZE = 256                # resampled series to keep around
+
+
+def grid(step, t_end, t_start=0.0):
+    """ Evenly spaced times from t_start to t_end (included if it lands on the grid).
+    """
+
+    return t_start + step * np.arange(int(np.floor((t_end - t_start) / step + 1e-9)) + 1, dtype=float)
+
+def resample(series, times):
+    """
+    Linear interpolation of a series at the given times.
+
+    Parameters:
+        series: a TimeSeries (or anything with times() and values())
+        times: numpy array of times to interpolate at
+
+    Returns:
+        numpy array of values, NaN outside of the series' time span
+
+    Raises:
+        None.
+    """
+
+    t = as_array(series.times())
+    if not len(t):
+        return np.full(len(times), np.nan)
+    return np.interp(times, t, as_array(series.values()), left=np.nan, right=np.nan)
+
+def start_time(series):
+    return series.times()[0]
+
+def time_at_temp(series, temp):
+    """ The first time the series reaches temp, or None if it never does.
+    """
+
+    v = as_array(series.values())
+    above = np.flatnonzero(v >= temp)
+    if not len(above):
+        return None
+    return series.times()[int(above[0])]
+
+def milestone(name):
+    """ An event function for one of the milestones (see milestones.py), None if the series doesn't
+    have it. For a bare series only, Resampler takes them from the whole roast.
+    """
+
+    def milestone_time(series):
+        found = find_milestones(series.times().tolist(), series.values().tolist())
+        return dict((n, t) for t, n in found).get(name)
+    return milestone_time
+
+EVENTS = {'start': start_time}
+EVENTS.update((name, milestone(name)) for name in MILESTONES)
+
+def event_time(series, event):
+    """
+    The time an event happens in a series.
+
+    Parameters:
+        series: a TimeSeries
+        event: a name from EVENTS, or a temperature ('F)
+
+    Returns:
+        (float) seconds, or None if the event never happens
+
+    Raises:
+        ValueError: for an unknown event
+    """
+
+    if not len(series):
+        return None
+    if isinstance(event, (int, float)):
+        return time_at_temp(series, event)
+    if event not in EVENTS:
+        raise ValueError("unknown event %r, pick one of %s or a temperature" % (event, sorted(EVENTS)))
+    return EVENTS[event](series)
+
+
+class Resampler(object):
+    """
+    Resamples roasts onto a common grid, remembering what it has already done.
+
+    Parameters:
+        step: (float) seconds between grid points
+        cache_size: (int) resampled series to keep
+    """
+
+    def __init__(self, step=0.2, cache_size=CACHE_SIZE):
+        self.step = float(step)
+        self.cache_size = cache_size
+        self.cache = {}
+        self.order = []         # cache keys, oldest first
+
+    def file_key(self, roast):
+        """ What identifies a roast for the cache: its file and that file's modification time and size.
+        """
+
+        path = roast.get('path')
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (path, st.st_mtime, st.st_size)
+
+    def offset(self, roast, event, event_key):
+        """ When the event happens in the roast (0 when not aligning).
+        """
+
+        if event is None:
+            return 0.0
+        if event_key not in roast:
+            return None
+        if event in MILESTONES:
+            if not len(roast[event_key]):
+                return None
+            # from the whole roast (its recorded milestones, temp_ror...), like the catalog
+            found = dict((n, t) for t, n in roast_milestones(roast, event_key))
+            return found.get(event)
+        return event_time(roast[event_key], event)
+
+    def roast(self, roast, key, times, event=None, event_key='temp_smooth'):
+        """
+        One series of a roast on the grid.
+
+        Parameters:
+            roast: (dict) the roast, ex: from viewer.read_in_data
+            key: (str) the series, ex: 'temp_smooth'
+            times: numpy array, the grid (see grid())
+            event: optional event to line the roast up on, see the top of this file
+            event_key: (str) the series to find the event in
+
+        Returns:
+            numpy array with a value (or NaN) for every grid time
+
+        Raises:
+            ValueError: for an unknown event
+        """
+
+        file_key = self.file_key(roast)
+        cache_key = None
+        if file_key is not None:
+            cache_key = (file_key, key, self.step, times[0], len(times), event, event_key)
+            if cache_key in self.cache:
+                return self.cache[cache_key]
+
+        offset = self.offset(roast, event, event_key)
+        if key not in roast or offset is None:
+            values = np.full(len(times), np.nan)
+        else:
+            values = resample(roast[key], times + offset)
+
+        if cache_key is not None:
+            values.flags.writeable = False          # it's shared by everyone who asks for it
+            self.cache[cache_key] = values
+            self.order.append(cache_key)
+            if len(self.order) > self.cache_size:
+                del self.cache[self.order.pop(0)]
+        return values
+
+    def roasts(self, roasts, keys, t_end=None, t_start=0.0, event=None, event_key='temp_smooth'):
+        """
+        Several series of several roasts on one grid.
+
+        Parameters:
+            roasts: list of roast dictionaries
+            keys: list of series, ex: ['temp_smooth', 'target_temp']
+            t_end: (float) last grid time. By default, the end of the longest series.
+            t_start: (float) first grid time (negative makes sense when aligning on an event)
+            event, event_key: see roast()
+
+        Returns:
+            (times, {key: 2D numpy array, one row per roast})
+
+        Raises:
+            ValueError: for an unknown event
+        """
+
+        if t_end is None:
+            t_end = 0.0
+            for roast in roasts:
+                offset = self.offset(roast, event, event_key) or 0.0
+                for key in keys:
+                    if key in roast and len(roast[key]):
+                        t_end = max(t_end, roast[key].times()[-1] - offset)
+        times = grid(self.step, t_end, t_start)
+        table = {}
+        for key in keys:
+            rows = [self.roast(roast, key, times, event, event_key) for roast in roasts]
+            table[key] = np.vstack(rows) if rows else np.empty((0, len(times)))
+        return times, table
+
+def resample_roasts(roasts, keys, step=0.2, t_end=None, t_start=0.0, event=None, event_key='temp_smooth'):
+    """ Resampler(step).roasts(...), for a one-off. See Resampler.roasts().
+    """
+
+    return Resampler(step).roasts(roasts, keys, t_end, t_start, event, event_key)
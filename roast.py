@@ -1,57 +1,86 @@
 #!/usr/bin/python
 
-import time
+import sys
 import math
-import json
+import os
 # from modGregory import tk_ui_for_path
 from modGregory import *
+from scheduler import Scheduler
+from acquisition import SensorReader
+from journal import Journal
+from smoothing import make_filter, RateOfRise, ROR_OVER
+from timeseries import TimeSeries
+from profile_compiler import load_profile
+from sensors import MAX31855Sensor, RecordedFileSensor, OversamplingSensor
+from clock import SystemClock, ScaledClock, VirtualClock
+from bounds import BoundsChecker, OK, OVER, UNDER
+from milestones import MilestoneDetector, LABELS
+from control import PID, Controller, RelayHeater, ThermalPlant, HEATER_WATTS
 
 # Use fake data for testing the script when you don't have the beaglebone.
 USING_FAKE_DATA = True
-FAKE_DATA_FILENAME = './fake_data.json'
+FAKE_DATA_FILENAME = './fake_data.json'   # or any roast file, ex: one from incoming_roasts/
+REPLAY_SPEED = 1             # How fast to play back the fake data: 1 is real time, 10 is 10x, 0 is as fast as possible
+FAKE_FAULTS = []             # Sensor faults to fake, ex: [('nan', 30.0), ('dropout', 60.0, 65.0)]. See replay.py
+FAKE_NAN_EVERY = 0           # Make every Nth fake reading a NaN (0 for never)
 FAKE_MESSAGE = "* FAKE *"    # Display this message when using fake data.
-fake_data = []               # Not a constant but must be initiated early because it is actually
+sensor = None                # Not a constant but must be initiated early because it is actually
                              # assigned a meaningful value inside of a function and a global var
 profile_data = []            # Not a constant but must be initiated early because it is actually
                              # assigned a meaningful value inside of a function and a global var
+bounds_data = None           # Same deal. Checks the roast against the profile's lower and upper bounds.
+heater = None                # Same deal. What the CONTROL event drives (see control.py), None when not controlling.
 
-if not USING_FAKE_DATA:
+# BeagleBone Black software SPI configuration.
+# Taken directly from MAX31855 Example on Adafruit.com
+CLK = 'P9_12'
+CS  = 'P9_15'
+DO  = 'P9_23'
 
-    # None of the following will work if you aren't running the script on the beaglebone,
-    # so leave it out. Taken directly from MAX31855 Example on Adafruit.com
-    import Adafruit_GPIO.SPI as SPI
-    import Adafruit_MAX31855.MAX31855 as MAX31855
-
-    # BeagleBone Black software SPI configuration.
-    # Taken directly from MAX31855 Example on Adafruit.com
-    CLK = 'P9_12'
-    CS  = 'P9_15'
-    DO  = 'P9_23'
-    sensor = MAX31855.MAX31855(CLK, CS, DO)
-    
+if not USING_FAKE_DATA:
     # Overwrite the previous message so printout shows nothin when printing
     # actual sampled data. Avoids conoditional statement in loop later.
     FAKE_MESSAGE = ""
 
 FILE_EXT = ".json" # Extension (string) of the save file. Soon to be ".json"
-MAX_ATTEMPTS = 3  # Number of tries to get a non-NaN temperature reading
+MAX_ATTEMPTS = 3  # Number of tries to get a non-NaN temperature reading (when not oversampling)
+OVERSAMPLE = 1    # Readings to take per READ. Above 1, they are combined (see OVERSAMPLE_COMBINE)
+                  # and NaN readings are just left out instead of retried.
+OVERSAMPLE_COMBINE = 'median'  # 'median' or 'trimmed_mean'
 VERBOSE = True    # Allow additional comments such as the NaN commentary?
 BEAN_TEMP = 68    # Initial bean temperature (*F). Only used to initialize a running average.
 SMOOTH_OVER = 15  # The number of readings to average over. Changing this DOES change your curve!
                   # This is number of readings, not the number of seconds!  See READ_FREQ below.
+PROFILE_INTERPOLATION = 'linear' # How to fill in between profile setpoints: 'linear', 'spline' or 'step' (the old way)
+ALARM_DEBOUNCE = 5 # Smoothed samples in a row outside (or back inside) the profile's bounds before it counts
+ALARM_MESSAGES = {OVER: "TOO HOT  ", UNDER: "TOO COLD  "}   # shown on the PRINT line while out of bounds
+SMOOTH_FILTER = 'mean' # How to smooth: 'mean' (moving average), 'ema', 'median' or 'savgol'. See smoothing.py
+THREADED_READ = False # Read the sensor in a background thread? The main loop then collects the
+                      # readings from a buffer, so slow reads can't hold up (or be held up by) the rest.
+READ_BUFFER = 1024    # Max number of readings the background thread can get ahead of the main loop.
+CONTROL = False       # Drive the heater to follow the profile? With fake data, the roaster is the
+                      # ThermalPlant model instead of a replay (see control.py).
+HEATER_PIN = 'P8_10'  # GPIO pin of the heater's solid state relay
+PID_GAINS = (0.05, 0.001, 0.2) # kp (1/'F), ki (1/('F*s)), kd (s/'F)
+SHOW_SIMILAR = True   # Print the past roasts this one is most like so far? Needs the index, see similarity.py
+SIMILAR_K = 3         # How many of them
 
 # events occur every n seconds
 READ_FREQ  = 0.2
 TARGET_FREQ = READ_FREQ
 SMOOTH_FREQ= 0.2
 PRINT_FREQ = 1
-WRITE_FREQ = 30   # write is functionally a back up frequency
+CONTROL_FREQ = 1.0
+SIMILAR_FREQ = 30
+WRITE_FREQ = 30   # write is functionally a back up frequency (only the new readings are appended, see journal.py)
 
 # offset them to ensure they happen in the correct order and to avoid any potential conflicts
 READ_OFFSET  = 0
 TARGET_OFFSET = READ_OFFSET
 SMOOTH_OFFSET= 0
 PRINT_OFFSET = 0
+CONTROL_OFFSET = 0
+SIMILAR_OFFSET = 15
 WRITE_OFFSET = 4    # while testing, you'll want to see the data before the first WRITE_FREQ trigger
 
 # DEFINITIONS FOR CLARITY:
@@ -65,35 +94,49 @@ WRITE_OFFSET = 4    # while testing, you'll want to see the data before the firs
 
 
 
-def load_fake_data():
+def load_sensor():
     """
-    Pre-loads the fake data set into a 2D list.
+    Sets up the temperature sensor: the MAX31855 on the beaglebone, or the fake data.
     Fake data is is for testing the script without a beaglebone.
+    With CONTROL on, it also sets up the heater: the relay, or (with fake data) the ThermalPlant,
+    which is the sensor too.
 
     Parameters:
+        USING_FAKE_DATA
         FAKE_DATA_FILENAME
-        fake_data (global): previously an empty [], 
+        FAKE_FAULTS
+        FAKE_NAN_EVERY
+        OVERSAMPLE
+        CONTROL
+        HEATER_PIN
+        sensor (global): previously None
+        heater (global): previously None
 
     Returns: 
         None.
-        Alters the (global) fake_data to be a 2D list.
+        Alters the (global) sensor to be one of the sensors in sensors.py, and the (global) heater
 
     Raises:
+        ImportError: for the real sensor or relay, when not running on the beaglebone
     """
 
-    global fake_data
-
-    print "getting fake data from %s" % FAKE_DATA_FILENAME
+    global sensor, heater
 
-    # fake data is stored in the same file format as regular roasts. Currently it only includes entries for temp_actual readings (time and temp pairs)
-    fake = json.load(open(FAKE_DATA_FILENAME))
+    if USING_FAKE_DATA and CONTROL:
+        print "simulating the roaster (see control.py)"
+        sensor = heater = ThermalPlant(watts=HEATER_WATTS)
+    elif USING_FAKE_DATA:
+        print "getting fake data from %s" % FAKE_DATA_FILENAME
 
-    # data is stored as unicode strings
-    use_this_data = []
-    for k in fake.keys():
-        use_this_data += [[float(x),float(y)] for [x,y] in fake[k]]
+        # fake data is stored in the same file format as regular roasts, only the temp_actual readings (time and temp pairs) are used
+        sensor = RecordedFileSensor(FAKE_DATA_FILENAME, FAKE_FAULTS, FAKE_NAN_EVERY)
+    else:
+        sensor = MAX31855Sensor(CLK, CS, DO)
+        if CONTROL:
+            heater = RelayHeater(HEATER_PIN)
 
-    fake_data = use_this_data
+    if OVERSAMPLE > 1:
+        sensor = OversamplingSensor(sensor, OVERSAMPLE, OVERSAMPLE_COMBINE)
     return
 
 def welcome_message():
@@ -123,6 +166,34 @@ def generate_batch_dict():
         None.
     """
 
+    temp_dict = empty_batch_dict()
+
+    temp_dict['filepath'] = tk_ui_for_path()  # have the user enter the save location for this batch
+
+    # pull all the information about this particular bean and roast so it can be added into the batch roast file
+    temp_dict.update(get_bean_info())
+    temp_dict.update(get_batch_info())
+    temp_dict.update(generate_filename(temp_dict))
+
+    temp_dict['comments'] = raw_input("Enter optional roast comments or <Enter> to continue:  ")+" "
+
+    return temp_dict
+
+def empty_batch_dict():
+    """
+    The series of the batch dictionary, before any information about the bean or batch is added.
+
+    Parameters:
+        BEAN_TEMP
+        SMOOTH_OVER
+
+    Returns:
+        temp_dict: (dict) with the (pre-filled) series
+
+    Raises:
+        None.
+    """
+
     temp_dict = {}
 
     # Temperature sensors reading will store the sample time and sample value:
@@ -131,42 +202,36 @@ def generate_batch_dict():
     # It will make it very easy for graphing scatter plots.
     # More imporantely, list indexes won't have to be coordinated across keys/values
     # within the batch dictionary and we can safely ignore NaN values
-    temp_dict['temp_actual'] = []    # the actual, sampled temperate ('F)
-    temp_dict['temp_smooth'] = []    # the smoothed reading (hopefully less noisy than the actual reading)
+    # In memory, each series is a TimeSeries (see timeseries.py), which stores the pairs compactly.
+    temp_dict['temp_actual'] = TimeSeries()    # the actual, sampled temperate ('F)
+    temp_dict['temp_smooth'] = TimeSeries()    # the smoothed reading (hopefully less noisy than the actual reading)
+    temp_dict['temp_ror'] = TimeSeries()       # the rate of rise ('F/min), see make_ror()
+    temp_dict['alarms'] = []                   # [[time, 'over' / 'under' / 'ok'], ...] whenever the roast leaves or
+                                               # comes back into the profile's bounds
+    temp_dict['milestones'] = []               # [[time, 'turning_point' / 'drying_end' / 'first_crack' / 'drop'], ...]
+                                               # as they are spotted (see milestones.py)
 
     # the following are aspirational (future implementations) sensors and calculations:
     #temp_dict['temp_target'] = []   # the target will either be calculated from the profile on the fly or pre-loaded (depending on how you end up dealing with time)
-    #temp_dict['Q_in'] = []          # Approx. of heat rate based on duty cycle of the heating element.Currently its either 100% or 0%
-    #temp_dict['E_heat'] = []        # a fake parameter approximating energy input into the beans, Q_in*dt, right?
     #temp_dict['specific_heat']=[]   # would require knowledge of Qheat or experimentally sampling the bean at various stages (assuming it changes over time)
+    # (Q_in and E_heat are added by make_controller(), when the heater is being controlled)
 
     # pre-fill the temperature readings with enough values so we can start smoothing
     # right away (at time 0:00)... assumes beans start at room temperature
     for i in range(SMOOTH_OVER):
         temp_dict['temp_actual'].append([0.0, BEAN_TEMP])
 
-    temp_dict['filepath'] = tk_ui_for_path()  # have the user enter the save location for this batch
-
-    # pull all the information about this particular bean and roast so it can be added into the batch roast file
-    temp_dict.update(get_bean_info())
-    temp_dict.update(get_batch_info())
-    temp_dict.update(generate_filename(temp_dict))
-
-    temp_dict['comments'] = raw_input("Enter optional roast comments or <Enter> to continue:  ")+" "
-
     return temp_dict
 
 def load_roast_profile():
     """
     Allows user to select a pre-existing roast profile to guide the roast.
 
-    Based on load_fake_data()
-
     Parameters:
-    	None.
+    	PROFILE_INTERPOLATION
 
     Returns:
-    	saves to profile_data (global 2D list) containing temp, time pairs in the format [[0.0, 68.1],...]
+    	saves to profile_data (global CompiledProfile) built from temp, time pairs in the format [[0.0, 68.1],...]
 
     Raises:
     """
@@ -183,15 +248,42 @@ def load_roast_profile():
         # or presumably when you cancel or don't want to use a profile.
         profile_data = None
     else:
-        prof = json.load(open(profile_file_path[0]))
-
-        # WARNING: Assumes that the profile stores temps just as the regular batch roasts with the key of 'temp_actual'
-        # this makes sense because we may want to use an actual batch as a profile.
-        # however it is vulnerable if we decide to change key names elsewhere.
-        profile_data = [[float(x),float(y)] for [x,y] in prof['temp_actual']]
+        read_roast_profile(profile_file_path[0])
         
     return
 
+def read_roast_profile(filename):
+    """
+    Loads the profile from a file into profile_data (global CompiledProfile),
+    and its bounds (if it has any) into bounds_data (global BoundsChecker)
+
+    Parameters:
+        filename: (str) the profile (or batch) file
+        PROFILE_INTERPOLATION
+        SMOOTH_FREQ
+        ALARM_DEBOUNCE
+
+    Returns:
+        None.
+
+    Raises:
+        IOError, ValueError: if the file can't be read
+    """
+
+    global profile_data, bounds_data
+
+    # WARNING: Assumes that the profile stores temps just as the regular batch roasts with the key of 'temp_actual'
+    # this makes sense because we may want to use an actual batch as a profile.
+    # however it is vulnerable if we decide to change key names elsewhere.
+    # The ones from profile_builder.py only have 'target_temp', so fall back on that.
+    # The profile is compiled into tables with an entry every SMOOTH_FREQ seconds, and those are
+    # kept in a file next to the profile, so the next time it loads instantly (see profile_compiler.py)
+    profile_data = load_profile(filename, SMOOTH_FREQ, PROFILE_INTERPOLATION)
+
+    bounds_data = None
+    if profile_data.has_bounds():
+        bounds_data = BoundsChecker(profile_data.lower, profile_data.upper, SMOOTH_FREQ, ALARM_DEBOUNCE)
+
 def get_bean_info():
     """
     Grabs information about the bean, including name, but potentially order date, region, etc.
@@ -243,7 +335,7 @@ def get_batch_info():
     # they should be identified elsewhere, perferably with the other VARIABLE definitions at the beginning
     temp_dict = {}
     temp_dict['t_ambient'] = get_ambient_f()		### THIS SHOULD PROBABLY BE 'temp_ambient'
-    temp_dict['target_temp'] = []
+    temp_dict['target_temp'] = TimeSeries()
 
     temp_dict['starting_wt'] = raw_input("Enter the starting weight in grams (example: 80)... ")
     temp_dict['run'] = raw_input("Enter the Run # (example: 5)... ")
@@ -319,7 +411,7 @@ def get_ambient_f():
     Grabs the ambient temperature reading (Fahrenheit) at the MAX31855 chip
 
     Parameters:
-        USING_FAKE_DATA
+        sensor (global)
 
     Returns:
         (float) representing a temperature (Fahrenheit)
@@ -328,10 +420,7 @@ def get_ambient_f():
         None.
     """
 
-    if USING_FAKE_DATA:
-        return 68.1
-    else:
-        return c_to_f(sensor.readInternalC())
+    return sensor.ambient_f()
 
 def check_validity(t):
     """ Determine if the temperature is a valid value
@@ -344,16 +433,19 @@ def check_validity(t):
 
 def get_valid_reading(elapsed):
     """
-    Attempts to get a single temperature reading ('F).
-    If we are using fake data, it re-directs to the get_fake_data_point function.
+    Attempts to get a single temperature reading ('F) from the (global) sensor.
+    If we are using fake data, that is a replay of a recorded roast (which can fake NaN readings, too).
 
     Sensor temperature is vulnerable to NaN so this attempts
     up to MAX_ATTEMPTS times before giving up, indicated by returning temp_is_valid == False.
+    When oversampling, the sensor already takes OVERSAMPLE readings and skips the NaNs among them,
+    so there is only one attempt.
 
     Parameters:
         elapsed: (float) time in seconds since start
-        USING_FAKE_DATA
+        sensor (global)
         MAX_ATTEMPTS
+        OVERSAMPLE
         VERBOSE
 
     Returns: 
@@ -365,133 +457,63 @@ def get_valid_reading(elapsed):
         None.
     """
 
-    
-    if USING_FAKE_DATA:
-        # get fake data
-        temp = get_fake_data_point(elapsed)
-        return temp, True         # WARNING: this assumes you have valid data... you aren't testing what happens when you get a NaN...
-                                  # It might be of value to allow the fake data to contain NaN and then pass it through the rest of the get_valid_reading function
-                                  # so you can imitate more accurately actual readings from a sensor... you can test how your system handles NaN without BBB
+    # reset counters and flags
+    temp_is_valid = False            
+    read_attempt = 0    
 
+    if OVERSAMPLE > 1:
+        max_attempts = 1
     else:
-        # get real data
-        # reset counters and flags
-        temp_is_valid = False            
-        read_attempt = 0    
+        max_attempts = MAX_ATTEMPTS
 
-        while temp_is_valid is not True and (read_attempt < MAX_ATTEMPTS):
+    while temp_is_valid is not True and (read_attempt < max_attempts):
 
-            read_attempt += 1
+        read_attempt += 1
 
-            temp = c_to_f(sensor.readTempC())    # read the sensor
+        temp = sensor.read_f(elapsed)    # read the sensor
 
-            # check that it is valid. the whole check_validity code is so short
-            # that it could be included here but it might be useful elsewhere
-            # in the program too, so i'll leave it as a function and call it.
-            temp_is_valid = check_validity(temp)
+        # check that it is valid. the whole check_validity code is so short
+        # that it could be included here but it might be useful elsewhere
+        # in the program too, so i'll leave it as a function and call it.
+        temp_is_valid = check_validity(temp)
 
-            # if you failed to get a good reading and you care to hear about it...
-            if temp_is_valid is not True and VERBOSE==True:
-                print "failed attempt", read_attempt, "... Received:", temp
+        # if you failed to get a good reading and you care to hear about it...
+        if temp_is_valid is not True and VERBOSE==True:
+            print "failed attempt", read_attempt, "... Received:", temp
 
-        # if you did have errors but want to know that you got a good value on subsequent checks
-        # this message is not necessary for operation, just intermediate-term error-checking
-        if temp_is_valid and read_attempt > 1 and VERBOSE==True:    
-            print "passed on attempt", read_attempt,"with value:", temp
+    # if you did have errors but want to know that you got a good value on subsequent checks
+    # this message is not necessary for operation, just intermediate-term error-checking
+    if temp_is_valid and read_attempt > 1 and VERBOSE==True:    
+        print "passed on attempt", read_attempt,"with value:", temp
 
-        # in theory, the thermocouple is only accurate to 6 degrees
-        # so there is no point in keeping 10 decimal places
-        if temp_is_valid:
-            temp = truncate(temp, 1)
-
-        # return the reading and whether it is valid or not (True/False)
-        return temp, temp_is_valid
-
-def get_fake_data_point(elapsed):
-    """
-    Grabs a data point from a time-temp pair list, based on elapsed time.
+    # in theory, the thermocouple is only accurate to 6 degrees
+    # so there is no point in keeping 10 decimal places
+    if temp_is_valid:
+        temp = truncate(temp, 1)
 
-    Parameters:
-        elapsed: (float) time in seconds since start        
-        fake_data (global 2D list)
-
-    Returns: 
-        (float) representing a temperature in Fahrenheit
-
-    Raises:
-        IndexError: after running out of fake data
-    """
-
-    global fake_data
-
-    i=0
-    # we know the fake data comes sorted chronologically so we'll just step through it, 
-    # ignoring all the time-temp pair that have already passed 
-    try:
-        while fake_data[i][0] < elapsed:
-            i += 1
-    except IndexError:
-        print "Came to the end of the fake data."
-
-    # cut the fake list short so we don't have to search it all again.
-    # this won't fly anymore if you remove the global functionality.
-    fake_data = fake_data[i:]
-    return fake_data[0][1]
+    # return the reading and whether it is valid or not (True/False)
+    return temp, temp_is_valid
 
 def get_profile_data_point(elapsed):
     """
-    Grabs a data point from a time-temp pair list, based on elapsed time.
-
-    Very similar to get_fake_data_point() but I've added this as a standalone function
-    since it is hard to deal with the way I did the files (using the global variables).
-
-    Parameters:
-        elapsed: (float) time in seconds since start        
-        profile_data (global 2D list)
-
-    Returns: 
-        (float) representing a temperature in Fahrenheit
-
-    Raises:
-        IndexError: after running out of fake data
-    """
-
-    global profile_data
-
-    i=0
-    # we know the profile data comes sorted chronologically so we'll just step through it, 
-    # ignoring all the time-temp pair that have already passed 
-    try:
-        while profile_data[i][0] < elapsed:
-            i += 1
-    except IndexError:
-        print "Came to the end of the profile data."
-
-    # cut the profile list short so we don't have to search it all again.
-    # this won't fly anymore if you remove the global functionality.
-    profile_data = profile_data[i:]
-    return profile_data[0][1]
-
-def smooth_data(sampled_pairs):
-    """
-    Performs some smoothing function and returns a single value (not a time, value pair)
+    Looks up the profile's target temperature at the elapsed time.
 
-    Currently, it is just an average.  Obviously this creates a lag.
+    The profile was compiled into a table (an entry every SMOOTH_FREQ seconds) when it was loaded,
+    see profile_compiler.py, so this is a single index lookup.
 
     Parameters:
-        sampled_pairs: a 2D list in for the format [[time, value], [time, value], ...]
+        elapsed: (float) time in seconds since start
+        profile_data (global CompiledProfile)
 
     Returns: 
-        
+        (float) representing a temperature in Fahrenheit.
+        Before the start or after the end of the profile, its first or last temperature.
 
     Raises:
+        None.
     """
-    
-    all_the_values = [x[1] for x in sampled_pairs]
-    average_value = sum(all_the_values) / float(len(all_the_values))
 
-    # returns a single value
-    return truncate(average_value,1)
+    return profile_data.value_at(elapsed)
 
 def calc_loss_percent(wt_start, wt_finish):
     """
@@ -559,137 +581,534 @@ def closing_sequence(original_dict):
 
 
 
-# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
-    
-   
-if __name__ == "__main__":
-    # initiate the first due dates.  This could be done earlier on but then we tend
-    # to get UnboundLocalError due to the += assignment that thappens for each event.
-    # alternatively, they could all be marked global but that seems sketchy too.
-    read_next  = READ_OFFSET
-    target_next= TARGET_OFFSET
-    smooth_next= SMOOTH_OFFSET
-    print_next = PRINT_OFFSET
-    write_next = WRITE_OFFSET
+def make_smoother(batch):
+    """
+    Creates the SMOOTH_FILTER smoothing filter and feeds it the readings already in the batch
+    (the BEAN_TEMP values generate_batch_dict() pre-fills so we can start smoothing right away).
 
-    if USING_FAKE_DATA: load_fake_data()    
+    Parameters:
+        batch: (dict) the batch dictionary
+        SMOOTH_FILTER
+        SMOOTH_OVER
 
+    Returns:
+        a filter from smoothing.py
 
+    Raises:
+        ValueError: if SMOOTH_FILTER isn't a known filter
+    """
 
-    welcome_message()
-    batch = generate_batch_dict()
-    profile = load_roast_profile()
-    display_preliminary_temps()
-    wait_for_user()
+    smoother = make_filter(SMOOTH_FILTER, SMOOTH_OVER)
+    for sample in batch['temp_actual']:
+        smoother.update(sample[1])
+    return smoother
 
+def make_ror(batch):
+    """
+    Creates the rate of rise calculator and feeds it the readings already in the batch.
 
+    Parameters:
+        batch: (dict) the batch dictionary
+        ROR_OVER
 
+    Returns:
+        a smoothing.RateOfRise
 
+    Raises:
+        ValueError: if ROR_OVER is less than 2
+    """
 
-    # and we're up and running...
-    t_initial = time.time()
+    ror = RateOfRise(ROR_OVER)
+    for sample in batch['temp_actual']:
+        ror.update(sample[0], sample[1])
+    return ror
 
-    #the try statement allows for a soft exit via Ctrl+C
-    try:
-        while True:
-            # determine how much time has elapsed (seconds)
-            elapsed = time.time() - t_initial
+def make_controller(batch):
+    """
+    Creates the heater controller and adds its series to the batch:
+        Q_in    heat rate going in (W), from the duty cycle of the heating element
+        E_heat  energy put in so far (kJ), the sum of Q_in*dt
 
-            # we don't need all that accuracy so we'll work with a truncated version of it
-            elapsed_trunc = truncate(elapsed,3)
+    Parameters:
+        batch: (dict) the batch dictionary
+        heater (global): set up by load_sensor()
+        PID_GAINS
+        HEATER_WATTS (control.py)
 
+    Returns:
+        a control.Controller
 
-            # five events happen in this loop: READ, determine the TARGET TEMP, SMOOTH, PRINT, and WRITE
-            # the basic flow goes like this:
-            # if we reached or passed the due date (total elapsed time in seconds) for the event:
-                # do it
-                # then determine the next time this event will be run
+    Raises:
+        None.
+    """
 
+    batch['Q_in'] = TimeSeries()
+    batch['E_heat'] = TimeSeries()
+    return Controller(PID(*PID_GAINS), heater, HEATER_WATTS)
 
+def read_event(batch, smoother, ror, elapsed):
+    """
+    READ: grabs the temperature from the sensor and records it in the batch.
 
-            # READ SENSORS
-            if elapsed >= read_next:
+    Parameters:
+        batch: (dict) the batch dictionary
+        smoother: the smoothing filter, which gets every valid reading
+        ror: the rate of rise calculator, which gets them too
+        elapsed: (float) time in seconds since start
 
-                # grab the temperature from the sensor
-                temp, temp_is_valid = get_valid_reading(elapsed)
-                
-                # write it to the batch dictionary
-                if temp_is_valid:
-                    batch['temp_actual'].append([elapsed_trunc, temp])
-                else:
-                    # we're fine just ignoring bad readings,
-                    # the time-series approach for storing batchs facilitates this
-                    pass
+    Returns:
+        None.
 
-                read_next += READ_FREQ
+    Raises:
+        None.
+    """
 
+    # we don't need all that accuracy so we'll work with a truncated version of it
+    elapsed_trunc = truncate(elapsed,3)
 
+    # grab the temperature from the sensor
+    temp, temp_is_valid = get_valid_reading(elapsed)
 
-            # GET TARGET TEMP
-            if elapsed >= target_next and profile_data:
+    # write it to the batch dictionary
+    if temp_is_valid:
+        batch['temp_actual'].append([elapsed_trunc, temp])
+        smoother.update(temp)
+        ror.update(elapsed_trunc, temp)
+    else:
+        # we're fine just ignoring bad readings,
+        # the time-series approach for storing batchs facilitates this
+        pass
 
-                # grab the temperature from the sensor
-                target = get_profile_data_point(elapsed)
-                
-                # write it to the batch dictionary
-                batch['target_temp'].append([elapsed_trunc, target])
+def drain_event(batch, smoother, ror, reader, elapsed):
+    """
+    READ (threaded version): collects the readings the background SensorReader has taken
+    since the last pass and records them in the batch.
 
-                target_next += TARGET_FREQ
+    Each reading keeps the time stamp from when it was taken, not when it was collected.
 
+    Parameters:
+        batch: (dict) the batch dictionary
+        smoother: the smoothing filter, which gets every valid reading
+        ror: the rate of rise calculator, which gets them too
+        reader: (SensorReader) the running reader thread
+        elapsed: (float) time in seconds since start (unused, but all events take it)
 
+    Returns:
+        None.
+
+    Raises:
+        Whatever stopped the reader thread, if it died.
+    """
+
+    for when, temp, temp_is_valid in reader.drain():
+        if temp_is_valid:
+            when = truncate(when,3)
+            batch['temp_actual'].append([when, temp])
+            smoother.update(temp)
+            ror.update(when, temp)
+
+def target_event(batch, elapsed):
+    """ TARGET: looks up the target temperature in the profile (if there is one) and records it in the batch.
+    """
+
+    if not profile_data:
+        return
+
+    elapsed_trunc = truncate(elapsed,3)
+    target = get_profile_data_point(elapsed)
+    batch['target_temp'].append([elapsed_trunc, target])
+
+def smooth_event(batch, smoother, ror, detector, elapsed):
+    """
+    SMOOTH: records the current smoothed temperature (and rate of rise) in the batch.
+
+    The sensor reading is really noisy and jumps around a lot.
+    It's not reliable to use for controlling yet.  It must be smoothed my some means.
+    The smoother has already seen every reading (see read_event), so this is just a lookup.
+    With SMOOTH_FILTER = 'mean' the result is the same as averaging the last SMOOTH_OVER readings.
+
+    If the profile has bounds, the smoothed temperature is also checked against them
+    and any alarm is recorded in batch['alarms'].
+
+    The milestone detector gets the smoothed temperature and rate of rise too, and any
+    milestone it spots is recorded in batch['milestones'].
+    """
+
+    elapsed_trunc = truncate(elapsed,3)
+    smoothed = truncate(smoother.value,1)
+
+    # add that value to the batch dictionary
+    batch['temp_smooth'].append([elapsed_trunc, smoothed])
+    # the rate of rise needs readings at two different times before there is one
+    if ror.value is not None:
+        batch['temp_ror'].append([elapsed_trunc, truncate(ror.value,1)])
+
+    milestone = detector.update(elapsed_trunc, smoothed, ror.value)
+    if milestone:
+        batch['milestones'].append(milestone)
+
+    if bounds_data:
+        alarm = bounds_data.update(elapsed, smoothed)
+        if alarm:
+            batch['alarms'].append([elapsed_trunc, alarm])
+
+def control_event(batch, controller, smoother, ror, elapsed):
+    """
+    CONTROL: sets the heater's duty cycle to bring the smoothed temperature to the profile's target,
+    and records the heat going in (Q_in) and the energy so far (E_heat) in the batch.
+    """
+
+    elapsed_trunc = truncate(elapsed,3)
+    target = get_profile_data_point(elapsed)
+    duty, q_in, e_heat = controller.update(elapsed, target, smoother.value, ror.value)
+    batch['Q_in'].append([elapsed_trunc, truncate(q_in,1)])
+    batch['E_heat'].append([elapsed_trunc, truncate(e_heat,3)])
+
+def print_event(batch, elapsed):
+    """ PRINT: prints the desired info from the batch dictionary to the screen, with formatting
+    """
+
+    # flag it on the line while the roast is outside of the profile's bounds
+    alarm = ""
+    if bounds_data and bounds_data.state != OK:
+        alarm = ALARM_MESSAGES[bounds_data.state]
+
+    ror = "--"
+    if len(batch['temp_ror']):
+        ror = "%.1f" % batch['temp_ror'][-1][1]
+
+    # how long it has been since the last milestone, ex: "1C +01:05" is the development time so far
+    since = ""
+    if batch['milestones']:
+        when, name = batch['milestones'][-1]
+        since = "%s +%s  " % (LABELS[name], convert_time(elapsed - when))
+
+    # and how hard the heater is working, when it is being controlled
+    if batch.get('Q_in'):
+        since = "Heat: %3i%%  %s" % (round(100.0 * batch['Q_in'][-1][1] / HEATER_WATTS), since)
+
+    if profile_data:
+        print 'Time: %s\tBean: %.1f\tAverage: %.1f\tRoR: %s\tTarget: %.1f\t%s%s%s' % (convert_time(elapsed), batch['temp_actual'][-1][1], batch['temp_smooth'][-1][1], ror, batch['target_temp'][-1][-1], since, alarm, FAKE_MESSAGE)
+    else: print 'Time: %s\tBean: %.1f\tAverage: %.1f\tRoR: %s\t%s%s' % (convert_time(elapsed), batch['temp_actual'][-1][1], batch['temp_smooth'][-1][1], ror, since, FAKE_MESSAGE)
+
+def load_similarity_index():
+    """
+    Loads the similarity index of the past roasts (see similarity.py).
+
+    Parameters:
+        SHOW_SIMILAR
+
+    Returns:
+        a SimilarityIndex, or None if it is turned off, hasn't been built, or numpy isn't installed
+
+    Raises:
+        None.
+    """
+
+    if not SHOW_SIMILAR:
+        return None
+    try:
+        from similarity import SimilarityIndex
+        index = SimilarityIndex()
+    except (ImportError, IOError, ValueError):
+        return None
+    if not len(index):
+        return None
+    return index
+
+def similar_event(batch, index, elapsed):
+    """ SIMILAR: prints the past roasts that have gone most like this one so far.
+    """
+
+    matches = index.query(batch, SIMILAR_K, milestones=batch['milestones'])
+    if matches:
+        print 'Most like: %s' % ', '.join("%s (%.1f)" % (os.path.basename(path), distance) for distance, path in matches)
+
+def write_event(batch, journal, elapsed):
+    """
+    WRITE: "backs up" the batch dictionary by appending the new readings to the journal.
+
+    If you knew that the program wouldn't crash, you could just do this once, at the end.
+    The journal is turned into the regular export file by the final write (journal.compact())
+    or, after a crash, with:  python journal.py <the .journal file>
+    """
+
+    journal.checkpoint(batch)
+
+def make_clock():
+    """
+    Picks the clock the roast runs on. Only fake data can be played back faster than real time.
+
+    Parameters:
+        USING_FAKE_DATA
+        REPLAY_SPEED
+
+    Returns:
+        a SystemClock, ScaledClock or VirtualClock (see clock.py)
+
+    Raises:
+        None.
+    """
+
+    if not USING_FAKE_DATA or REPLAY_SPEED == 1:
+        return SystemClock()
+    if REPLAY_SPEED == 0:
+        return VirtualClock()
+    return ScaledClock(REPLAY_SPEED)
+
+def schedule_events(batch, journal, smoother, ror, detector, reader=None, clock=None, controller=None, index=None):
+    """
+    Sets up the five events of the roast loop: READ, determine the TARGET TEMP, SMOOTH, PRINT, and WRITE
+    (plus CONTROL, right after SMOOTH, when there is a controller, and SIMILAR after PRINT when there is an index)
+
+    They are added in that order so that, when several come due at the same time, they still
+    run in that order (READ before SMOOTH, SMOOTH before PRINT, etc.)
+
+    Parameters:
+        batch: (dict) the batch dictionary
+        journal: (Journal) where WRITE backs up the batch
+        smoother: the smoothing filter (see make_smoother)
+        ror: the rate of rise calculator (see make_ror)
+        detector: (MilestoneDetector) spots the milestones, see milestones.py
+        reader: (SensorReader) optional. If given, READ collects that thread's readings
+            instead of reading the sensor itself.
+        clock: clock with now() and sleep() (see make_clock), the real one if not given
+        controller: (control.Controller) optional, see make_controller
+        index: (similarity.SimilarityIndex) optional, see load_similarity_index
 
-            # SMOOTHING DATA
-            # the sensor reading is really noisy and jumps around a lot.
-            # It's not reliable to use for controlling yet.  It must be smoothed my some means.
-            if elapsed >= smooth_next:
-                
-                # send the last x time-and-temperature pairs to the smoothing function
-                smoothed = smooth_data(batch['temp_actual'][-SMOOTH_OVER:])
+    Returns:
+        a Scheduler, ready to run()
 
-                # add that value to the batch dictionary
-                batch['temp_smooth'].append([elapsed_trunc, smoothed])
+    Raises:
+        None.
+    """
 
-                smooth_next += SMOOTH_FREQ
+    if clock is None:
+        clock = SystemClock()
+    sched = Scheduler(clock.now, clock.sleep)
+    if reader is None:
+        sched.add('READ', READ_FREQ, READ_OFFSET, lambda elapsed: read_event(batch, smoother, ror, elapsed))
+    else:
+        sched.add('READ', READ_FREQ, READ_OFFSET, lambda elapsed: drain_event(batch, smoother, ror, reader, elapsed))
+    sched.add('TARGET', TARGET_FREQ, TARGET_OFFSET, lambda elapsed: target_event(batch, elapsed))
+    sched.add('SMOOTH', SMOOTH_FREQ, SMOOTH_OFFSET, lambda elapsed: smooth_event(batch, smoother, ror, detector, elapsed))
+    if controller:
+        sched.add('CONTROL', CONTROL_FREQ, CONTROL_OFFSET, lambda elapsed: control_event(batch, controller, smoother, ror, elapsed))
+    sched.add('PRINT',  PRINT_FREQ,  PRINT_OFFSET,  lambda elapsed: print_event(batch, elapsed))
+    if index:
+        sched.add('SIMILAR', SIMILAR_FREQ, SIMILAR_OFFSET, lambda elapsed: similar_event(batch, index, elapsed))
+    sched.add('WRITE',  WRITE_FREQ,  WRITE_OFFSET,  lambda elapsed: write_event(batch, journal, elapsed))
+
+    return sched
+
+def report_timing(sched):
+    """ Prints how well the scheduler kept up and, when oversampling, how many of the sensor's
+    readings were NaN. But only if something went wrong (or VERBOSE is on).
+    """
 
+    for name, runs, missed, max_late in sched.stats():
+        if missed or VERBOSE:
+            print "%-6s ran %5i times, skipped %3i, worst lateness %.1f ms" % (name, runs, missed, max_late*1000)
+    # the oversampler leaves NaN readings out instead of retrying them, this is where they show up
+    if isinstance(sensor, OversamplingSensor) and (sensor.nan_count or VERBOSE):
+        print "SENSOR read %5i times, NaN %5i (%.1f%%)" % (sensor.reads, sensor.nan_count,
+                                                          100.0 * sensor.nan_count / max(sensor.reads, 1))
 
-            # PRINT TO TERMINAL
-            if elapsed >= print_next:
+def run_roast(batch, journal, clock, until=None):
+    """
+    The roast loop itself: runs the five events until Ctrl+C (or until the time is up).
 
-                # prints the desired info from the batch dictionary to the screen, with formatting
-                if profile_data: 
-                    print 'Time: %s\tBean: %.1f\tAverage: %.1f\tTarget: %.1f\t%s' % (convert_time(elapsed), batch['temp_actual'][-1][1], batch['temp_smooth'][-1][1], batch['target_temp'][-1][-1], FAKE_MESSAGE)
-                else: print 'Time: %s\tBean: %.1f\tAverage: %.1f\t%s' % (convert_time(elapsed), batch['temp_actual'][-1][1], batch['temp_smooth'][-1][1], FAKE_MESSAGE)
+    Everything that happens in here gets its time from the clock, so with a VirtualClock
+    the whole roast runs as fast as the computer allows and comes out the same every time.
 
-                print_next += PRINT_FREQ
+    Parameters:
+        batch: (dict) the batch dictionary
+        journal: (Journal) where WRITE backs up the batch
+        clock: clock with now() and sleep() (see make_clock)
+        until: (float) optional number of elapsed seconds after which to stop
+        THREADED_READ
+        heater (global): when there is one and a profile to follow, CONTROL drives it.
+            It is always turned off on the way out.
 
+    Returns:
+        the Scheduler, for its stats
 
-            # WRITE TO FILE
-            # this is the export file.  If you knew that the program wouldn't crash, you could just
-            # do this once, at the end.   Until then, it "backs up" the batch dictionary on
-            # the WRITE_FREQ interval if we reached the due date for the next event.
-            if elapsed >= write_next:
+    Raises:
+        None.
+    """
 
-                # this really should use the WITH statement
-                # from: https://stackoverflow.com/questions/11026959/python-writing-dict-to-txt-file-and-reading-dict-from-txt-file
-                json.dump(batch, open(batch['full_filename'], 'w'))
+    # five events happen in the loop: READ, determine the TARGET TEMP, SMOOTH, PRINT, and WRITE
+    # the scheduler sleeps until the next one is due, runs it, then determines the next
+    # time this event will be run
+    reader = None
+    if THREADED_READ and isinstance(clock, VirtualClock):
+        print "THREADED_READ is ignored with a virtual clock (ex: REPLAY_SPEED = 0)"
+    elif THREADED_READ:
+        reader = SensorReader(get_valid_reading, READ_FREQ, READ_OFFSET, capacity=READ_BUFFER,
+                              scheduler=Scheduler(clock.now, clock.sleep))
+    smoother = make_smoother(batch)
+    ror = make_ror(batch)
+    controller = None
+    if heater and profile_data:
+        controller = make_controller(batch)
+    elif heater:
+        print "CONTROL needs a profile to follow, the heater stays off"
+        heater.off()
+    sched = schedule_events(batch, journal, smoother, ror, MilestoneDetector(), reader, clock, controller,
+                            load_similarity_index())
 
-                # and then schedule the next event
-                write_next += WRITE_FREQ
+    # and we're up and running...
+    sched.start()
+    if reader:
+        # the reader shares the scheduler's time zero so the time stamps line up
+        reader.start_at(sched.t_initial)
 
+    #the try statement allows for a soft exit via Ctrl+C
+    try:
+        sched.run(until)
 
     except KeyboardInterrupt:
         # this is the soft exit
         print "\n"
         pass
 
+    finally:
+        # whatever happened, don't leave the heater on
+        if controller:
+            controller.off()
+
+    if reader:
+        # pick up whatever was read after the last pass
+        reader.stop(READ_FREQ*2)
+        drain_event(batch, smoother, ror, reader, sched.elapsed())
+        if reader.buffer.overflows:
+            print "WARNING: %i readings were dropped because the main loop fell behind." % reader.buffer.overflows
+
+    return sched
+
+def simulate_roast(replay_filename, profile_filename=None, filepath='./'):
+    """
+    Runs a whole roast on a virtual clock, replaying a recorded roast, without asking the user anything.
+
+    The result only depends on the files and the settings at the top of this file,
+    so two runs write exactly the same batch file. Good for benchmarking and for checking
+    that a change to the loop didn't change the output.
+
+    Parameters:
+        replay_filename: (str) roast file whose temp_actual readings play the sensor
+        profile_filename: (str) optional profile to follow
+        filepath: (str) where to save the batch, ending in '/'
+
+    Returns:
+        the batch dictionary (also written to batch['full_filename'])
+
+    Raises:
+        IOError, ValueError: if the files can't be read
+    """
+
+    global sensor, profile_data, bounds_data, heater
+
+    sensor = RecordedFileSensor(replay_filename, FAKE_FAULTS, FAKE_NAN_EVERY)
+    if OVERSAMPLE > 1:
+        sensor = OversamplingSensor(sensor, OVERSAMPLE, OVERSAMPLE_COMBINE)
+    heater = None
+    profile_data = None
+    bounds_data = None
+    if profile_filename:
+        read_roast_profile(profile_filename)
+
+    return run_simulation("simulated replay of %s " % replay_filename, filepath, sensor.duration())
+
+def simulate_control(profile_filename, filepath='./'):
+    """
+    Runs a whole roast on a virtual clock with the heater controlled, on the ThermalPlant model
+    (see control.py) instead of a roaster. For trying out PID_GAINS and CONTROL_FREQ without the beaglebone.
+
+    Like simulate_roast(), two runs write exactly the same batch file.
+
+    Parameters:
+        profile_filename: (str) the profile to follow
+        filepath: (str) where to save the batch, ending in '/'
+
+    Returns:
+        the batch dictionary (also written to batch['full_filename']), with Q_in and E_heat
+
+    Raises:
+        IOError, ValueError: if the profile can't be read
+    """
+
+    global sensor, profile_data, bounds_data, heater
+
+    sensor = heater = ThermalPlant(watts=HEATER_WATTS)
+    profile_data = None
+    bounds_data = None
+    read_roast_profile(profile_filename)
+
+    # to the end of the profile
+    until = (len(profile_data) - 1) * profile_data.step
+    return run_simulation("simulated control of %s " % profile_filename, filepath, until)
+
+def run_simulation(comments, filepath, until):
+    """ The part simulate_roast() and simulate_control() share: runs the roast and saves the batch.
+    """
+
+    batch = empty_batch_dict()
+    batch['filepath'] = filepath
+    batch['beanName'] = 'TEST_SIMULATED'
+    batch['run'] = 99
+    batch['starting_wt'] = 99
+    batch['t_ambient'] = get_ambient_f()
+    batch['target_temp'] = TimeSeries()
+    batch['comments'] = comments
+    batch.update(generate_filename(batch))
+
+    journal = Journal(batch['full_filename'])
+    sched = run_roast(batch, journal, VirtualClock(), until)
+    report_timing(sched)
+    journal.compact(batch)
+
+    return batch
+
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+    
+   
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--simulate':
+        # python roast.py --simulate <roast file to replay> [profile file]
+        simulate_roast(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        sys.exit()
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--simulate-control':
+        # python roast.py --simulate-control <profile file>
+        simulate_control(sys.argv[2])
+        sys.exit()
+
+    load_sensor()    
+
+
+
+    welcome_message()
+    batch = generate_batch_dict()
+    profile = load_roast_profile()
+    display_preliminary_temps()
+    wait_for_user()
+
+    journal = Journal(batch['full_filename'])
+    # stop when we run out of fake data (the real sensor never runs out)
+    sched = run_roast(batch, journal, make_clock(), sensor.duration())
 
+    report_timing(sched)
 
     # add post-roast data, calculations, and comments
     batch.update(closing_sequence(batch))
 
     # do a final write to the output file so as not to lose the last bit of data that may have
     # accumulated since the last write and post-roast additions as well as the closing_sequence().
-    json.dump(batch, open(batch['full_filename'], 'w'))
+    # This replaces the journal with the complete batch file.
+    journal.compact(batch)
     print "\ncomplete.\n"
 
 
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+
+# A compact binary roast file, for when the json ones get too slow to read.
+#
+# A json batch file spends 30-60 characters on every [time, value] pair, and all of it has
+# to be parsed just to look at one series. In this format each series is stored as two
+# columns (times, values) of fixed-point numbers, delta-encoded in chunks:
+#
+#   MAGIC                              8 bytes
+#   header length                      4 bytes, little-endian
+#   header                             json: the metadata (every key that isn't a series)
+#                                      and, for every series, its scales and chunk index
+#   chunks                             the samples
+#
+# A chunk holds up to CHUNK_SIZE samples. Each of its two columns is the differences between
+# consecutive fixed-point numbers (ex: 0.2 s = 2000 at a time scale of 10000, 68.1 'F = 681 at
+# a value scale of 10), stored as int16 when they fit, otherwise int32. The first number of
+# the chunk is in the chunk index, so every chunk can be decoded on its own. A column whose
+# numbers don't fit fixed point is stored as plain doubles instead, so nothing is ever rounded.
+#
+# The header also lists, per column, the samples that were ints in the json (see timeseries.py)
+# so that converting back gives the same file.
+#
+# The chunk index also has the first and last time of each chunk, so reading a time window
+# only decodes the chunks that overlap it. The file is memory-mapped, so the rest of it isn't
+# even read off the disk.
+#
+# To convert:   python roastbin.py <roast file>     .txt/.json -> .rbin, or .rbin -> .txt
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+from timeseries import TimeSeries, is_pair_list
+
+MAGIC = b'ROASTBIN'
+BIN_EXT = '.rbin'
+CHUNK_SIZE = 512
+MAX_DECIMALS = 6                # finest fixed point tried, 10**-6
+
+INT_TYPES = (('h', -2**15, 2**15 - 1), ('i', -2**31, 2**31 - 1))
+
+
+def fixed_point_scale(numbers):
+    """
+    Finds the smallest power of 10 that turns all the numbers into integers exactly.
+
+    Parameters:
+        numbers: sequence of floats
+
+    Returns:
+        (int) the scale, ex: 10 for 68.1, or None if there isn't one up to 10**MAX_DECIMALS
+
+    Raises:
+        None.
+    """
+
+    for decimals in range(MAX_DECIMALS + 1):
+        scale = 10 ** decimals
+        if all(round(x * scale) / float(scale) == x for x in numbers):
+            return scale
+    return None
+
+def encode_column(numbers, scale):
+    """
+    Encodes one column of a chunk.
+
+    Returns:
+        (first, code, data): the first fixed-point number (None for doubles),
+        the array typecode of the data and the data itself (bytes)
+    """
+
+    if scale is not None:
+        ints = [int(round(x * scale)) for x in numbers]
+        deltas = [b - a for a, b in zip(ints, ints[1:])]
+        for code, low, high in INT_TYPES:
+            if all(low <= d <= high for d in deltas):
+                column = array(code, deltas)
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                return ints[0], code, column.tostring()
+    column = array('d', numbers)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return None, 'd', column.tostring()
+
+def decode_column(buf, offset, n, first, code, scale):
+    """
+    Decodes one column of a chunk.
+
+    Returns:
+        (list) n floats
+    """
+
+    column = array(code)
+    count = n if code == 'd' else n - 1
+    column.fromstring(buf[offset:offset + count * column.itemsize])
+    if sys.byteorder != 'little':
+        column.byteswap()
+    if code == 'd':
+        return column.tolist()
+
+    scale = float(scale)
+    numbers = [first / scale]
+    total = first
+    for d in column:
+        total += d
+        numbers.append(total / scale)
+    return numbers
+
+def split_series(batch):
+    """ (meta, series): the numeric [[time, value], ...] series of the batch, and everything else.
+    """
+
+    meta = {}
+    series = {}
+    for key, value in batch.items():
+        if isinstance(value, TimeSeries):
+            series[key] = value
+            continue
+        if is_pair_list(value):
+            try:
+                series[key] = TimeSeries(value)
+                continue
+            except TypeError:
+                pass                # ex: the alarms, [[time, 'over'], ...]
+        meta[key] = value
+    return meta, series
+
+def write_roast(batch, path, chunk_size=CHUNK_SIZE):
+    """
+    Writes a batch dictionary in the binary format.
+
+    Like journal.write_atomically(), it writes a temporary file and renames it into place.
+
+    Parameters:
+        batch: (dict) the batch dictionary, series as lists or TimeSeries
+        path: (str) where to write it
+        chunk_size: (int) samples per chunk
+
+    Returns:
+        None.
+
+    Raises:
+        IOError: if the file can't be written
+    """
+
+    meta, series = split_series(batch)
+    header = {'meta': meta, 'series': {}}
+    chunks = []
+    offset = 0
+    for key in sorted(series):
+        t, v = series[key].times(), series[key].values()
+        t_scale = fixed_point_scale(t)
+        v_scale = fixed_point_scale(v)
+        index = []
+        for start in range(0, len(t), chunk_size):
+            stop = min(start + chunk_size, len(t))
+            t0, t_code, t_data = encode_column(t[start:stop], t_scale)
+            v0, v_code, v_data = encode_column(v[start:stop], v_scale)
+            index.append([offset, stop - start, t[start], t[stop - 1], t0, t_code, v0, v_code, len(t_data)])
+            chunks.append(t_data)
+            chunks.append(v_data)
+            offset += len(t_data) + len(v_data)
+        header['series'][key] = {'n': len(t), 't_scale': t_scale, 'v_scale': v_scale, 'chunks': index,
+                                 't_ints': series[key].t_ints.tolist(), 'v_ints': series[key].v_ints.tolist()}
+
+    header = json.dumps(header).encode('utf-8')
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for data in chunks:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+
+class RoastFile(object):
+    """
+    Reads a binary roast file, only as much of it as you ask for.
+
+    Parameters:
+        path: (str) the .rbin file
+
+    Raises:
+        IOError: if the file can't be read
+        ValueError: if it isn't a binary roast file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:len(MAGIC)] != MAGIC:
+            self.buf.close()
+            raise ValueError("%s isn't a binary roast file" % path)
+        start = len(MAGIC) + 4
+        (size,) = struct.unpack('<I', self.buf[len(MAGIC):start])
+        header = json.loads(self.buf[start:start + size].decode('utf-8'))
+        self.data_start = start + size
+        self.meta = header['meta']
+        self.index = header['series']
+
+    def close(self):
+        self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def keys(self):
+        return sorted(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, key, t_start=None, t_end=None):
+        """
+        Reads one series, or just the samples with t_start <= time <= t_end.
+
+        Parameters:
+            key: (str) the series, ex: 'temp_smooth'
+            t_start, t_end: (float) optional time window, in seconds
+
+        Returns:
+            a TimeSeries
+
+        Raises:
+            KeyError: if there is no such series
+        """
+
+        info = self.index[key]
+        chunks = info['chunks']
+        if t_start is None:
+            first = 0
+        else:
+            # the first chunk that ends at or after t_start
+            first = bisect_left([c[3] for c in chunks], t_start)
+
+        series = TimeSeries()
+        # where the ints are, counted from the first chunk read
+        skipped = sum(c[1] for c in chunks[:first])
+        for name in ('t_ints', 'v_ints'):
+            getattr(series, name).extend(i - skipped for i in info.get(name, ()) if i >= skipped)
+        for offset, n, c_start, c_end, t0, t_code, v0, v_code, t_size in chunks[first:]:
+            if t_end is not None and c_start > t_end:
+                break
+            offset += self.data_start
+            times = decode_column(self.buf, offset, n, t0, t_code, info['t_scale'])
+            values = decode_column(self.buf, offset + t_size, n, v0, v_code, info['v_scale'])
+            series.t.extend(times)
+            series.v.extend(values)
+        if len(series.t) < info['n'] - skipped:
+            # stopped early, at t_end
+            series.t_ints = array('l', [i for i in series.t_ints if i < len(series.t)])
+            series.v_ints = array('l', [i for i in series.v_ints if i < len(series.v)])
+
+        if t_start is not None or t_end is not None:
+            lo = float('-inf') if t_start is None else t_start
+            hi = float('inf') if t_end is None else t_end
+            series = series.between(lo, hi).to_series()
+        return series
+
+    def to_batch(self, keys=None, t_start=None, t_end=None):
+        """
+        The batch dictionary: the metadata plus the series (all of them, or just keys).
+
+        Returns:
+            (dict) like loader.load_roast(), series as TimeSeries. Missing keys are left out.
+        """
+
+        batch = dict(self.meta)
+        for key in (self.keys() if keys is None else keys):
+            if key in self.index:
+                batch[key] = self.read(key, t_start, t_end)
+        return batch
+
+
+def json_to_bin(src, dst=None):
+    """ Converts a json batch file to the binary format. Returns the new file's name.
+    """
+
+    if dst is None:
+        dst = os.path.splitext(src)[0] + BIN_EXT
+    with open(src) as f:
+        write_roast(json.load(f), dst)
+    return dst
+
+def bin_to_json(src, dst=None):
+    """ Converts a binary roast file back to a json batch file. Returns the new file's name.
+    """
+
+    from journal import write_atomically
+
+    if dst is None:
+        dst = os.path.splitext(src)[0] + '.txt'
+    with RoastFile(src) as roast:
+        write_atomically(roast.to_batch(), dst)
+    return dst
+
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:]:
+        if name.endswith(BIN_EXT):
+            print "%s -> %s" % (name, bin_to_json(name))
+        else:
+            print "%s -> %s" % (name, json_to_bin(name))
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+# Rate of rise for roasts that were made before roast.py recorded it.
+#
+# During the roast, smoothing.RateOfRise fits a line through the last ROR_OVER readings every
+# time one comes in. ror_values() does the same thing to a whole series at once: the sums of
+# t, v, t*t and t*v over every window come from cumulative sums, so there is no loop over the
+# readings at all. It gives the same numbers as the live version (to float error).
+#
+# backfill() adds a temp_ror series to every batch file in the library that doesn't have one,
+# reading and working them out over a pool of worker processes. Only json batch files can
+# hold the new series; the csv files are left alone (import them first, see importer.py).
+#
+#   python ror.py [folders, default: library, incoming_roasts]
+#   python ror.py --force incoming_roasts          (redo the ones that already have it)
+
+import argparse
+import json
+import multiprocessing
+
+import numpy as np
+
+from importer import ROOTS, detect, roast_files
+from journal import write_atomically
+from modGregory import truncate
+from smoothing import ROR_OVER
+
+SOURCE = 'temp_actual'
+KEY = 'temp_ror'
+
+
+def window_sums(x, n):
+    """ Sum of x over the last n entries (fewer at the start) at every index.
+    """
+
+    c = np.concatenate(([0.0], np.cumsum(x)))
+    ends = np.arange(1, len(x) + 1)
+    return c[ends] - c[np.maximum(ends - n, 0)]
+
+def ror_values(times, values, n=ROR_OVER):
+    """
+    Rate of rise at every reading: the slope of the least-squares line through the last
+    n readings (fewer at the start), in degrees per minute.
+
+    Parameters:
+        times: numpy array of the reading times (seconds)
+        values: numpy array of the readings
+        n: (int) readings per window
+
+    Returns:
+        numpy array, NaN where the window doesn't hold two different times yet
+
+    Raises:
+        None.
+    """
+
+    # relative to the first time, so the squares stay small
+    t = np.asarray(times, dtype=float)
+    if not len(t):
+        return np.empty(0)
+    t = t - t[0]
+    v = np.asarray(values, dtype=float)
+
+    m = np.minimum(np.arange(1, len(t) + 1), n).astype(float)
+    st = window_sums(t, n)
+    sv = window_sums(v, n)
+    stt = window_sums(t * t, n)
+    stv = window_sums(t * v, n)
+
+    spread = m * stt - st * st
+    ror = np.full(len(t), np.nan)
+    ok = spread > 1e-9 * m * stt
+    ror[ok] = 60.0 * (m[ok] * stv[ok] - st[ok] * sv[ok]) / spread[ok]
+    return ror
+
+def ror_series(pairs, n=ROR_OVER):
+    """
+    The temp_ror series for a [[time, temp], ...] series, as roast.py would have recorded it.
+
+    Returns:
+        [[time, rate of rise], ...] (truncated to 0.1, like the live one)
+    """
+
+    if not len(pairs):
+        return []
+    a = np.asarray(pairs, dtype=float)
+    ror = ror_values(a[:, 0], a[:, 1], n)
+    return [[t, truncate(r, 1)] for t, r in zip(a[:, 0].tolist(), ror.tolist()) if r == r]
+
+def backfill_one(job):
+    """
+    Adds temp_ror to one batch file. Meant for a worker process.
+
+    Parameters:
+        job: (path, n, force)
+
+    Returns:
+        (path, what happened): 'added', 'had it', or why it was skipped
+    """
+
+    path, n, force = job
+    try:
+        if detect(path) != 'json':
+            return path, "not a batch file (import it first)"
+        # plain json, not TimeSeries, so everything else is written back the way it was read
+        with open(path) as f:
+            batch = json.load(f)
+        if not isinstance(batch, dict) or SOURCE not in batch:
+            return path, "no %s" % SOURCE
+        if KEY in batch and not force:
+            return path, "had it"
+        batch[KEY] = ror_series(batch[SOURCE], n)
+        write_atomically(batch, path)
+        return path, "added"
+    except (IOError, OSError, ValueError, TypeError, IndexError) as e:
+        return path, "%s: %s" % (e.__class__.__name__, e)
+
+def backfill(roots=ROOTS, n=ROR_OVER, force=False, workers=None):
+    """
+    Adds temp_ror to every batch file under the roots that doesn't have it yet.
+
+    Parameters:
+        roots: list of folders
+        n: (int) readings per window, ex: ROR_OVER
+        force: (bool) recalculate it for the files that already have it
+        workers: (int) processes to use. None uses one per cpu, 1 does it all right here.
+
+    Returns:
+        list of (path, what happened), see backfill_one()
+
+    Raises:
+        None.
+    """
+
+    jobs = [(path, n, force) for path in roast_files(roots)]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        return [backfill_one(job) for job in jobs]
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(backfill_one, jobs, chunksize=4)
+    finally:
+        pool.close()
+        pool.join()
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Add the rate of rise (temp_ror) to past roasts.")
+    parser.add_argument('roots', nargs='*', default=ROOTS, help="folders to go through")
+    parser.add_argument('--over', type=int, default=ROR_OVER, help="readings to fit the line through")
+    parser.add_argument('--force', action='store_true', help="redo files that already have temp_ror")
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    results = backfill(args.roots, args.over, args.force, args.workers)
+    added = 0
+    for path, what in results:
+        if what == 'added':
+            added += 1
+        elif what != 'had it':
+            print "skipped %s: %s" % (path, what)
+    print "added %s to %i of %i files" % (KEY, added, len(results))
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+# Event scheduler for the roast loop.
+#
+# The old main loop polled time.time() as fast as it could and compared it against a
+# due date for each event (read_next, smooth_next, ...). That kept a core at 100% the whole
+# roast. Here, the due dates live in a priority queue (heapq) and we sleep until the
+# earliest one comes up.
+
+import heapq
+import math
+import time
+
+from clock import monotonic
+
+# What to do when an event is so late that one or more of its due dates have already passed:
+SKIP  = 'skip'     # run it once, then jump ahead to the next due date that is still in the future
+BURST = 'burst'    # run it once for every missed due date (the behavior of the old polling loop)
+
+
+class Event(object):
+    """
+    A single periodic event (READ, SMOOTH, etc.) and its bookkeeping.
+
+    The due dates are always offset + count*freq, calculated fresh each time rather than
+    accumulated with +=, so float error doesn't drift the schedule over a long roast.
+    """
+
+    def __init__(self, name, freq, offset, action, catch_up, order):
+        self.name = name
+        self.freq = float(freq)
+        self.offset = float(offset)
+        self.action = action          # called as action(elapsed)
+        self.catch_up = catch_up
+        self.order = order            # registration order, used to break ties
+        self.count = 0                # index of the next due date
+        self.runs = 0                 # how many times the action has actually been called
+        self.missed = 0               # due dates skipped over (SKIP only)
+        self.max_late = 0.0           # worst lateness (seconds) seen so far
+
+    def due(self):
+        return self.offset + self.count * self.freq
+
+
+class Scheduler(object):
+    """
+    Runs periodic events at fixed frequencies, sleeping in between.
+
+    Events that come due at the same moment run in the order they were added, so adding them
+    in the order READ, TARGET, SMOOTH, PRINT, WRITE reproduces the order of the old loop.
+    All the events that are due when the scheduler wakes up see the same elapsed time,
+    just like they all shared one 'elapsed' per pass of the old loop.
+
+    Parameters:
+        clock: function returning the current time in seconds (monotonic)
+        sleep: function that waits for a given number of seconds
+    """
+
+    def __init__(self, clock=monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.events = []
+        self.queue = []           # heap of (due, order, event)
+        self.t_initial = None
+        self.running = False
+
+    def add(self, name, freq, offset, action, catch_up=SKIP):
+        """
+        Registers an event.
+
+        Parameters:
+            name: (str) used in the stats, ex: 'READ'
+            freq: (float) seconds between due dates
+            offset: (float) seconds from the start until the first due date
+            action: function called as action(elapsed)
+            catch_up: SKIP or BURST, see the top of this file
+
+        Returns:
+            the Event
+
+        Raises:
+            ValueError: if freq is not positive or catch_up is unknown
+        """
+
+        if freq <= 0:
+            raise ValueError("event frequency must be positive, got %r" % freq)
+        if catch_up not in (SKIP, BURST):
+            raise ValueError("unknown catch_up mode %r" % catch_up)
+
+        event = Event(name, freq, offset, action, catch_up, len(self.events))
+        self.events.append(event)
+        if self.t_initial is not None:
+            heapq.heappush(self.queue, (event.due(), event.order, event))
+        return event
+
+    def start(self, t_initial=None):
+        """
+        Sets time zero and queues the first due date of every event.
+
+        Parameters:
+            t_initial: (float) optional clock reading to use as time zero, so that two
+                schedulers (ex: one in a reader thread) can share the same timeline
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+        """
+
+        if t_initial is None:
+            t_initial = self.clock()
+        self.t_initial = t_initial
+        self.running = True
+        self.queue = [(e.due(), e.order, e) for e in self.events]
+        heapq.heapify(self.queue)
+
+    def elapsed(self):
+        """ Seconds since start()
+        """
+        return self.clock() - self.t_initial
+
+    def time_until_next(self):
+        """ Seconds until the next due date (negative if we are already late), or None if nothing is queued.
+        """
+
+        if not self.queue:
+            return None
+        return self.queue[0][0] - self.elapsed()
+
+    def run_pending(self):
+        """
+        Runs every event whose due date has been reached.
+
+        Parameters:
+            None.
+
+        Returns:
+            (int) the number of actions that were run
+
+        Raises:
+            Whatever the actions raise.
+        """
+
+        elapsed = self.elapsed()
+
+        # pull everything that is due, then run it in registration order
+        due_now = []
+        while self.queue and self.queue[0][0] <= elapsed:
+            due_now.append(heapq.heappop(self.queue)[2])
+        due_now.sort(key=lambda e: e.order)
+
+        for event in due_now:
+            late = elapsed - event.due()
+            if late > event.max_late:
+                event.max_late = late
+
+            event.action(elapsed)
+            event.runs += 1
+
+            # and then schedule the next due date
+            event.count += 1
+            if event.catch_up == SKIP and event.due() <= elapsed:
+                # we fell at least one whole period behind. Don't try to make up the lost
+                # due dates, just get back on the original grid at the next future slot.
+                next_count = int(math.floor((elapsed - event.offset) / event.freq)) + 1
+                event.missed += next_count - event.count
+                event.count = next_count
+
+            heapq.heappush(self.queue, (event.due(), event.order, event))
+
+        return len(due_now)
+
+    def run(self, until=None):
+        """
+        Sleeps until the next due date, runs whatever is due, and repeats until stop() is called.
+
+        Parameters:
+            until: (float) optional number of elapsed seconds after which to stop
+
+        Returns:
+            None.
+
+        Raises:
+            Whatever the actions raise (including KeyboardInterrupt for a soft exit).
+        """
+
+        if self.t_initial is None:
+            self.start()
+
+        while self.running and self.queue:
+            wait = self.time_until_next()
+            if until is not None and self.queue[0][0] > until:
+                break
+            if wait > 0:
+                self.sleep(wait)
+            self.run_pending()
+
+    def stop(self):
+        """ Makes run() return after the current pass (or right away, if it hasn't started yet).
+        """
+        self.running = False
+
+    def stats(self):
+        """ Returns a list of (name, runs, missed, max_late) tuples, one per event.
+        """
+        return [(e.name, e.runs, e.missed, e.max_late) for e in self.events]
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+
+# Where the temperatures come from.
+#
+# Every sensor has the same two methods, so roast.py doesn't care which one it is talking to:
+#   read_f(elapsed)  one bean temperature reading ('F), NaN when the reading failed
+#   ambient_f()      the ambient temperature ('F)
+#
+#   MAX31855Sensor      the thermocouple amplifier on the beaglebone (Adafruit library)
+#   ReplaySensor        plays back readings from a Replay (fake data, see replay.py)
+#   RecordedFileSensor  a ReplaySensor straight from a roast file, using its recorded t_ambient
+#   OversamplingSensor  wraps any of the above: takes several readings per call and combines them
+
+import math
+
+from modGregory import c_to_f
+from replay import Replay, load_recording, replay_pairs, NAN
+
+
+class Sensor(object):
+    """ The interface every sensor provides.
+    """
+
+    def read_f(self, elapsed):
+        raise NotImplementedError
+
+    def ambient_f(self):
+        raise NotImplementedError
+
+    def duration(self):
+        """ How long (seconds) the sensor has readings for, or None if it just keeps going.
+        """
+        return None
+
+
+class MAX31855Sensor(Sensor):
+    """
+    The MAX31855 thermocouple amplifier, over software SPI.
+
+    The Adafruit libraries are only imported when one of these is created, since they only
+    exist on the beaglebone. Taken directly from MAX31855 Example on Adafruit.com
+
+    Parameters:
+        clk, cs, do: (str) the header pins, ex: 'P9_12', 'P9_15', 'P9_23'
+
+    Raises:
+        ImportError: when not running on the beaglebone
+    """
+
+    def __init__(self, clk, cs, do):
+        import Adafruit_MAX31855.MAX31855 as MAX31855
+        self.device = MAX31855.MAX31855(clk, cs, do)
+
+    def read_f(self, elapsed):
+        return c_to_f(self.device.readTempC())
+
+    def ambient_f(self):
+        return c_to_f(self.device.readInternalC())
+
+
+class ReplaySensor(Sensor):
+    """
+    Plays back recorded readings as if they came off the thermocouple.
+
+    Parameters:
+        replay: (Replay) the readings (and faked faults) to play back
+        ambient: (float) what ambient_f() reports, 'F
+    """
+
+    def __init__(self, replay, ambient=68.1):
+        self.replay = replay
+        self.ambient = ambient
+
+    def read_f(self, elapsed):
+        return self.replay.read(elapsed)
+
+    def ambient_f(self):
+        return self.ambient
+
+    def duration(self):
+        return self.replay.duration()
+
+
+class RecordedFileSensor(ReplaySensor):
+    """
+    Replays the temp_actual readings of a roast file, ex: one from incoming_roasts/.
+
+    Parameters:
+        filename: (str) the roast file
+        faults, nan_every: faked sensor faults, see replay.py
+
+    Raises:
+        IOError, ValueError: if the file can't be read or has no readings
+    """
+
+    def __init__(self, filename, faults=(), nan_every=0):
+        recorded = load_recording(filename)
+        ReplaySensor.__init__(self, Replay(replay_pairs(recorded, filename), faults, nan_every),
+                              float(recorded.get('t_ambient', 68.1)))
+
+
+def median(values):
+    ordered = sorted(values)
+    m = len(ordered)
+    if m % 2:
+        return ordered[m // 2]
+    return (ordered[m // 2 - 1] + ordered[m // 2]) / 2.0
+
+def trimmed_mean(values, trim=0.25):
+    """ Average after throwing out the lowest and highest 'trim' fraction of the values.
+    """
+
+    ordered = sorted(values)
+    k = int(len(ordered) * trim)
+    if len(ordered) - 2 * k < 1:
+        k = (len(ordered) - 1) // 2
+    kept = ordered[k:len(ordered) - k]
+    return sum(kept) / float(len(kept))
+
+COMBINE = {
+    'median': median,
+    'trimmed_mean': trimmed_mean,
+}
+
+
+class OversamplingSensor(Sensor):
+    """
+    Takes n readings per read_f() and combines the good ones into a single, less noisy, value.
+
+    NaN readings are simply left out and counted. There is no re-polling: a read_f() always
+    takes exactly n readings, so it always takes about the same time. It only returns NaN
+    when fewer than min_valid of the n readings were good.
+
+    Parameters:
+        sensor: (Sensor) where the readings come from
+        n: (int) readings per call
+        combine: (str) 'median' or 'trimmed_mean'
+        min_valid: (int) good readings needed for a valid result
+
+    Raises:
+        ValueError: for an unknown combine method or impossible n/min_valid
+    """
+
+    def __init__(self, sensor, n=5, combine='median', min_valid=1):
+        if combine not in COMBINE:
+            raise ValueError("unknown combine method %r, pick one of %s" % (combine, sorted(COMBINE)))
+        if n < 1 or not 1 <= min_valid <= n:
+            raise ValueError("need n >= 1 and 1 <= min_valid <= n, got n=%r, min_valid=%r" % (n, min_valid))
+        self.sensor = sensor
+        self.n = n
+        self.combine = COMBINE[combine]
+        self.min_valid = min_valid
+        self.reads = 0              # readings taken, and how many of them were NaN
+        self.nan_count = 0          # (roast.py reports them at the end, see report_timing)
+
+    def read_f(self, elapsed):
+        good = []
+        for i in range(self.n):
+            temp = self.sensor.read_f(elapsed)
+            if math.isnan(temp):
+                self.nan_count += 1
+            else:
+                good.append(temp)
+        self.reads += self.n
+
+        if len(good) < self.min_valid:
+            return NAN
+        return self.combine(good)
+
+    def ambient_f(self):
+        return self.sensor.ambient_f()
+
+    def duration(self):
+        return self.sensor.duration()
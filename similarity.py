@@ -0,0 +1,325 @@
+#!/usr/bin/python
+
+# Finding the past roasts that looked most like this one.
+#
+# Every roast in the catalog (see catalog.py) gets a feature vector of a fixed length:
+#   the temp_smooth curve (temp_actual for a roast without one, ex: fake_data.json), resampled
+#   every FEATURE_STEP seconds from 0 to FEATURE_END (NaN past the end of the roast), then
+#   the times of the drying end, first crack and drop (see milestones.py), times MILESTONE_WEIGHT
+# The vectors are kept in one numpy array, saved in INDEX_FILE. Like the catalog, refresh()
+# only reworks the roasts whose files changed.
+#
+# A query compares one roast against all of them at once, two ways:
+#   'euclidean'   root mean square difference over the points both have ('F). A roast in
+#                 progress only has the start of its curve, so it is compared on just that.
+#   'dtw'         dynamic time warping of the curves, within BAND points of the diagonal, so a
+#                 roast that did the same thing a bit earlier or later still counts as close.
+#                 Open ended: the query can match the start of a longer roast. Curves only.
+#
+#   python similarity.py                            refreshes the index
+#   python similarity.py <roast file> [--dtw] [-k 5]  the closest roasts to that file
+
+import argparse
+import os
+
+import numpy as np
+
+from milestones import DRYING_END, FIRST_CRACK, DROP, roast_milestones
+from resample import grid, resample
+
+INDEX_FILE = './similarity.npz'
+KEY = 'temp_smooth'
+FALLBACK_KEY = 'temp_actual'    # the curve for a roast that doesn't have KEY
+FEATURE_STEP = 5.0              # seconds between curve points
+FEATURE_END = 720.0             # seconds, the last curve point
+MILESTONE_FEATURES = (DRYING_END, FIRST_CRACK, DROP)
+MILESTONE_WEIGHT = 0.5          # 'F per second, how much a milestone that is 10 s off counts
+BAND = 6                        # points (BAND*FEATURE_STEP seconds) dtw can shift the curves by
+MIN_SHARED = 12                 # curve points a roast needs in common with the query to be compared
+K = 5
+METHODS = ('euclidean', 'dtw')
+VERSION = 3                     # bumped when the features change (ex: the milestones are found differently)
+# what a query needs from a roast file (milestones, or the series to find them in)
+QUERY_KEYS = [KEY, FALLBACK_KEY, 'temp_ror', 'milestones']
+
+CURVE_TIMES = grid(FEATURE_STEP, FEATURE_END)
+SETTINGS = np.array([VERSION, FEATURE_STEP, FEATURE_END, MILESTONE_WEIGHT, len(MILESTONE_FEATURES)])
+
+
+def features(roast, milestones=None, key=KEY):
+    """
+    The feature vector of a roast (see the top of this file).
+
+    Parameters:
+        roast: (dict) the roast, series as TimeSeries. A roast in progress is fine.
+        milestones: [[time, name], ...]. By default, milestones.roast_milestones() of the roast.
+        key: (str) the curve. If the roast doesn't have it, FALLBACK_KEY is used instead.
+
+    Returns:
+        numpy array of len(CURVE_TIMES) + len(MILESTONE_FEATURES) values, NaN for what's missing
+
+    Raises:
+        None.
+    """
+
+    if roast.get(key) is None or not len(roast[key]):
+        key = FALLBACK_KEY
+    if roast.get(key) is not None:
+        curve = resample(roast[key], CURVE_TIMES)
+    else:
+        curve = np.full(len(CURVE_TIMES), np.nan)
+    if milestones is None:
+        milestones = roast_milestones(roast, key)
+    found = dict((name, t) for t, name in milestones)
+    marks = [found.get(name, np.nan) * MILESTONE_WEIGHT for name in MILESTONE_FEATURES]
+    return np.concatenate((curve, marks))
+
+def euclidean(query, vectors):
+    """ Root mean square difference between the query and every row, over the values both have.
+    """
+
+    diff = vectors - query
+    shared = ~np.isnan(diff)
+    count = shared.sum(axis=1)
+    total = np.where(shared, diff, 0.0)
+    distance = np.sqrt((total * total).sum(axis=1) / np.maximum(count, 1))
+    curve_count = shared[:, :len(CURVE_TIMES)].sum(axis=1)
+    distance[curve_count < MIN_SHARED] = np.inf
+    return distance
+
+def dtw(query, curves, band=BAND):
+    """
+    Banded, open ended dynamic time warping distance between a curve and every row of curves.
+
+    Either side can end first: the query can match the start of a longer curve (ex: the query
+    is a roast in progress), and a shorter curve can match the start of the query. The rows are
+    all done at once, one numpy operation per cell of the band.
+
+    Parameters:
+        query: numpy array, a curve (NaN past its end)
+        curves: 2D numpy array, one curve per row (NaN past their ends)
+        band: (int) how far (in points) the match can stray from the diagonal
+
+    Returns:
+        numpy array, root mean square difference along the best match ('F), inf when there isn't one
+
+    Raises:
+        None.
+    """
+
+    n_rows, m = curves.shape
+    have = np.flatnonzero(~np.isnan(query))
+    n = have[-1] + 1 if len(have) else 0
+    if n < MIN_SHARED:
+        return np.full(n_rows, np.inf)
+    ended = np.isnan(curves)
+    last = m - 1 - np.argmax(~ended[:, ::-1], axis=1)      # index of every curve's last point
+    rows = np.arange(n_rows)
+    # best cost per point of a match that ran to the end of the curve
+    finished = np.full(n_rows, np.inf)
+
+    previous = np.full((n_rows, m), np.inf)
+    for i in range(n):
+        current = np.full((n_rows, m), np.inf)
+        lo = max(0, i - band)
+        hi = min(m, i + band + 1)
+        cost = (curves[:, lo:hi] - query[i]) ** 2
+        cost[ended[:, lo:hi]] = np.inf
+        # coming straight down or down the diagonal only depends on the previous row
+        down = previous[:, lo:hi].copy()
+        if lo > 0:
+            down = np.minimum(down, previous[:, lo - 1:hi - 1])
+        else:
+            down[:, 1:] = np.minimum(down[:, 1:], previous[:, lo:hi - 1])
+        if i == 0:
+            down[:, 0] = 0.0
+        # coming from the left depends on the cell just done
+        current[:, lo] = cost[:, 0] + down[:, 0]
+        for j in range(lo + 1, hi):
+            current[:, j] = cost[:, j - lo] + np.minimum(down[:, j - lo], current[:, j - 1])
+        if i + 1 >= MIN_SHARED:
+            done = (last >= lo) & (last < hi)
+            finished[done] = np.minimum(finished[done], current[rows[done], last[done]] / (i + 1))
+        previous = current
+    return np.sqrt(np.minimum(previous.min(axis=1) / n, finished))
+
+
+class SimilarityIndex(object):
+    """
+    The feature vectors of every roast in the catalog, and k-nearest-neighbour queries against them.
+
+    Parameters:
+        filename: (str) where the index is saved. It is read if it exists (and was made with
+            the same settings).
+    """
+
+    def __init__(self, filename=INDEX_FILE):
+        self.filename = filename
+        self.paths = []
+        self.stamps = {}                # path -> (mtime, size) of the file when it was indexed
+        self.vectors = np.empty((0, len(CURVE_TIMES) + len(MILESTONE_FEATURES)))
+        if os.path.exists(filename):
+            self.load()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def load(self):
+        """ Reads the index back from its file (it stays empty if the file is from other settings).
+        """
+
+        saved = np.load(self.filename)
+        try:
+            if saved['settings'].shape != SETTINGS.shape or not np.all(saved['settings'] == SETTINGS):
+                return
+            self.paths = [str(p) for p in saved['paths']]
+            self.stamps = dict(zip(self.paths, [tuple(s) for s in saved['stamps'].tolist()]))
+            self.vectors = saved['vectors']
+        finally:
+            saved.close()
+
+    def save(self):
+        """ Writes the index to its file. Like journal.write_atomically(), through a temporary file.
+        """
+
+        tmp = self.filename + ".tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, settings=SETTINGS, paths=np.array(self.paths, dtype=str),
+                     stamps=np.array([self.stamps[p] for p in self.paths], dtype=float).reshape(-1, 2),
+                     vectors=self.vectors)
+        os.rename(tmp, self.filename)
+
+    def refresh(self, catalog=None, workers=None):
+        """
+        Brings the index up to date with the catalog, and saves it.
+
+        Parameters:
+            catalog: (Catalog) to use. By default the usual one, refreshed first.
+            workers: (int) processes to read the changed roasts with. None uses one per cpu.
+
+        Returns:
+            (indexed, removed, unchanged) counts
+
+        Raises:
+            None.
+        """
+
+        from loader import load_roasts
+
+        own_catalog = catalog is None
+        if own_catalog:
+            from catalog import Catalog
+            catalog = Catalog()
+            catalog.refresh()
+
+        rows = catalog.find(has_series=KEY)
+        old = dict(zip(self.paths, self.vectors))
+        vectors = {}
+        stale = []
+        for row in rows:
+            stamp = (row['mtime'], row['size'])
+            if row['path'] in old and self.stamps.get(row['path']) == stamp:
+                vectors[row['path']] = old[row['path']]
+            else:
+                stale.append(row)
+
+        roasts, errors = load_roasts([row['path'] for row in stale], [KEY], workers)
+        for row, roast in zip(stale, roasts):
+            if roast is None:
+                continue
+            found = catalog.milestones(row['path'])
+            vectors[row['path']] = features(roast, [[t, name] for name, t in found.items()])
+            self.stamps[row['path']] = (row['mtime'], row['size'])
+        if own_catalog:
+            catalog.close()
+
+        removed = len([p for p in self.paths if p not in vectors])
+        self.paths = sorted(vectors)
+        self.stamps = dict((p, self.stamps[p]) for p in self.paths)
+        self.vectors = np.array([vectors[p] for p in self.paths]).reshape(len(self.paths), -1)
+        self.save()
+        return len(stale) - len(errors), removed, len(rows) - len(stale)
+
+    def query(self, roast, k=K, method='euclidean', exclude=None, milestones=None):
+        """
+        The k past roasts closest to a roast.
+
+        Parameters:
+            roast: (dict) the roast (or the batch of a roast in progress)
+            k: (int) how many to return
+            method: 'euclidean' or 'dtw', see the top of this file
+            exclude: (str) a file to leave out, ex: the roast's own
+            milestones: see features()
+
+        Returns:
+            [(distance, path), ...], closest first
+
+        Raises:
+            ValueError: for an unknown method
+        """
+
+        if method not in METHODS:
+            raise ValueError("unknown method %r, pick one of %s" % (method, METHODS))
+        if not len(self.paths):
+            return []
+        query = features(roast, milestones)
+        if method == 'euclidean':
+            distance = euclidean(query, self.vectors)
+        else:
+            curve = len(CURVE_TIMES)
+            distance = dtw(query[:curve], self.vectors[:, :curve])
+
+        if exclude is not None:
+            exclude = os.path.realpath(exclude)
+        matches = []
+        for i in np.argsort(distance, kind='mergesort'):
+            if len(matches) == k or not np.isfinite(distance[i]):
+                break
+            if exclude is not None and os.path.realpath(self.paths[i]) == exclude:
+                continue
+            matches.append((float(distance[i]), self.paths[i]))
+        return matches
+
+def query_file(path, k=K, method='euclidean', index=None):
+    """
+    The k past roasts closest to a roast file (not counting the file itself).
+
+    Parameters:
+        path: (str) the roast file
+        k, method: see SimilarityIndex.query()
+        index: (SimilarityIndex) to search. By default the saved one.
+
+    Returns:
+        [(distance, path), ...], closest first
+
+    Raises:
+        IOError, ValueError: if the file can't be read
+    """
+
+    from loader import load_roast
+
+    if index is None:
+        index = SimilarityIndex()
+    return index.query(load_roast(path, QUERY_KEYS), k, method, exclude=path)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find the past roasts most like a roast.")
+    parser.add_argument('file', nargs='?', help="the roast to compare. Without one, the index is refreshed.")
+    parser.add_argument('-k', type=int, default=K, help="how many roasts to list")
+    parser.add_argument('--dtw', action='store_true', help="compare with dynamic time warping")
+    args = parser.parse_args()
+
+    index = SimilarityIndex()
+    if args.file is None:
+        print "indexed %i, removed %i, unchanged %i" % index.refresh()
+    elif not len(index):
+        print "the index is empty, run 'python similarity.py' first"
+    else:
+        matches = query_file(args.file, args.k, 'dtw' if args.dtw else 'euclidean', index)
+        if not matches:
+            print "%s can't be compared: it needs %i s of %s or %s in common with another roast" % (
+                args.file, MIN_SHARED * FEATURE_STEP, KEY, FALLBACK_KEY)
+        for distance, path in matches:
+            print "%6.1f  %s" % (distance, path)
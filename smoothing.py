@@ -0,0 +1,342 @@
+#!/usr/bin/python
+
+# Streaming smoothing filters.
+#
+# smooth_data() used to slice the last SMOOTH_OVER readings out of the batch and re-average
+# them on every SMOOTH tick, so the cost went up with the window size. These filters keep
+# their own state instead: feed each reading in with update() as it arrives and read the
+# current smoothed value whenever you want it.
+#
+#   'mean'    MovingAverage  - same output as the old smooth_data(), running sum over a ring buffer
+#   'ema'     EMA            - exponential moving average, no window at all
+#   'median'  MovingMedian   - median of the last n readings, shrugs off single spikes
+#   'savgol'  SavitzkyGolay  - least-squares polynomial fit over the last n readings
+#
+# RateOfRise isn't a smoothing filter but works the same way: it takes each reading (with its
+# time) and keeps the slope of a least-squares line through the last n of them, in 'F/min.
+#
+# All of them except the median do a fixed amount of work per reading no matter how big the
+# window is. The median keeps a sorted copy of the window: finding the spot is a bisect,
+# moving the neighbours over is a (very fast) memmove of at most n pointers.
+
+from bisect import bisect_left, insort
+
+ROR_OVER = 75     # readings to fit the rate of rise over (15 s at roast.py's READ_FREQ = 0.2)
+
+
+class MovingAverage(object):
+    """
+    Average of the last n readings (fewer while the window is still filling up).
+
+    The sum is kept up to date by adding the new reading and subtracting the one that falls
+    out of the window. Every n readings it is recalculated from scratch so float error can't
+    pile up over a long roast.
+
+    Parameters:
+        n: (int) the number of readings to average over
+    """
+
+    def __init__(self, n):
+        if n < 1:
+            raise ValueError("window must hold at least 1 reading, got %r" % n)
+        self.n = n
+        self.window = [0.0] * n     # ring buffer of the last n readings
+        self.i = 0                  # slot the next reading goes into
+        self.count = 0              # readings in the window so far (maxes out at n)
+        self.total = 0.0
+        self.value = None
+
+    def update(self, x):
+        """ Adds a reading and returns the new average.
+        """
+
+        if self.count == self.n:
+            self.total -= self.window[self.i]
+        else:
+            self.count += 1
+        self.window[self.i] = x
+        self.total += x
+        self.i = (self.i + 1) % self.n
+
+        if self.i == 0:
+            # window is in chronological order right now, same order sum() used to see it in
+            self.total = sum(self.window[:self.count])
+
+        self.value = self.total / float(self.count)
+        return self.value
+
+
+class EMA(object):
+    """
+    Exponential moving average: value += alpha*(reading - value)
+
+    Parameters:
+        n: (int) window it should roughly behave like, alpha = 2/(n+1).  Ignored if alpha is given.
+        alpha: (float) optional smoothing factor in (0, 1]. Smaller is smoother (and laggier).
+    """
+
+    def __init__(self, n=15, alpha=None):
+        if alpha is None:
+            alpha = 2.0 / (n + 1)
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1], got %r" % alpha)
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, x):
+        if self.value is None:
+            self.value = float(x)
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+
+class MovingMedian(object):
+    """
+    Median of the last n readings (fewer while the window is still filling up).
+
+    Parameters:
+        n: (int) the number of readings to take the median of
+    """
+
+    def __init__(self, n):
+        if n < 1:
+            raise ValueError("window must hold at least 1 reading, got %r" % n)
+        self.n = n
+        self.window = [0.0] * n     # ring buffer, chronological
+        self.ordered = []           # the same readings, sorted
+        self.i = 0
+        self.value = None
+
+    def update(self, x):
+        if len(self.ordered) == self.n:
+            del self.ordered[bisect_left(self.ordered, self.window[self.i])]
+        self.window[self.i] = x
+        self.i = (self.i + 1) % self.n
+        insort(self.ordered, x)
+
+        m = len(self.ordered)
+        if m % 2:
+            self.value = float(self.ordered[m // 2])
+        else:
+            self.value = (self.ordered[m // 2 - 1] + self.ordered[m // 2]) / 2.0
+        return self.value
+
+
+def solve(a, b):
+    """
+    Solves the (small, square) linear system a*x = b by Gaussian elimination with partial pivoting.
+
+    Parameters:
+        a: (2D list) the matrix, not modified
+        b: (list) the right hand side, not modified
+
+    Returns:
+        x: (list)
+
+    Raises:
+        ZeroDivisionError: if a is singular
+    """
+
+    n = len(b)
+    m = [list(row) + [b[r]] for r, row in enumerate(a)]
+    for c in range(n):
+        p = max(range(c, n), key=lambda r: abs(m[r][c]))
+        m[c], m[p] = m[p], m[c]
+        for r in range(c + 1, n):
+            f = m[r][c] / m[c][c]
+            for k in range(c, n + 1):
+                m[r][k] -= f * m[c][k]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        x[r] = (m[r][n] - sum(m[r][k] * x[k] for k in range(r + 1, n))) / m[r][r]
+    return x
+
+def binomial(n, k):
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+
+class SavitzkyGolay(object):
+    """
+    Savitzky-Golay smoothing: fits a polynomial to the last n readings (least squares) and
+    reports the fitted value at the newest reading.
+
+    Unlike the moving average, a quadratic fit follows a steadily climbing bean temperature
+    without lagging behind it.
+
+    The fit only needs the moments S_p = sum(k**p * y_k) of the window (k = 0 for the oldest
+    reading). When the window slides by one, every k drops by 1, and (k-1)**p expands with the
+    binomial theorem into the old moments, so each update costs O(order**2), not O(n).
+    The readings are assumed to be evenly spaced (READ_FREQ apart).
+
+    Parameters:
+        n: (int) the number of readings to fit
+        order: (int) degree of the polynomial, less than n
+    """
+
+    def __init__(self, n, order=2):
+        if order < 0 or order >= n:
+            raise ValueError("polynomial order must be between 0 and n-1, got %r" % order)
+        self.n = n
+        self.order = order
+        self.window = [0.0] * n
+        self.i = 0
+        self.count = 0
+        self.moments = [0.0] * (order + 1)
+        self.weights = {}           # window length -> weights such that value = sum(w*S)
+        self.value = None
+
+    def weights_for(self, m):
+        """ Weights that turn the moments of an m-reading window into the fitted value at k = m-1
+        """
+
+        if m not in self.weights:
+            p = min(self.order, m - 1)
+            gram = [[float(sum(k ** (r + c) for k in range(m))) for c in range(p + 1)] for r in range(p + 1)]
+            at_newest = [float((m - 1) ** r) for r in range(p + 1)]
+            # value = at_newest . inverse(gram) . S, and gram is symmetric
+            w = solve(gram, at_newest)
+            self.weights[m] = w + [0.0] * (self.order - p)
+        return self.weights[m]
+
+    def resync(self):
+        """ Recalculates the moments from the window itself, wiping out accumulated float error.
+        """
+
+        oldest = (self.i - self.count) % self.n
+        ys = [self.window[(oldest + k) % self.n] for k in range(self.count)]
+        self.moments = [float(sum(k ** p * y for k, y in enumerate(ys))) for p in range(self.order + 1)]
+
+    def update(self, x):
+        s = self.moments
+        if self.count == self.n:
+            # slide: drop the oldest reading (k = 0) and renumber the rest k -> k-1
+            s[0] -= self.window[self.i]
+            s[:] = [sum(binomial(p, j) * (-1) ** (p - j) * s[j] for j in range(p + 1)) for p in range(self.order + 1)]
+            k_new = self.n - 1
+        else:
+            k_new = self.count
+            self.count += 1
+        for p in range(self.order + 1):
+            s[p] += k_new ** p * x
+        self.window[self.i] = x
+        self.i = (self.i + 1) % self.n
+
+        if self.i == 0:
+            self.resync()
+
+        w = self.weights_for(self.count)
+        self.value = sum(w[p] * s[p] for p in range(self.order + 1))
+        return self.value
+
+
+class RateOfRise(object):
+    """
+    Rate of rise: slope of the least-squares line through the last n readings, in degrees per minute.
+
+    The slope only needs the sums of t, v, t*t and t*v over the window, which are kept up to
+    date like MovingAverage's total, so each update costs the same no matter how big n is.
+    The readings don't have to be evenly spaced, each one comes with its own time.
+    The times are kept relative to an anchor (the oldest time in the window at the last resync)
+    so the squares stay small; every n readings the anchor moves up and the sums are
+    recalculated from scratch.
+
+    The value is None until the window holds two different times.
+
+    Parameters:
+        n: (int) the number of readings to fit the line through
+    """
+
+    def __init__(self, n):
+        if n < 2:
+            raise ValueError("window must hold at least 2 readings, got %r" % n)
+        self.n = n
+        self.times = [0.0] * n      # ring buffers of the last n readings
+        self.window = [0.0] * n
+        self.i = 0
+        self.count = 0
+        self.anchor = None
+        self.st = self.sv = self.stt = self.stv = 0.0
+        self.value = None
+
+    def resync(self):
+        """ Moves the anchor to the oldest reading and recalculates the sums from the window.
+        """
+
+        oldest = (self.i - self.count) % self.n
+        order = [(oldest + k) % self.n for k in range(self.count)]
+        self.anchor = self.times[order[0]]
+        ts = [self.times[j] - self.anchor for j in order]
+        vs = [self.window[j] for j in order]
+        self.st = sum(ts)
+        self.sv = sum(vs)
+        self.stt = sum(t * t for t in ts)
+        self.stv = sum(t * v for t, v in zip(ts, vs))
+
+    def update(self, t, x):
+        """ Adds a reading taken at time t (seconds) and returns the new rate of rise.
+        """
+
+        if self.anchor is None:
+            self.anchor = t
+        if self.count == self.n:
+            old_t = self.times[self.i] - self.anchor
+            old_v = self.window[self.i]
+            self.st -= old_t
+            self.sv -= old_v
+            self.stt -= old_t * old_t
+            self.stv -= old_t * old_v
+        else:
+            self.count += 1
+        self.times[self.i] = t
+        self.window[self.i] = x
+        t -= self.anchor
+        self.st += t
+        self.sv += x
+        self.stt += t * t
+        self.stv += t * x
+        self.i = (self.i + 1) % self.n
+
+        if self.i == 0:
+            self.resync()
+
+        m = self.count
+        spread = m * self.stt - self.st * self.st
+        if spread <= 1e-9 * m * self.stt:
+            # all the times are the same (ex: the pre-filled readings at 0:00)
+            self.value = None
+        else:
+            self.value = 60.0 * (m * self.stv - self.st * self.sv) / spread
+        return self.value
+
+
+FILTERS = {
+    'mean': MovingAverage,
+    'ema': EMA,
+    'median': MovingMedian,
+    'savgol': SavitzkyGolay,
+}
+
+def make_filter(kind, n, **options):
+    """
+    Creates one of the filters above by name.
+
+    Parameters:
+        kind: (str) one of the keys of FILTERS
+        n: (int) the window size (number of readings)
+        options: passed along to the filter, ex: order=3 for 'savgol'
+
+    Returns:
+        a filter object with update(x) and .value
+
+    Raises:
+        ValueError: if the kind is unknown
+    """
+
+    try:
+        return FILTERS[kind](n, **options)
+    except KeyError:
+        raise ValueError("unknown smoothing filter %r, pick one of %s" % (kind, sorted(FILTERS)))
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+
+# Compact storage for sampled data.
+#
+# A sample used to be stored as its own [time, value] list, which is two float objects plus a
+# list object (100+ bytes) per point. TimeSeries keeps the times and the values in two
+# parallel array('d') buffers instead (16 bytes per point) but still acts enough like the old
+# list of pairs that code such as batch['temp_actual'][-1][1] or batch['temp_actual'].append([t, v])
+# keeps working. In the files, series are still written as [[time, value], ...] lists.
+#
+# The arrays only hold floats, but some files have ints in them (ex: the [0.0, 68] readings
+# roast.py starts temp_actual with). So that a file read in and written back out comes out
+# the same, each series also remembers where its ints were (t_ints, v_ints: the indices,
+# usually none or a handful) and hands those samples back as ints.
+
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+
+INT_TYPES = (int, long)         # not bool, json has no use for it here
+
+
+def int_indices(numbers):
+    """ array('l') of the indices of the ints in a list of numbers.
+    """
+
+    types = map(type, numbers)
+    if int not in types and long not in types:
+        # the usual case, checked without a Python loop
+        return array('l')
+    return array('l', [i for i, kind in enumerate(types) if kind in INT_TYPES])
+
+def with_ints(column, ints):
+    """ The column as a list, with the samples at the ints indices turned back into ints.
+    """
+
+    numbers = column.tolist()
+    for i in ints:
+        numbers[i] = int(numbers[i])
+    return numbers
+
+def sliced_ints(ints, start, stop, step):
+    """ Where the ints end up in the slice start:stop:step of a column.
+    """
+
+    if step == 1:
+        return array('l', [i - start for i in ints if start <= i < stop])
+    kept = dict((j, k) for k, j in enumerate(range(start, stop, step)))
+    return array('l', [kept[i] for i in ints if i in kept])
+
+
+class TimeSeries(object):
+    """
+    A series of (time, value) samples in chronological order.
+
+    Parameters:
+        pairs: optional iterable of [time, value] pairs to start with
+    """
+
+    __slots__ = ('t', 'v', 't_ints', 'v_ints')
+
+    def __init__(self, pairs=()):
+        if not isinstance(pairs, list):
+            pairs = list(pairs)
+        # two passes over the list is still quicker than appending pair by pair
+        times = [p[0] for p in pairs]
+        values = [p[1] for p in pairs]
+        self.t = array('d', times)
+        self.v = array('d', values)
+        self.t_ints = int_indices(times)
+        self.v_ints = int_indices(values)
+
+    @classmethod
+    def from_arrays(cls, times, values):
+        """ Builds a series from two equal-length sequences (copied into new arrays).
+        """
+
+        if len(times) != len(values):
+            raise ValueError("times and values must be the same length (%i != %i)" % (len(times), len(values)))
+        ts = cls()
+        ts.t.extend(times)
+        ts.v.extend(values)
+        return ts
+
+    def append(self, pair):
+        """ Adds a [time, value] pair, just like appending to the old list of pairs.
+        """
+
+        t, v = pair
+        self.add(t, v)
+
+    def add(self, t, v):
+        """ Adds a sample without building a pair first.
+        """
+
+        if type(t) in INT_TYPES:
+            self.t_ints.append(len(self.t))
+        if type(v) in INT_TYPES:
+            self.v_ints.append(len(self.v))
+        self.t.append(t)
+        self.v.append(v)
+
+    def has_ints(self):
+        return bool(self.t_ints or self.v_ints)
+
+    def __len__(self):
+        return len(self.t)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            ts = TimeSeries.from_arrays(self.t[i], self.v[i])
+            if self.has_ints():
+                start, stop, step = i.indices(len(self.t))
+                ts.t_ints = sliced_ints(self.t_ints, start, stop, step)
+                ts.v_ints = sliced_ints(self.v_ints, start, stop, step)
+            return ts
+        t, v = self.t[i], self.v[i]
+        if self.has_ints():
+            if i < 0:
+                i += len(self.t)
+            if self.is_int(self.t_ints, i):
+                t = int(t)
+            if self.is_int(self.v_ints, i):
+                v = int(v)
+        return [t, v]
+
+    @staticmethod
+    def is_int(ints, i):
+        j = bisect_left(ints, i)
+        return j < len(ints) and ints[j] == i
+
+    def __iter__(self):
+        if self.has_ints():
+            for pair in self.to_list():
+                yield pair
+            return
+        for i in range(len(self.t)):
+            yield [self.t[i], self.v[i]]
+
+    def __eq__(self, other):
+        if isinstance(other, TimeSeries):
+            return self.t == other.t and self.v == other.v
+        try:
+            return self.to_list() == [list(p) for p in other]
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "TimeSeries(%i samples)" % len(self)
+
+    # __slots__ classes need these to be pickled (ex: sent back from a loader process).
+    # The raw array bytes are much quicker to pickle than the samples one by one.
+    def __getstate__(self):
+        return (self.t.tostring(), self.v.tostring(), self.t_ints.tostring(), self.v_ints.tostring())
+
+    def __setstate__(self, state):
+        self.t = array('d')
+        self.v = array('d')
+        self.t_ints = array('l')
+        self.v_ints = array('l')
+        self.t.fromstring(state[0])
+        self.v.fromstring(state[1])
+        self.t_ints.fromstring(state[2])
+        self.v_ints.fromstring(state[3])
+
+    def times(self):
+        return self.t
+
+    def values(self):
+        return self.v
+
+    def tail(self, n):
+        """ A view of the last n samples (no copying).
+        """
+
+        return Window(self, max(len(self.t) - n, 0), len(self.t))
+
+    def between(self, t_start, t_end):
+        """
+        A view of the samples with t_start <= time <= t_end (no copying).
+
+        Parameters:
+            t_start: (float) seconds
+            t_end: (float) seconds
+
+        Returns:
+            a Window
+
+        Raises:
+            None.
+        """
+
+        return Window(self, bisect_left(self.t, t_start), bisect_right(self.t, t_end))
+
+    def to_list(self):
+        """ The old [[time, value], ...] format, ex: for json. The ints it was made from come back as ints.
+        """
+
+        if not self.has_ints():
+            return [[t, v] for t, v in zip(self.t, self.v)]
+        return [list(p) for p in zip(with_ints(self.t, self.t_ints), with_ints(self.v, self.v_ints))]
+
+
+class Window(object):
+    """
+    A read-only view of samples start:stop of a TimeSeries.
+
+    It looks at the series' arrays directly, so samples appended to the series after the
+    view was made do not show up in it.
+    """
+
+    __slots__ = ('series', 'start', 'stop')
+
+    def __init__(self, series, start, stop):
+        self.series = series
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        n = self.stop - self.start
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("window index out of range")
+        return self.series[self.start + i]
+
+    def __iter__(self):
+        if self.series.has_ints():
+            for pair in self.to_list():
+                yield pair
+            return
+        t, v = self.series.t, self.series.v
+        for i in range(self.start, self.stop):
+            yield [t[i], v[i]]
+
+    def times(self):
+        return self.series.t[self.start:self.stop]
+
+    def values(self):
+        return self.series.v[self.start:self.stop]
+
+    def to_series(self):
+        return self.series[self.start:self.stop]
+
+    def to_list(self):
+        return self.series[self.start:self.stop].to_list()
+
+
+class BatchEncoder(json.JSONEncoder):
+    """ json encoder that writes TimeSeries (and Windows) as [[time, value], ...] lists.
+    """
+
+    def default(self, o):
+        if isinstance(o, (TimeSeries, Window)):
+            return o.to_list()
+        return json.JSONEncoder.default(self, o)
+
+
+def is_pair_list(value):
+    """ True for a [[time, value], ...] list as found in the batch files.
+    """
+
+    return isinstance(value, list) and all(isinstance(p, list) and len(p) == 2 for p in value)
+
+def to_timeseries(batch, keys=None):
+    """
+    Converts the [[time, value], ...] lists of a batch dictionary to TimeSeries, in place.
+
+    Parameters:
+        batch: (dict) ex: straight out of json.load()
+        keys: optional list of keys to convert. By default, every pair list is converted.
+
+    Returns:
+        the same dictionary. Lists of pairs that aren't numbers (ex: the alarms) are left as they are.
+
+    Raises:
+        None.
+    """
+
+    for key in (batch.keys() if keys is None else keys):
+        value = batch.get(key)
+        if is_pair_list(value):
+            try:
+                batch[key] = TimeSeries(value)
+            except TypeError:
+                pass
+    return batch
@@ -1,8 +1,8 @@
 #!/usr/bin/python
 
 # I am running the BBB headless right now so, obviously, I need to run the viewer on the laptop if i want to SEE the graph
+# (or use render.py, which draws the same graphs straight to png/svg files, no display needed)
 
-import json
 # import matplotlib
 # Force matplotlib to not use any Xwindows backend.
 # see: https://stackoverflow.com/questions/2801882/generating-a-png-with-matplotlib-when-display-is-undefined
@@ -11,40 +11,57 @@ import json
 import matplotlib.pyplot as plt
 from Tkinter import *
 from modGregory import *
+from loader import load_roasts
+from downsample import ZoomDownsampler
+from exporter import export_roasts, csv_title
 
 #VERSION = "16.02.06"        # just yy.mm.dd format of last update
 variable_locker = []
 available_data = []
 
+LOAD_WORKERS = None             # processes used to read in (and export) the files. None = one per cpu, 1 = no extra processes
+SIMILAR_K = 5                   # how many of the most similar past roasts to add (see similarity.py)
 
 
-def read_in_data(filenames):
+
+def read_in_data(filenames, keys=None, workers=None):
     """
     Loads json data structures for a list of files into a list.
 
     It also adds the path and a nickname to to each json structure loaded in, based on filenames.
+    If keys are given, only those series (plus the few bits generate_title() needs) are loaded,
+    see loader.py. The files are read in parallel; one that can't be read is reported and left out.
 
     Parameters:
         filenames: (tuple) of file names, including file path
+        keys: optional list of the series to load, ex: ['temp_smooth']. None loads everything.
+        workers: (int) processes to read the files with, defaults to LOAD_WORKERS
 
     Returns: 
-        a list of the the imports from the files in the form: [{'key':value,...},...]
+        a list of the the imports from the files in the form: [{'key':value,...},...], in the order of filenames
 
     Raises:
         None.
     """
 
+    if workers is None:
+        workers = LOAD_WORKERS
+
+    # the [[time, value], ...] series are stored as (compact) TimeSeries from here on
+    samples, errors = load_roasts(list(filenames), keys, workers)
+    for f, error in errors:
+        print "couldn't read %s: %s" % (f, error)
+
     # given a list of filenames, this returns a list. Each entry is a dictionary representing the data from the files
     all_together =[]
-    for f in filenames:
-        temp_dict={}
+    for f, sample_in in zip(filenames, samples):
+        if sample_in is None:
+            continue
         #locate the actual filename w/o the path --> that becomes the nickname
         i = f.rfind('/')
         nickname = f[i+1:]
         # ad some basic data 
         temp_dict = {'path' : f, 'nickname' : nickname}
-        # then, read in the contents of the file
-        sample_in = json.load(open(f))
         # add those contents to our basic data
         temp_dict.update(sample_in)
         # collect all these individual samples in one big roast list
@@ -98,16 +115,19 @@ def get_desired_data(all_possible_data):
             temp_data.append(all_possible_data[i])
     return temp_data
 
-def graph_roasts(all_roasts, desired_data):
+def draw_roasts(ax, all_roasts, desired_data):
     """
-    Creates a matplotlib graph of the desired_data from a list of roasts (json)
+    Draws the desired_data from a list of roasts (json) onto a matplotlib axes, with labels and a legend.
+
+    Used for the graph on the screen as well as for the files render.py writes.
 
     Parameters:
-        all_roasts: (list of json objects)
+        ax: the matplotlib axes to draw on
+        all_roasts: (list of json objects), with the series stored as TimeSeries (see read_in_data)
         desired_data: (list) of keywords in the json objects
 
     Returns: 
-        None. Outputs a graph to the screen.
+        the ZoomDownsampler holding the lines (it has to stay around for zooming to work)
 
     Raises:
         None.
@@ -115,36 +135,92 @@ def graph_roasts(all_roasts, desired_data):
         
     all_plots = []               # this supposed to be the equivalent of a handle for a plot, but for each plot
     legend_names = []            # collects all the nicknames for display to the legend
+
+    # every line is drawn downsampled to about the width of the plot, and gets its detail back
+    # when you zoom in (see downsample.py)
+    lines = ZoomDownsampler(ax)
     
     # import that data
     for roast in all_roasts:
         for series in desired_data:
-            x = []
-            y = []
-            for i in roast[series]:
-                x.append(i[0])
-                y.append(i[1])
-            all_plots.append(plt.plot(x, y))
+            if series not in roast or not len(roast[series]):
+                # not every file has every series (ex: only profiles have bounds), and some are empty
+                continue
+            # the times and values are already in their own arrays, numpy uses them without copying
+            all_plots.append(lines.plot(roast[series].times(), roast[series].values()))
             legend_names.append(roast['nickname']+" "+series)
     
+    lines.autoscale()
+
     # plot formatting
-    plt.ylabel("Temp ('F)")
-    plt.xlabel("Time (sec)")
-    plt.legend(tuple(legend_names), prop={'size':11}, loc='lower right')
+    ax.set_ylabel("Temp ('F)")
+    ax.set_xlabel("Time (sec)")
+    if legend_names:
+        ax.legend(tuple(legend_names), prop={'size':11}, loc='lower right')
+    return lines
+
+def graph_roasts(all_roasts, desired_data):
+    """
+    Creates a matplotlib graph of the desired_data from a list of roasts (json)
+
+    Parameters:
+        all_roasts: (list of json objects), with the series stored as TimeSeries (see read_in_data)
+        desired_data: (list) of keywords in the json objects
+
+    Returns: 
+        None. Outputs a graph to the screen.
+
+    Raises:
+        None.
+    """
+
+    fig, ax = plt.subplots()
+    draw_roasts(ax, all_roasts, desired_data)
 
     # output them to a screen
     plt.show()
 
+def similar_roasts(filename, desired_data, k=SIMILAR_K, method='euclidean'):
+    """
+    Finds the past roasts most like a roast file (see similarity.py), prints them, and reads them in.
+
+    Parameters:
+        filename: (str) the roast file
+        desired_data: (list) the series to read in for them
+        k: (int) how many
+        method: 'euclidean' or 'dtw'
+
+    Returns:
+        a list of roasts, like read_in_data(), closest first
+
+    Raises:
+        None.
+    """
+
+    from similarity import SimilarityIndex, query_file
+
+    index = SimilarityIndex()
+    if not len(index):
+        print "the similarity index is empty, build it with: python similarity.py"
+        return []
+    try:
+        matches = query_file(filename, k, method, index)
+    except (IOError, ValueError) as e:
+        print "couldn't compare %s: %s" % (filename, e)
+        return []
+    for distance, path in matches:
+        print "%6.1f 'F  %s" % (distance, path)
+    return read_in_data([path for distance, path in matches], desired_data)
+
 def generate_title(d):
     """ Creates a header string from important dictionary keys to display on the top of a human-readable *.csv file
     """
     # takes the bean dictionary and creates a title/header for the csv file (returns a string)
-    title = "%s\nRun #%02.i,T_ambient = %.f\n\n"%(d['beanName'], d['run'], d['t_ambient'])
-    return title
+    return csv_title(d)
 
 def welcome_message():
-	""" Prints an ASCII welcome message.
-	"""
+    """ Prints an ASCII welcome message.
+    """
     print "\n"*20
     print "\t\t\t************************************"
     print "\t\t\t*        Roast viewer              *"
@@ -160,14 +236,26 @@ def main():
 
     welcome_message()
 
+    available_data = ['temp_actual', 'temp_smooth', 'upper_bound','lower_bound', 'target_temp']            # more could go here but i need error handling for the files that don't have keys with these legend_names
+
     while True:
         try:
             # get a list of all the files we're reading from (full path)
             print "Choose file(s) to view."
             filez = user_select_files("Choose file(s) to view.")
+            if len(filez) == 0:
+                all_roasts = []
+                break
+
+            # pick the series first, so only those have to be read in
+            desired_data = get_desired_data(available_data)
 
-            # read in all the data from those files
-            all_roasts = read_in_data(filez)
+            # read in all the data from those files (the ones that aren't json get reported and skipped)
+            all_roasts = read_in_data(filez, desired_data)
+
+            # past roasts that went the same way, to graph along with it
+            if len(all_roasts) == 1 and raw_input('Add the most similar past roasts?  [y/N]  ') in ['Y','y']:
+                all_roasts += similar_roasts(filez[0], desired_data)
             break
             
         except ValueError:
@@ -176,21 +264,15 @@ def main():
 
     # as long as you actually picked some files, proceed.
     if len(all_roasts)>0:
-        available_data = ['temp_actual', 'temp_smooth', 'upper_bound','lower_bound', 'target_temp']            # more could go here but i need error handling for the files that don't have keys with these legend_names
-
-        desired_data = get_desired_data(available_data)
 
 
         if raw_input('Export to CSV?  [y/N]  ') in ['Y','y']:
-            # ideally, you'd be passing in save location and filenames could be inferred from the roast dictionary
-            # and then just notify the user of hte location (like how roast.py chooses the filename with a default save path) 
-            for roast in all_roasts:
-                t = generate_title(roast)
-                try:
-                    dict2csv(roast, title=t, only_export=desired_data, subscript1="_sec", subscript2="_val")
-                except IOError:
-                    # likely the user canceled the save location window
-                    print "Invalid location. Canceling"
+            # pick the save location once, every roast goes there (named after its filename)
+            pth = tk_ui_for_path()
+            written, errors = export_roasts(all_roasts, pth, desired_data, workers=LOAD_WORKERS)
+            for full_filename, error in errors:
+                print "couldn't export %s: %s" % (full_filename, error)
+            print "exported %i roasts to %s\n" % (len(written), pth)
 
 
 
@@ -203,4 +285,6 @@ def main():
         print "why would you come here if you didn't want to see any roasts?\n"
 
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    # the guard matters now that the files are loaded by worker processes
+    main()
\ No newline at end of file